@@ -0,0 +1,90 @@
+# Файл: async_db.py
+
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from PyQt6 import sip
+from PyQt6.QtCore import QObject, Qt, pyqtSignal
+
+# --- Параметры фоновых запросов ---
+ASYNC_WORKERS = 2   # Потоков для чтения: долгий экспорт не задерживает поиск
+
+
+class AsyncDatabase(QObject):
+    """
+    Асинхронный фасад над DatabaseManager.
+    Запросы выполняются в пуле рабочих потоков (читатели пула соединений
+    работают параллельно), результат возвращается как Future и, если
+    переданы обработчики, доставляется в GUI-поток через сигнал Qt.
+    Так долгие чтения (полное дерево, поиск, теги, сбор данных для экспорта)
+    не останавливают цикл событий и анимации окон.
+    """
+    _completed = pyqtSignal(object)  # Завершенный Future (испускается из рабочего потока)
+
+    def __init__(self, db, parent=None, workers=ASYNC_WORKERS):
+        super().__init__(parent)
+        self.db = db
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="db-async")
+        self._handlers = {}  # Future -> (on_result, on_error, owner, key)
+        self._latest = {}    # key -> последний Future с этим ключом
+        self._pending = set()
+        # Доставка всегда через очередь событий: обработчик не вызывается внутри call()
+        self._completed.connect(self._deliver, Qt.ConnectionType.QueuedConnection)
+
+    def submit(self, method, *args, **kwargs):
+        """
+        Ставит запрос в очередь и возвращает concurrent.futures.Future.
+        method - имя метода DatabaseManager или функция, которая сама
+        обращается к БД (для составных запросов).
+        """
+        func = getattr(self.db, method) if isinstance(method, str) else method
+        future = self._executor.submit(func, *args, **kwargs)
+        self._pending.add(future)
+        future.add_done_callback(self._pending.discard)
+        return future
+
+    def call(self, method, *args, on_result=None, on_error=None, owner=None, key=None, **kwargs):
+        """
+        Как submit(), но результат передается в on_result(result) в GUI-потоке,
+        а ошибка - в on_error(message).
+        owner - виджет-получатель: если он уже удален, обработчик не вызывается.
+        key - ключ "последнего запроса": результат устаревшего запроса с тем же
+        ключом отбрасывается (например, поиск при быстром наборе текста).
+        """
+        future = self.submit(method, *args, **kwargs)
+        self._handlers[future] = (on_result, on_error, owner, key)
+        if key is not None:
+            self._latest[key] = future
+        future.add_done_callback(self._completed.emit)
+        return future
+
+    def _deliver(self, future):
+        on_result, on_error, owner, key = self._handlers.pop(future, (None, None, None, None))
+        if key is not None:
+            if self._latest.get(key) is not future:
+                return
+            del self._latest[key]
+        if future.cancelled() or (owner is not None and sip.isdeleted(owner)):
+            return
+        error = future.exception()
+        if error is not None:
+            if on_error:
+                on_error(str(error))
+            else:
+                print(f"Ошибка фонового запроса к БД: {error}")
+            return
+        if on_result:
+            on_result(future.result())
+
+    def cancel(self, key):
+        """Отбрасывает результат последнего запроса с ключом key (сам запрос доработает)."""
+        self._latest.pop(key, None)
+
+    def wait(self):
+        """Дожидается всех поставленных запросов (например, перед заменой базы)."""
+        wait(list(self._pending))
+
+    def shutdown(self):
+        """Отменяет ожидающие запросы и дожидается выполняющихся (перед закрытием БД)."""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._handlers.clear()
+        self._latest.clear()
@@ -0,0 +1,222 @@
+# Файл: backup_store.py
+
+import os
+import json
+import zlib
+import hashlib
+from datetime import datetime
+
+# --- Параметры хранилища резервных копий ---
+# Бэкап SQLite, снятый через backup API, сохраняет страницы на тех же
+# смещениях, поэтому достаточно резать файл на блоки фиксированного
+# размера (кратного странице): неизмененные блоки совпадают байт в байт.
+CHUNK_SIZE = 64 * 1024              # Размер блока (16 страниц по 4 КиБ)
+CHUNK_COMPRESS_LEVEL = 6
+MANIFEST_VERSION = 1
+SNAPSHOT_PREFIX = "assistant_"
+
+
+class BackupStore:
+    """
+    Хранилище резервных копий с дедупликацией.
+    Каждый снимок базы режется на блоки; блок сжимается и хранится один раз
+    под именем своего SHA-256 (chunks/ab/abcd...). Снимок - это небольшой
+    манифест (snapshots/<имя>.json) со списком хешей блоков, поэтому сотня
+    почти одинаковых снимков занимает немногим больше одного.
+    """
+
+    def __init__(self, root, chunk_size=CHUNK_SIZE):
+        self.root = root
+        self.chunk_size = chunk_size
+        self.chunks_dir = os.path.join(root, "chunks")
+        self.snapshots_dir = os.path.join(root, "snapshots")
+
+    # --- Пути ---
+
+    def _chunk_path(self, digest):
+        return os.path.join(self.chunks_dir, digest[:2], digest)
+
+    def manifest_path(self, name):
+        return os.path.join(self.snapshots_dir, f"{name}.json")
+
+    @staticmethod
+    def _write_atomic(path, data):
+        """Пишет файл целиком или никак: через временный файл и переименование."""
+        temp_path = path + ".part"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    # --- Снимки ---
+
+    def _store_file(self, source_path):
+        """
+        Режет файл на блоки и дописывает в хранилище недостающие.
+        Возвращает (описание файла {'size', 'sha256', 'chunks'}, новых блоков, новых байт).
+        """
+        digests = []
+        file_hash = hashlib.sha256()
+        size = new_chunks = new_bytes = 0
+        with open(source_path, 'rb') as f:
+            while chunk := f.read(self.chunk_size):
+                file_hash.update(chunk)
+                size += len(chunk)
+                digest = hashlib.sha256(chunk).hexdigest()
+                digests.append(digest)
+                chunk_path = self._chunk_path(digest)
+                if not os.path.exists(chunk_path):
+                    os.makedirs(os.path.dirname(chunk_path), exist_ok=True)
+                    packed = zlib.compress(chunk, CHUNK_COMPRESS_LEVEL)
+                    self._write_atomic(chunk_path, packed)
+                    new_chunks += 1
+                    new_bytes += len(packed)
+        return {"size": size, "sha256": file_hash.hexdigest(), "chunks": digests}, new_chunks, new_bytes
+
+    def _assemble_file(self, entry, target_path, name):
+        """Собирает файл из блоков описания entry и проверяет его контрольную сумму."""
+        file_hash = hashlib.sha256()
+        temp_path = target_path + ".part"
+        with open(temp_path, 'wb') as out:
+            for digest in entry["chunks"]:
+                with open(self._chunk_path(digest), 'rb') as f:
+                    chunk = zlib.decompress(f.read())
+                file_hash.update(chunk)
+                out.write(chunk)
+        if file_hash.hexdigest() != entry["sha256"]:
+            os.remove(temp_path)
+            raise ValueError(f"Снимок {name} поврежден: контрольная сумма не совпадает")
+        os.replace(temp_path, target_path)
+
+    def add_snapshot(self, source_path, name=None, attachments=None):
+        """
+        Добавляет файл базы как новый снимок.
+        attachments - {имя: путь} дополнительных файлов снимка (например,
+        архива): их блоки хранятся в том же общем хранилище, поэтому
+        неизменный файл почти ничего не добавляет.
+        Возвращает манифест с полями new_chunks/new_bytes - сколько блоков
+        и байт реально пришлось дописать.
+        """
+        if name is None:
+            name = SNAPSHOT_PREFIX + datetime.now().strftime("%Y%m%d_%H%M%S")
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+
+        entry, new_chunks, new_bytes = self._store_file(source_path)
+        attached = {}
+        for attachment_name, attachment_path in (attachments or {}).items():
+            attached[attachment_name], chunks, written = self._store_file(attachment_path)
+            new_chunks += chunks
+            new_bytes += written
+
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "name": name,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "chunk_size": self.chunk_size,
+            **entry,
+        }
+        if attached:
+            manifest["attachments"] = attached
+        # Манифест пишется последним: снимок появляется, только когда все блоки на месте
+        self._write_atomic(self.manifest_path(name), json.dumps(manifest).encode('utf-8'))
+        manifest["new_chunks"] = new_chunks
+        manifest["new_bytes"] = new_bytes
+        return manifest
+
+    def load_manifest(self, name):
+        with open(self.manifest_path(name), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def list_snapshots(self):
+        """Возвращает снимки от новых к старым: [{'name', 'path', 'created', 'size'}]."""
+        if not os.path.isdir(self.snapshots_dir):
+            return []
+        snapshots = []
+        for file_name in os.listdir(self.snapshots_dir):
+            if not file_name.endswith(".json"):
+                continue
+            name = file_name[:-len(".json")]
+            try:
+                manifest = self.load_manifest(name)
+            except (OSError, ValueError) as e:
+                print(f"Поврежденный манифест бэкапа {file_name}: {e}")
+                continue
+            snapshots.append({
+                'name': name,
+                'path': self.manifest_path(name),
+                'created': manifest.get("created"),
+                'size': manifest.get("size", 0),
+            })
+        snapshots.sort(key=lambda s: s['name'], reverse=True)
+        return snapshots
+
+    def restore_snapshot(self, name, target_path, attachments=None):
+        """
+        Собирает файл базы из блоков снимка и проверяет его контрольную сумму.
+        attachments - {имя: путь назначения} для дополнительных файлов снимка.
+        Возвращает {имя: путь} тех из них, что были в снимке.
+        """
+        manifest = self.load_manifest(name)
+        self._assemble_file(manifest, target_path, name)
+        restored = {}
+        for attachment_name, attachment_path in (attachments or {}).items():
+            if entry := manifest.get("attachments", {}).get(attachment_name):
+                self._assemble_file(entry, attachment_path, name)
+                restored[attachment_name] = attachment_path
+        return restored
+
+    def delete_snapshot(self, name):
+        """Удаляет манифест снимка; блоки освобождает collect_garbage()."""
+        os.remove(self.manifest_path(name))
+
+    def prune(self, max_count):
+        """Оставляет max_count новейших снимков и удаляет ненужные блоки."""
+        removed = []
+        for snapshot in self.list_snapshots()[max_count:]:
+            self.delete_snapshot(snapshot['name'])
+            removed.append(snapshot['name'])
+        if removed:
+            self.collect_garbage()
+        return removed
+
+    def collect_garbage(self):
+        """
+        Удаляет блоки, на которые не ссылается ни один манифест.
+        Возвращает (удалено блоков, освобождено байт).
+        """
+        referenced = set()
+        for snapshot in self.list_snapshots():
+            manifest = self.load_manifest(snapshot['name'])
+            referenced.update(manifest["chunks"])
+            for entry in manifest.get("attachments", {}).values():
+                referenced.update(entry["chunks"])
+
+        removed = freed = 0
+        if not os.path.isdir(self.chunks_dir):
+            return removed, freed
+        for prefix in os.listdir(self.chunks_dir):
+            prefix_dir = os.path.join(self.chunks_dir, prefix)
+            for digest in os.listdir(prefix_dir):
+                if digest in referenced:
+                    continue
+                chunk_path = os.path.join(prefix_dir, digest)
+                freed += os.path.getsize(chunk_path)
+                os.remove(chunk_path)
+                removed += 1
+        return removed, freed
+
+    def stats(self):
+        """Возвращает {'snapshots', 'logical_bytes', 'chunks', 'stored_bytes'}."""
+        snapshots = self.list_snapshots()
+        chunks = stored = 0
+        if os.path.isdir(self.chunks_dir):
+            for prefix in os.listdir(self.chunks_dir):
+                prefix_dir = os.path.join(self.chunks_dir, prefix)
+                for digest in os.listdir(prefix_dir):
+                    chunks += 1
+                    stored += os.path.getsize(os.path.join(prefix_dir, digest))
+        return {
+            'snapshots': len(snapshots),
+            'logical_bytes': sum(s['size'] for s in snapshots),
+            'chunks': chunks,
+            'stored_bytes': stored,
+        }
@@ -0,0 +1,16 @@
+# Файл: benchmarks/__init__.py
+"""
+Замеры производительности DatabaseManager на синтетических хранилищах.
+Запуск из корня проекта (Qt не нужен):
+
+    python -m benchmarks --notes 1000 10000 100000 --output bench.json
+    python -m benchmarks --notes 10000 --compare bench.json
+"""
+
+from .vault import VaultSpec, VaultGenerator
+from .runner import BenchmarkRunner, SCENARIOS, run_benchmarks, save_report, load_report, compare_reports
+
+__all__ = [
+    'VaultSpec', 'VaultGenerator',
+    'BenchmarkRunner', 'SCENARIOS', 'run_benchmarks', 'save_report', 'load_report', 'compare_reports',
+]
@@ -0,0 +1,55 @@
+# Файл: benchmarks/__main__.py
+
+import sys
+import argparse
+
+from .vault import (DEFAULT_DEPTH, DEFAULT_BODY_MEDIAN, DEFAULT_BODY_SIGMA, DEFAULT_BODY_MAX,
+                    DEFAULT_TAG_DENSITY, DEFAULT_TAG_VOCABULARY, DEFAULT_TASK_LISTS, DEFAULT_TASKS_PER_LIST)
+from .runner import (DEFAULT_REPEAT, SCENARIOS, run_benchmarks, save_report, load_report,
+                     compare_reports, print_comparison)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Замеры DatabaseManager")
+    parser.add_argument("--notes", type=int, nargs="+", default=[1000, 10000], help="размеры хранилищ (до 100000)")
+    parser.add_argument("--folders", type=int, default=None, help="число папок (по умолчанию 5%% от заметок)")
+    parser.add_argument("--depth", type=int, default=DEFAULT_DEPTH, help="максимальная вложенность папок")
+    parser.add_argument("--body-median", type=int, default=DEFAULT_BODY_MEDIAN, help="медианный размер текста")
+    parser.add_argument("--body-sigma", type=float, default=DEFAULT_BODY_SIGMA, help="разброс размеров текстов")
+    parser.add_argument("--body-max", type=int, default=DEFAULT_BODY_MAX, help="максимальный размер текста")
+    parser.add_argument("--tag-density", type=float, default=DEFAULT_TAG_DENSITY, help="среднее число тегов в заметке")
+    parser.add_argument("--tag-vocabulary", type=int, default=DEFAULT_TAG_VOCABULARY, help="число разных тегов")
+    parser.add_argument("--task-lists", type=int, default=DEFAULT_TASK_LISTS)
+    parser.add_argument("--tasks-per-list", type=int, default=DEFAULT_TASKS_PER_LIST)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="повторов каждого замера")
+    parser.add_argument("--only", nargs="+", choices=SCENARIOS, help="запустить только эти сценарии")
+    parser.add_argument("--workdir", help="каталог для баз (по умолчанию временный)")
+    parser.add_argument("--keep", action="store_true", help="не удалять сгенерированные базы")
+    parser.add_argument("--output", default="benchmark_results.json", help="куда записать отчет JSON")
+    parser.add_argument("--compare", help="отчет JSON предыдущей версии для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.2, help="доля замедления, считающаяся регрессией")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_benchmarks(
+        args.notes, repeat=args.repeat, workdir=args.workdir, keep=args.keep, only=args.only,
+        folders=args.folders, depth=args.depth, body_median=args.body_median, body_sigma=args.body_sigma,
+        body_max=args.body_max, tag_density=args.tag_density, tag_vocabulary=args.tag_vocabulary,
+        task_lists=args.task_lists, tasks_per_list=args.tasks_per_list, seed=args.seed,
+    )
+    save_report(report, args.output)
+    print(f"Отчет сохранен: {args.output}")
+
+    if args.compare:
+        rows = compare_reports(load_report(args.compare), report, args.threshold)
+        print_comparison(rows)
+        # Ненулевой код выхода позволяет использовать сравнение как проверку в CI
+        return 1 if any(row['regression'] for row in rows) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,286 @@
+# Файл: benchmarks/runner.py
+
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import platform
+import tempfile
+import statistics
+from datetime import datetime
+
+from database import DatabaseManager
+from backup_store import BackupStore
+from .vault import VaultSpec, VaultGenerator
+
+# --- Параметры замеров ---
+DEFAULT_REPEAT = 5          # Повторов каждого замера (в отчет идут min/median/max)
+WRITE_SAMPLES = 50          # Сколько заметок создается / сохраняется за один повтор
+SEARCH_LIMIT = 200          # Лимит выдачи поиска, как в окне фильтра
+RESULTS_VERSION = 1
+
+
+def _summary(samples, rows=None):
+    """Сводка по замерам в миллисекундах."""
+    summary = {
+        'runs': len(samples),
+        'min_ms': round(min(samples) * 1000, 3),
+        'median_ms': round(statistics.median(samples) * 1000, 3),
+        'mean_ms': round(statistics.fmean(samples) * 1000, 3),
+        'max_ms': round(max(samples) * 1000, 3),
+    }
+    if rows is not None:
+        summary['rows'] = rows
+    return summary
+
+
+def _count(result):
+    """Сколько строк вернул метод (для деревьев - сколько элементов во всех уровнях)."""
+    if isinstance(result, list):
+        return sum(1 + _count(item.get('children', [])) if isinstance(item, dict) else 1 for item in result)
+    return None
+
+
+# Порядок сценариев: сначала чтения на свежесгенерированной базе, затем записи и бэкап
+SCENARIOS = (
+    'get_note_tree', 'get_full_note_tree', 'get_all_tags',
+    'search_frequent_word', 'search_rare_word', 'search_prefix', 'search_tag', 'search_text_and_tag',
+    'create_note', 'update_note_content', 'update_tasks_order',
+    'backup', 'backup_snapshot',
+)
+
+
+class BenchmarkRunner:
+    """
+    Прогоняет замеры публичных методов DatabaseManager на синтетическом хранилище.
+    Каждый сценарий - метод bench_*: возвращает список длительностей в секундах
+    и, если есть, число строк результата. Qt не нужен, поэтому набор запускается
+    без графической среды (например, в CI) и сравнивается между версиями по JSON.
+    """
+
+    def __init__(self, spec, workdir, repeat=DEFAULT_REPEAT, progress=print):
+        self.spec = spec
+        self.workdir = workdir
+        self.repeat = repeat
+        self.progress = progress
+        self.generator = VaultGenerator(spec)
+        self.db = None
+
+    def _time(self, func, *args, **kwargs):
+        """Запускает func repeat раз; возвращает (длительности, результат последнего вызова)."""
+        samples = []
+        result = None
+        for _ in range(self.repeat):
+            started = time.perf_counter()
+            result = func(*args, **kwargs)
+            samples.append(time.perf_counter() - started)
+        return samples, result
+
+    # --- Сценарии ---
+
+    def bench_get_note_tree(self):
+        samples, tree = self._time(self.db.get_note_tree)
+        return samples, _count(tree)
+
+    def bench_get_full_note_tree(self):
+        samples, tree = self._time(self.db.get_full_note_tree)
+        return samples, _count(tree)
+
+    def bench_get_all_tags(self):
+        samples, tags = self._time(self.db.get_all_tags)
+        return samples, len(tags)
+
+    def bench_search_frequent_word(self):
+        word = self.generator.sample_words(1, frequent=True)[0]
+        samples, found = self._time(self.db.search_notes, word, limit=SEARCH_LIMIT)
+        return samples, len(found)
+
+    def bench_search_rare_word(self):
+        word = self.generator.sample_words(1, frequent=False)[0]
+        samples, found = self._time(self.db.search_notes, word, limit=SEARCH_LIMIT)
+        return samples, len(found)
+
+    def bench_search_prefix(self):
+        word = self.generator.sample_words(1, frequent=True)[0]
+        samples, found = self._time(self.db.search_notes, word[:2], limit=SEARCH_LIMIT)
+        return samples, len(found)
+
+    def bench_search_tag(self):
+        samples, found = self._time(self.db.search_notes, "", tag=self.generator.tags[0])
+        return samples, len(found)
+
+    def bench_search_text_and_tag(self):
+        word = self.generator.sample_words(1, frequent=True)[0]
+        samples, found = self._time(self.db.search_notes, word, tag=self.generator.tags[0], limit=SEARCH_LIMIT)
+        return samples, len(found)
+
+    def bench_create_note(self):
+        """WRITE_SAMPLES новых заметок в корне; время - на одну заметку."""
+        def create():
+            for index in range(WRITE_SAMPLES):
+                self.db.create_note(None, f"Новая заметка {index}", self.generator.make_body(self.spec.body_median))
+        samples, _ = self._time(create)
+        return [sample / WRITE_SAMPLES for sample in samples], None
+
+    def bench_update_note_content(self):
+        """
+        Сохранение WRITE_SAMPLES заметок с дозаписью очереди (flush): время
+        на одну заметку, включая фактическую запись в БД.
+        """
+        note_ids = [row['id'] for row in self.db.get_all_notes_for_refresh()[:WRITE_SAMPLES]]
+
+        def update():
+            for note_id in note_ids:
+                self.db.update_note_content(note_id, None, self.generator.make_body(self.generator.body_size()))
+            self.db.flush()
+        samples, _ = self._time(update)
+        return [sample / max(1, len(note_ids)) for sample in samples], None
+
+    def bench_update_tasks_order(self):
+        # Самый длинный список (кроме сгенерированных есть и список по умолчанию)
+        tasks_by_list = {task_list['id']: [task['id'] for task in self.db.get_tasks_for_list(task_list['id'])]
+                         for task_list in self.db.get_all_task_lists()}
+        list_id = max(tasks_by_list, key=lambda key: len(tasks_by_list[key]), default=None)
+        if list_id is None:
+            return [], None
+        task_ids = tasks_by_list[list_id]
+
+        def reorder():
+            task_ids.reverse()
+            self.db.update_tasks_order(list_id, task_ids)
+        samples, _ = self._time(reorder)
+        return samples, len(task_ids)
+
+    def bench_backup(self):
+        """Полная копия базы через backup API."""
+        target = os.path.join(self.workdir, "backup.db")
+        samples, _ = self._time(self.db.backup_to, target)
+        return samples, os.path.getsize(target)
+
+    def bench_backup_snapshot(self):
+        """Копия плюс снимок в хранилище с дедупликацией (как автоматический бэкап)."""
+        store = BackupStore(os.path.join(self.workdir, "backups"))
+        target = os.path.join(self.workdir, "snapshot.db")
+        names = iter(range(self.repeat))
+
+        def snapshot():
+            self.db.backup_to(target)
+            return store.add_snapshot(target, name=f"bench_{next(names)}")
+        samples, manifest = self._time(snapshot)
+        return samples, manifest['new_bytes']
+
+
+    # --- Запуск ---
+
+    def run(self, only=None):
+        """
+        Создает базу в workdir, наполняет ее и прогоняет сценарии
+        (only - список имен сценариев или None для всех).
+        Возвращает {'spec', 'vault', 'generate_s', 'results'}.
+        """
+        os.makedirs(self.workdir, exist_ok=True)
+        db_path = os.path.join(self.workdir, "assistant.db")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+
+        self.db = DatabaseManager(db_path)
+        try:
+            self.progress(f"Генерация хранилища: {self.spec.notes} заметок, {self.spec.folders} папок...")
+            started = time.perf_counter()
+            vault = self.generator.populate(self.db)
+            generate_s = round(time.perf_counter() - started, 3)
+
+            results = {}
+            for name in SCENARIOS:
+                if only and name not in only:
+                    continue
+                samples, rows = getattr(self, f"bench_{name}")()
+                if samples:
+                    results[name] = _summary(samples, rows)
+                    self.progress(f"  {name}: {results[name]['median_ms']} мс")
+        finally:
+            self.db.close()
+            self.db = None
+
+        return {'spec': self.spec.as_dict(), 'vault': vault, 'generate_s': generate_s, 'results': results}
+
+
+def environment():
+    """Сведения об окружении для отчета: версии Python и SQLite, платформа."""
+    return {
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+    }
+
+
+def run_benchmarks(sizes, repeat=DEFAULT_REPEAT, workdir=None, keep=False, only=None, progress=print, **spec_options):
+    """
+    Прогоняет набор для каждого размера хранилища из sizes (число заметок).
+    spec_options передаются в VaultSpec (depth, body_median, tag_density, ...).
+    Возвращает отчет, готовый к записи в JSON.
+    """
+    base_dir = workdir or tempfile.mkdtemp(prefix="assistant_bench_")
+    runs = []
+    try:
+        for notes in sizes:
+            spec = VaultSpec(notes, **spec_options)
+            runner = BenchmarkRunner(spec, os.path.join(base_dir, f"vault_{notes}"), repeat, progress)
+            runs.append(runner.run(only))
+    finally:
+        if not keep:
+            shutil.rmtree(base_dir, ignore_errors=True)
+    return {
+        'version': RESULTS_VERSION,
+        'created': datetime.now().isoformat(timespec="seconds"),
+        'environment': environment(),
+        'repeat': repeat,
+        'runs': runs,
+    }
+
+
+def save_report(report, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+def load_report(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare_reports(baseline, current, threshold=0.2):
+    """
+    Сравнивает медианы двух отчетов по совпадающим размерам и сценариям.
+    Возвращает список {'notes', 'scenario', 'baseline_ms', 'current_ms',
+    'ratio', 'regression'}; regression - замедление больше threshold.
+    """
+    baseline_runs = {run['spec']['notes']: run['results'] for run in baseline['runs']}
+    rows = []
+    for run in current['runs']:
+        notes = run['spec']['notes']
+        for scenario, result in run['results'].items():
+            old = baseline_runs.get(notes, {}).get(scenario)
+            if not old or not old['median_ms']:
+                continue
+            ratio = result['median_ms'] / old['median_ms']
+            rows.append({
+                'notes': notes,
+                'scenario': scenario,
+                'baseline_ms': old['median_ms'],
+                'current_ms': result['median_ms'],
+                'ratio': round(ratio, 3),
+                'regression': ratio > 1 + threshold,
+            })
+    return rows
+
+
+def print_comparison(rows, stream=sys.stdout):
+    for row in rows:
+        mark = "  <-- медленнее" if row['regression'] else ""
+        print(f"{row['notes']:>7} {row['scenario']:<24} {row['baseline_ms']:>10.3f} -> "
+              f"{row['current_ms']:>10.3f} мс  x{row['ratio']:.2f}{mark}", file=stream)
@@ -0,0 +1,145 @@
+# Файл: benchmarks/vault.py
+
+import os
+import math
+import random
+from itertools import accumulate
+
+# --- Параметры синтетического хранилища по умолчанию ---
+DEFAULT_FOLDER_RATIO = 0.05     # Папок на одну заметку
+DEFAULT_DEPTH = 4               # Максимальная глубина вложенности папок
+DEFAULT_BODY_MEDIAN = 1500      # Медианный размер текста заметки, символов
+DEFAULT_BODY_SIGMA = 1.0        # Разброс логнормального распределения размеров
+DEFAULT_BODY_MAX = 200_000      # Верхняя граница размера текста
+DEFAULT_TAG_DENSITY = 1.5       # Среднее число тегов в заметке
+DEFAULT_TAG_VOCABULARY = 300    # Сколько разных тегов во всем хранилище
+DEFAULT_TASK_LISTS = 20
+DEFAULT_TASKS_PER_LIST = 50
+WORD_VOCABULARY = 5000          # Словарь псевдослов для текстов (для полнотекстового поиска)
+MAX_NOTES = 100_000
+
+
+class VaultSpec:
+    """
+    Описание синтетического хранилища: сколько заметок и папок, насколько
+    глубокое дерево, какие размеры текстов, сколько тегов и списков задач.
+    Генерация детерминирована: одинаковые параметры и seed дают одинаковую базу,
+    поэтому замеры разных версий кода можно сравнивать между собой.
+    """
+
+    def __init__(self, notes, folders=None, depth=DEFAULT_DEPTH,
+                 body_median=DEFAULT_BODY_MEDIAN, body_sigma=DEFAULT_BODY_SIGMA, body_max=DEFAULT_BODY_MAX,
+                 tag_density=DEFAULT_TAG_DENSITY, tag_vocabulary=DEFAULT_TAG_VOCABULARY,
+                 task_lists=DEFAULT_TASK_LISTS, tasks_per_list=DEFAULT_TASKS_PER_LIST, seed=0):
+        if not 0 < notes <= MAX_NOTES:
+            raise ValueError(f"Число заметок должно быть от 1 до {MAX_NOTES}")
+        self.notes = notes
+        self.folders = max(1, round(notes * DEFAULT_FOLDER_RATIO)) if folders is None else folders
+        self.depth = max(1, depth)
+        self.body_median = body_median
+        self.body_sigma = body_sigma
+        self.body_max = body_max
+        self.tag_density = tag_density
+        self.tag_vocabulary = max(1, tag_vocabulary)
+        self.task_lists = task_lists
+        self.tasks_per_list = tasks_per_list
+        self.seed = seed
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+class VaultGenerator:
+    """
+    Наполняет DatabaseManager синтетическими данными по VaultSpec.
+    Заметки и папки вставляются одним потоком через bulk_import (как при
+    импорте из Obsidian), задачи - через обычные методы списков задач.
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.random = random.Random(spec.seed)
+        self.words = [self._make_word() for _ in range(WORD_VOCABULARY)]
+        # Слова выбираются по закону Ципфа: частые встречаются почти везде, редкие - в единицах заметок
+        self.word_weights = list(accumulate(1.0 / rank for rank in range(1, WORD_VOCABULARY + 1)))
+        self.tags = [f"tag{index}" for index in range(spec.tag_vocabulary)]
+
+    def _make_word(self):
+        letters = "abcdefghijklmnopqrstuvwxyz"
+        return "".join(self.random.choice(letters) for _ in range(self.random.randint(3, 10)))
+
+    # --- Тексты ---
+
+    def body_size(self):
+        """Размер текста: логнормальное распределение - много коротких заметок и немного очень длинных."""
+        size = self.random.lognormvariate(math.log(self.spec.body_median), self.spec.body_sigma)
+        return max(1, min(int(size), self.spec.body_max))
+
+    def _tag_count(self):
+        """Число тегов заметки: пуассоновское распределение со средним tag_density."""
+        limit, count, product = math.exp(-self.spec.tag_density), 0, self.random.random()
+        while product > limit:
+            count += 1
+            product *= self.random.random()
+        return count
+
+    def make_body(self, size):
+        words = self.random.choices(self.words, cum_weights=self.word_weights, k=max(1, size // 7))
+        lines = [" ".join(words[start:start + 12]) for start in range(0, len(words), 12)]
+        tags = self.random.sample(self.tags, min(self._tag_count(), len(self.tags)))
+        if tags:
+            lines.append(" ".join(f"#{tag}" for tag in tags))
+        return "\n".join(lines)
+
+    # --- Дерево ---
+
+    def records(self):
+        """
+        Записи для DatabaseManager.bulk_import: сначала все папки (родитель
+        выбирается среди уже созданных папок не глубже depth), затем заметки,
+        разложенные по папкам и по корню.
+        """
+        levels = {None: 0}
+        folder_keys = []
+        for index in range(self.spec.folders):
+            candidates = [key for key in folder_keys[-200:] if levels[key] < self.spec.depth]
+            parent_key = self.random.choice(candidates + [None]) if candidates else None
+            key = f"folder{index}"
+            levels[key] = levels[parent_key] + 1
+            folder_keys.append(key)
+            yield {'type': 'folder', 'key': key, 'parent_key': parent_key, 'title': f"Папка {index}"}
+
+        targets = folder_keys + [None]
+        for index in range(self.spec.notes):
+            yield {
+                'type': 'note',
+                'parent_key': self.random.choice(targets),
+                'title': f"Заметка {index} {self.random.choice(self.words)}",
+                'content': self.make_body(self.body_size()),
+            }
+
+    def populate(self, db, progress=None):
+        """
+        Заполняет базу. Возвращает сводку {'notes', 'folders', 'task_lists',
+        'tasks', 'file_bytes'}.
+        """
+        notes, folders = db.bulk_import(self.records(), progress=progress)
+        tasks = 0
+        for list_index in range(self.spec.task_lists):
+            list_id = db.add_task_list(f"Список {list_index}")
+            for task_index in range(self.spec.tasks_per_list):
+                db.add_task(list_id, f"Задача {task_index} {self.random.choice(self.words)}")
+                tasks += 1
+        db.flush()
+        return {
+            'notes': notes,
+            'folders': folders,
+            'task_lists': self.spec.task_lists,
+            'tasks': tasks,
+            'file_bytes': os.path.getsize(db.db_path),
+        }
+
+    def sample_words(self, count, frequent=True):
+        """Слова для поисковых запросов: частые (из начала словаря) или редкие."""
+        pool = self.words[:50] if frequent else self.words[-1000:]
+        return self.random.sample(pool, count)
@@ -3,9 +3,26 @@
 import sqlite3
 import os
 import sys
+import queue
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 import re
 import hashlib
+import zlib
+import lzma
+import json
+import difflib
+from collections import OrderedDict
+
+from query_profiler import QueryProfiler, SLOW_QUERY_MS
+
+try:
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    from cryptography.exceptions import InvalidTag
+except ImportError:  # Без пакета cryptography шифрование заметок недоступно
+    AESGCM = None
+    InvalidTag = ValueError
 
 # --- Определение пути к базе данных ---
 if getattr(sys, 'frozen', False):
@@ -14,396 +31,2836 @@ else:
     BASE_PATH = os.path.dirname(os.path.abspath(__file__))
 DB_FILE = os.path.join(BASE_PATH, "assistant.db")
 
+# --- Параметры пула соединений ---
+READER_POOL_SIZE = 3                # Сколько читающих соединений держим открытыми
+STATEMENT_CACHE_SIZE = 256          # Размер кэша подготовленных выражений на соединение
+PAGE_CACHE_KIB = 16 * 1024          # Размер кэша страниц (в КиБ) на соединение
+MMAP_SIZE = 256 * 1024 * 1024       # Сколько байт файла БД отображать в память
+BUSY_TIMEOUT_MS = 5000
+
+# --- Параметры отложенной записи ---
+WRITE_BATCH_SIZE = 200              # Сколько сохранений заметок писать за одну транзакцию
+WRITE_RETRY_DELAY_SEC = 5           # Пауза перед повтором сохранений, запись которых не удалась
+
+# --- Обслуживание базы ---
+ANALYSIS_LIMIT = 1000               # Сколько строк индекса просматривает ANALYZE (приблизительная статистика)
+
+# --- Холодный архив ---
+ARCHIVE_FILE_NAME = "archive.db"    # Файл архива рядом с основной базой (подключается по требованию)
+
+# --- Параметры резервного копирования ---
+BACKUP_STEP_PAGES = 256             # Сколько страниц копировать за один шаг backup API
+
+# --- Потоковое чтение ---
+ITER_BATCH_SIZE = 200               # Сколько строк забирать из курсора за раз (fetchmany)
+# Поля, которые можно запросить у iter_notes/iter_subtree, и их SQL-выражения
+NOTE_FIELDS = {
+    'id': "n.id",
+    'parent_id': "n.parent_id",
+    'type': "n.type",
+    'title': "n.title",
+    'content': "note_text(n.content, n.content_blob, n.content_codec) AS content",
+    'is_pinned': "n.is_pinned",
+    'is_hidden': "n.is_hidden",
+    'created_at': "n.created_at",
+    'updated_at': "n.updated_at",
+}
+
+# Элемент (или все корневые элементы) и все потомки с глубиной; {start} - условие на корень
+SUBTREE_CTE = """
+    WITH RECURSIVE subtree(id, depth) AS (
+        SELECT id, 0 FROM notes WHERE {start}
+        UNION ALL
+        SELECT c.id, s.depth + 1 FROM notes c JOIN subtree s ON c.parent_id = s.id
+    )
+"""
+
+# Порядок элементов дерева: закрепленные, затем папки, затем заметки; внутри -
+# ручной порядок (order_key) и название. Тот же порядок у индекса idx_notes_children.
+NOTE_ORDER_SQL = "n.is_pinned DESC, n.type, n.order_key, n.title COLLATE NOCASE"
+
+# --- Параметры массового импорта ---
+IMPORT_BATCH_SIZE = 5000            # Сколько записей вставлять за одну транзакцию
+
+TAG_PATTERN = re.compile(r'#(\w+)')
+
+# --- Ключи порядка задач ---
+# Порядок задач и списков задается строками, которые сравниваются побайтно:
+# между любыми двумя ключами всегда найдется третий, поэтому перемещение
+# меняет только одну строку. Ключ никогда не оканчивается на первую цифру.
+ORDER_KEY_DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+ORDER_KEY_REBALANCE_LENGTH = 12     # Длина ключа, после которой список перенумеровывается
+
+# --- Сжатие больших заметок ---
+# Текст длиннее порога хранится сжатым в notes.content_blob, а notes.content
+# остается пустым; content_codec помечает способ сжатия.
+COMPRESS_MIN_BYTES = 8 * 1024       # Заметки меньше этого размера не сжимаем
+COMPRESS_MAX_RATIO = 0.9            # Сжимаем, только если выигрыш больше 10%
+NOTE_CODEC = "zlib"                 # "zlib" (быстро) или "lzma" (плотнее, медленнее)
+ZLIB_LEVEL = 6
+
+# --- История версий заметок ---
+REVISION_MIN_INTERVAL_SEC = 300     # Не чаще одной версии заметки за этот интервал
+REVISION_SNAPSHOT_EVERY = 20        # Каждая N-я версия хранится целиком, остальные - разницей
+REVISION_KEEP_DAYS = 90             # Версии старше этого срока удаляются
+REVISION_MAX_PER_NOTE = 100         # И не больше стольких версий на заметку
+
+# --- Параметры полнотекстового поиска ---
+FTS_TITLE_WEIGHT = 10.0             # Вес совпадения в заголовке для bm25
+FTS_CONTENT_WEIGHT = 1.0
+SNIPPET_TOKENS = 12                 # Длина фрагмента в выдаче (в словах)
+SNIPPET_OPEN = "<b>"
+SNIPPET_CLOSE = "</b>"
+
+# --- Шифрование заметок ---
+# Текст зашифрованной заметки хранится в content_blob (nonce + AES-GCM),
+# заголовок остается открытым, поэтому дерево и поиск по заголовкам не
+# требуют расшифровки. Заметки шифруются случайным ключом хранилища, а он
+# сам хранится в таблице security зашифрованным ключом из пароля (и ключом
+# из ответов на контрольные вопросы - для восстановления доступа).
+ENCRYPTED_CODEC = "aesgcm"
+NOTE_KEY_BYTES = 32                 # AES-256
+NOTE_NONCE_BYTES = 12
+KDF_SALT_BYTES = 16
+KDF_N = 2 ** 14                     # Параметры scrypt: ~16 МБ памяти, десятки мс один раз за сеанс
+KDF_R = 8
+KDF_P = 1
+DECRYPTED_CACHE_SIZE = 64           # Сколько расшифрованных заметок держать в памяти
+
+
+def order_key_between(before, after):
+    """
+    Возвращает ключ, лежащий строго между before и after.
+    None означает начало (before) или конец (after) списка.
+    """
+    if before is not None and after is not None and before >= after:
+        raise ValueError(f"Неверный порядок ключей: {before!r} >= {after!r}")
+    if after is None and before:
+        return order_key_after(before)
+    return _order_key_midpoint(before or "", after)
+
+
+def order_key_after(key):
+    """
+    Ключ для добавления в конец списка после key. Ключ читается как серия
+    из r последних цифр ("z") и "голова" - число из r + 1 цифр; добавление
+    увеличивает голову на единицу. Когда голова переполняется, серия
+    удлиняется, поэтому длина ключа растет логарифмически от числа добавлений.
+    """
+    digits = ORDER_KEY_DIGITS
+    base = len(digits)
+    run = len(key) - len(key.lstrip(digits[-1]))
+    width = run + 1
+    value = 0
+    for char in key[run:run + width].ljust(width, digits[0]):
+        value = value * base + digits.index(char)
+    value += 1
+    head = ""
+    for _ in range(width):
+        value, digit = divmod(value, base)
+        head = digits[digit] + head
+    if value or head[0] == digits[-1]:
+        # Голова переполнилась - переходим на серию длиннее
+        return digits[-1] * (run + 1) + digits[1]
+    return (digits[-1] * run + head).rstrip(digits[0])
+
+
+def _order_key_midpoint(low, high):
+    digits = ORDER_KEY_DIGITS
+    if high is not None:
+        # Общий префикс переносим как есть, середину ищем в остатке
+        n = 0
+        while n < len(high) and (low[n] if n < len(low) else digits[0]) == high[n]:
+            n += 1
+        if n:
+            return high[:n] + _order_key_midpoint(low[n:], high[n:])
+    low_digit = digits.index(low[0]) if low else 0
+    high_digit = digits.index(high[0]) if high is not None else len(digits)
+    if high_digit - low_digit > 1:
+        return digits[(low_digit + high_digit) // 2]
+    if high is not None and len(high) > 1:
+        return high[0]
+    return digits[low_digit] + _order_key_midpoint(low[1:], None)
+
+
+def spread_order_keys(count):
+    """Возвращает count равномерно распределенных возрастающих ключей одинаковой длины."""
+    base = len(ORDER_KEY_DIGITS)
+    length = 1
+    while base ** length <= count:
+        length += 1
+    span = base ** length
+    keys = []
+    for i in range(1, count + 1):
+        value = i * span // (count + 1)
+        key = ""
+        for _ in range(length):
+            value, digit = divmod(value, base)
+            key = ORDER_KEY_DIGITS[digit] + key
+        keys.append(key.rstrip(ORDER_KEY_DIGITS[0]))
+    return keys
+
+
+def pack_note_content(content):
+    """
+    Готовит текст заметки к записи.
+    Возвращает (content, content_blob, content_codec, content_size):
+    большой текст сжимается, иначе возвращается как есть.
+    """
+    if content:
+        raw = content.encode('utf-8')
+        if len(raw) >= COMPRESS_MIN_BYTES:
+            if NOTE_CODEC == "lzma":
+                packed = lzma.compress(raw)
+            else:
+                packed = zlib.compress(raw, ZLIB_LEVEL)
+            if len(packed) < len(raw) * COMPRESS_MAX_RATIO:
+                return None, packed, NOTE_CODEC, len(raw)
+    return content, None, None, None
+
+
+def unpack_note_content(content, content_blob, content_codec):
+    """Возвращает текст заметки, распаковывая его при необходимости."""
+    if content_codec is None:
+        return content
+    if content_codec == ENCRYPTED_CODEC:
+        return None  # Зашифрованный текст недоступен SQL (индексу, тегам, LIKE)
+    if content_codec == "zlib":
+        return zlib.decompress(content_blob).decode('utf-8')
+    if content_codec == "lzma":
+        return lzma.decompress(content_blob).decode('utf-8')
+    raise ValueError(f"Неизвестный способ сжатия заметки: {content_codec}")
+
+
+def make_text_delta(old, new):
+    """
+    Строит построчную разницу old -> new: список, где число > 0 - скопировать
+    столько строк из old, число < 0 - пропустить столько строк old,
+    список строк - вставить их.
+    """
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    ops = []
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append(i2 - i1)
+            continue
+        if i2 > i1:
+            ops.append(i1 - i2)
+        if j2 > j1:
+            ops.append(new_lines[j1:j2])
+    return ops
+
+
+def apply_text_delta(old, ops):
+    """Применяет разницу make_text_delta к тексту old."""
+    old_lines = old.splitlines(keepends=True)
+    result = []
+    pos = 0
+    for op in ops:
+        if isinstance(op, list):
+            result.extend(op)
+        elif op > 0:
+            result.extend(old_lines[pos:pos + op])
+            pos += op
+        else:
+            pos -= op
+    return "".join(result)
+
+
+def derive_key(secret, salt):
+    """Выводит 256-битный ключ из пароля (scrypt)."""
+    return hashlib.scrypt(secret.encode('utf-8'), salt=salt, n=KDF_N, r=KDF_R, p=KDF_P, dklen=NOTE_KEY_BYTES)
+
+
+def seal_bytes(key, data, associated_data):
+    """Шифрует data ключом key (AES-GCM); возвращает nonce + шифротекст."""
+    nonce = os.urandom(NOTE_NONCE_BYTES)
+    return nonce + AESGCM(key).encrypt(nonce, data, associated_data)
+
+
+def open_sealed_bytes(key, sealed, associated_data):
+    """Расшифровывает результат seal_bytes; при неверном ключе или подмене - InvalidTag."""
+    return AESGCM(key).decrypt(sealed[:NOTE_NONCE_BYTES], sealed[NOTE_NONCE_BYTES:], associated_data)
+
+
+class ConnectionPool:
+    """
+    Долгоживущие соединения с БД: одно пишущее и несколько читающих.
+    Каждое соединение настраивается один раз при открытии (WAL, synchronous,
+    кэш страниц, mmap), поэтому методы DatabaseManager больше не платят
+    за открытие файла при каждом вызове.
+    """
+
+    def __init__(self, db_path, reader_count=READER_POOL_SIZE, profiler=None):
+        self.db_path = db_path
+        self.reader_count = reader_count
+        self.profiler = profiler  # QueryProfiler: пока он выключен, соединения выдаются как есть
+        self._write_lock = threading.RLock()
+        self._writer_owner = None
+        self._write_depth = 0
+        self._writer = None
+        self._readers = None
+        self.open()
+
+    def _connect(self):
+        """Создает и настраивает новое соединение с базой данных."""
+        con = sqlite3.connect(
+            self.db_path,
+            timeout=BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,  # Доступ из разных потоков сериализуем сами
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        con.row_factory = sqlite3.Row  # Позволяет обращаться к колонкам по имени
+        # note_text(content, content_blob, content_codec) - текст заметки в SQL
+        # (нужна запросам, триггерам и представлению полнотекстового индекса)
+        con.create_function("note_text", 3, unpack_note_content, deterministic=True)
+        con.execute("PRAGMA synchronous = NORMAL")
+        con.execute(f"PRAGMA cache_size = -{PAGE_CACHE_KIB}")
+        con.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+        con.execute("PRAGMA temp_store = MEMORY")
+        # ON DELETE CASCADE работает только при включенных внешних ключах
+        con.execute("PRAGMA foreign_keys = ON")
+        return con
+
+    def open(self):
+        """Открывает пишущее соединение и пул читающих."""
+        if self._writer is not None:
+            return
+        self._writer = self._connect()
+        # WAL сохраняется в файле БД, поэтому достаточно включить его один раз
+        self._writer.execute("PRAGMA journal_mode = WAL")
+        self._readers = queue.Queue()
+        for _ in range(self.reader_count):
+            self._readers.put(self._connect())
+
+    @property
+    def is_open(self):
+        return self._writer is not None
+
+    @contextmanager
+    def writer(self):
+        """
+        Выдает пишущее соединение под блокировкой.
+        Транзакция фиксируется при выходе из самого внешнего блока,
+        поэтому вложенные вызовы пишущих методов образуют одну транзакцию.
+        """
+        with self._write_lock:
+            con = self._writer
+            if con is None:
+                raise sqlite3.ProgrammingError("Соединение с базой данных закрыто.")
+            self._writer_owner = threading.get_ident()
+            self._write_depth += 1
+            try:
+                yield self._lend(con)
+                if self._write_depth == 1:
+                    con.commit()
+            except BaseException:
+                if self._write_depth == 1:
+                    con.rollback()
+                raise
+            finally:
+                self._write_depth -= 1
+                if self._write_depth == 0:
+                    self._writer_owner = None
+
+    @contextmanager
+    def reader(self):
+        """
+        Выдает читающее соединение из пула.
+        Внутри открытой пишущей транзакции читаем через пишущее соединение,
+        чтобы видеть еще не зафиксированные изменения.
+        """
+        if self._writer_owner == threading.get_ident():
+            yield self._lend(self._writer)
+            return
+        if self._readers is None:
+            raise sqlite3.ProgrammingError("Соединение с базой данных закрыто.")
+        try:
+            con = self._readers.get_nowait()
+        except queue.Empty:
+            # Все соединения заняты (вложенное чтение) - открываем временное
+            con = self._connect()
+        try:
+            yield self._lend(con)
+        finally:
+            if self._readers is not None and self._readers.qsize() < self.reader_count:
+                self._readers.put(con)
+            else:
+                con.close()
+
+    def _lend(self, con):
+        """Соединение для вызывающего кода: при включенном профилировании - с замером запросов."""
+        profiler = self.profiler
+        return profiler.wrap_connection(con) if profiler is not None and profiler.enabled else con
+
+    def holds_writer(self):
+        """Проверяет, открыта ли пишущая транзакция в текущем потоке."""
+        return self._writer_owner == threading.get_ident()
+
+    def checkpoint(self):
+        """Переносит содержимое WAL-журнала в основной файл БД."""
+        with self.writer() as con:
+            con.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def replace_from(self, source):
+        """
+        Заменяет содержимое базы данными из соединения source через backup API.
+        Копирование идет одним шагом в транзакции пишущего соединения, поэтому
+        замена атомарна: при сбое база остается прежней. После замены все
+        соединения переоткрываются, чтобы не держать кэши старой базы.
+        """
+        with self._write_lock:
+            if self._write_depth:
+                raise sqlite3.ProgrammingError("Нельзя заменить базу внутри открытой транзакции.")
+            if self._writer is None:
+                raise sqlite3.ProgrammingError("Соединение с базой данных закрыто.")
+            try:
+                source.backup(self._writer)
+                self._writer.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            finally:
+                self.close()
+                self.open()
+
+    def close(self):
+        """Закрывает все соединения. Последнее закрытие сливает WAL в файл БД."""
+        with self._write_lock:
+            readers, self._readers = self._readers, None
+            while readers is not None and not readers.empty():
+                readers.get_nowait().close()
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+
+class WriteBehindQueue:
+    """
+    Очередь отложенной записи сохранений заметок.
+    Повторные сохранения одной заметки схлопываются (остается последняя версия),
+    а накопленные записи применяются отдельным потоком пачками по одной
+    транзакции. flush() блокирует вызывающего, пока очередь не опустеет.
+    Сохранение, которое не удалось записать, не теряется: оно возвращается
+    в очередь и повторяется через WRITE_RETRY_DELAY_SEC, а об ошибке
+    сообщается через on_error(note_ids, message).
+    Тот же поток выполняет фоновые задания записи (put_job), например
+    перенумерацию ключей порядка.
+    """
+
+    def __init__(self, apply_batch, batch_size=WRITE_BATCH_SIZE, on_error=None):
+        # apply_batch(take_batch) должен сам забрать пачку через take_batch()
+        # уже под блокировкой записи, чтобы не обогнать синхронные изменения.
+        # Возвращает [(note_id, title, content, ошибка)] для незаписанных сохранений.
+        self._apply_batch = apply_batch
+        self.batch_size = batch_size
+        self.on_error = on_error
+        self._pending = {}  # note_id -> (title, content), в порядке поступления
+        self._failed = set()  # note_id из _pending, которые ждут повтора после ошибки
+        self._jobs = {}  # ключ -> функция: фоновые задания, еще не начатые
+        self._busy = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="db-write-behind", daemon=True)
+        self._thread.start()
+
+    def put(self, note_id, title, content):
+        with self._cond:
+            # Удаляем и вставляем заново, чтобы заметка встала в конец очереди
+            self._pending.pop(note_id, None)
+            self._pending[note_id] = (title, content)
+            self._failed.discard(note_id)
+            self._cond.notify_all()
+
+    def put_job(self, key, job):
+        """
+        Ставит задание job() в поток записи. Пока задание с тем же ключом
+        ждет выполнения, повторное не добавляется. Возвращает False для дубля.
+        """
+        with self._cond:
+            if key in self._jobs:
+                return False
+            self._jobs[key] = job
+            self._cond.notify_all()
+            return True
+
+    def pending_titles(self):
+        """Возвращает {note_id: title} для еще не записанных сохранений."""
+        with self._cond:
+            return {note_id: title for note_id, (title, _) in self._pending.items()}
+
+    def peek(self, note_id):
+        """Возвращает еще не записанную версию заметки (title, content) или None."""
+        with self._cond:
+            return self._pending.get(note_id)
+
+    def has_pending(self):
+        with self._cond:
+            return bool(self._pending) or bool(self._jobs) or self._busy
+
+    def failed_ids(self):
+        """ID заметок, сохранение которых не удалось и ждет повтора."""
+        with self._cond:
+            return set(self._failed)
+
+    def _has_ready(self):
+        return bool(self._jobs) or self._has_ready_saves()
+
+    def _has_ready_saves(self):
+        return any(note_id not in self._failed for note_id in self._pending)
+
+    def take_batch(self):
+        with self._cond:
+            batch = []
+            for note_id in [note_id for note_id in self._pending if note_id not in self._failed][:self.batch_size]:
+                title, content = self._pending.pop(note_id)
+                batch.append((note_id, title, content))
+            return batch
+
+    def _requeue(self, failed):
+        """Возвращает незаписанные сохранения в очередь, если их не заменила более новая версия."""
+        with self._cond:
+            for note_id, title, content, _ in failed:
+                if note_id not in self._pending:
+                    self._pending[note_id] = (title, content)
+                    self._failed.add(note_id)
+        note_ids = [note_id for note_id, _, _, _ in failed]
+        message = str(failed[-1][3])
+        print(f"Ошибка сохранения заметок {note_ids}, повтор через {WRITE_RETRY_DELAY_SEC} с: {message}")
+        if self.on_error:
+            self.on_error(note_ids, message)
+
+    def flush(self, retry_failed=False):
+        """
+        Ждет, пока все поставленные в очередь сохранения будут записаны.
+        Сохранения, ждущие повтора после ошибки, не задерживают вызывающего;
+        retry_failed=True сначала повторяет их (например, перед закрытием).
+        """
+        if threading.current_thread() is self._thread:
+            return
+        with self._cond:
+            if retry_failed and self._failed:
+                self._failed.clear()
+                self._cond.notify_all()
+            while self._has_ready() or self._busy:
+                self._cond.wait()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._has_ready():
+                    if self._pending:
+                        # Остались только неудачные сохранения - повторяем после паузы
+                        if not self._cond.wait(WRITE_RETRY_DELAY_SEC):
+                            self._failed.clear()
+                    else:
+                        self._cond.wait()
+                self._busy = True
+                has_saves = self._has_ready_saves()
+                jobs, self._jobs = list(self._jobs.values()), {}
+            batch = []
+
+            def take_batch():
+                batch[:] = self.take_batch()
+                return batch
+            failed = []
+            if has_saves:
+                try:
+                    failed = self._apply_batch(take_batch)
+                except Exception as e:
+                    # Пачка не записана целиком: возвращаем ее в очередь
+                    failed = [(*item, e) for item in batch]
+            if failed:
+                self._requeue(failed)
+            for job in jobs:
+                try:
+                    job()
+                except Exception as e:
+                    print(f"Ошибка фонового задания записи: {e}")
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+
+
+class DecryptedNoteCache:
+    """
+    Ограниченный LRU-кэш расшифрованных текстов заметок (note_id -> текст).
+    Повторное открытие зашифрованной заметки не расшифровывает ее заново;
+    кэш живет только в памяти и очищается при блокировке приложения.
+    """
+
+    def __init__(self, capacity=DECRYPTED_CACHE_SIZE):
+        self.capacity = capacity
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, note_id):
+        with self._lock:
+            text = self._items.get(note_id)
+            if text is not None:
+                self._items.move_to_end(note_id)
+            return text
+
+    def put(self, note_id, text):
+        with self._lock:
+            self._items[note_id] = text
+            self._items.move_to_end(note_id)
+            while len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+
+    def discard(self, note_id):
+        with self._lock:
+            self._items.pop(note_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
 class DatabaseManager:
     """Класс для управления всеми операциями с базой данных SQLite."""
 
+    # Упорядоченные миграции схемы: (версия, имя метода).
+    # Номер последней примененной миграции хранится в PRAGMA user_version.
+    MIGRATIONS = (
+        (1, '_create_tables'),
+        (2, '_create_search_index'),
+        (3, '_create_tag_index'),
+        (4, '_create_performance_indexes'),
+        (5, '_create_timestamp_trigger'),
+        (6, '_create_order_keys'),
+        (7, '_compress_large_notes'),
+        (8, '_create_revision_history'),
+        (9, '_create_note_encryption'),
+        (10, '_collect_orphans'),
+        (11, '_create_note_paths'),
+        (12, '_create_note_order_keys'),
+    )
+
     def __init__(self, db_path=DB_FILE):
         self.db_path = db_path
-        self._create_tables()
-        
+        self.archive_path = os.path.join(os.path.dirname(os.path.abspath(db_path)), ARCHIVE_FILE_NAME)
+        self.profiler = QueryProfiler()
+        self.pool = ConnectionPool(db_path, profiler=self.profiler)
+        self.write_queue = WriteBehindQueue(self._apply_queued_updates, on_error=self._report_write_error)
+        self.on_write_error = None  # on_write_error(note_ids, message) вызывается из потока записи
+        self._note_key = None  # Ключ шифрования заметок; есть только после разблокировки
+        self.decrypted_cache = DecryptedNoteCache()
+        self._migrate()
+        self._reconcile_archive()
 
-    def _get_connection(self):
-        """Создает и возвращает соединение с базой данных."""
-        con = sqlite3.connect(self.db_path)
-        con.row_factory = sqlite3.Row  # Позволяет обращаться к колонкам по имени
+    def _write(self):
+        """Пишущее соединение; фиксирует транзакцию при выходе из блока with."""
+        # Синхронная запись не должна обогнать отложенные сохранения заметок
+        if not self.pool.holds_writer():
+            self.write_queue.flush()
+        return self.pool.writer()
+
+    def _read(self):
+        """Читающее соединение из пула."""
+        return self.pool.reader()
+
+    def flush(self):
+        """Дожидается записи всех отложенных сохранений заметок."""
+        self.write_queue.flush()
+
+    def backup_to(self, target_path, pages=BACKUP_STEP_PAGES, progress=None):
+        """
+        Делает согласованную копию базы через sqlite3 backup API, не блокируя запись.
+        Копия снимается с одного снимка: читающее соединение держит транзакцию
+        чтения, а в режиме WAL это не мешает сохранению заметок.
+        Копирование идет шагами по pages страниц; progress(copied, total)
+        вызывается после каждого шага. Файл появляется под target_path только
+        целиком (пишем во временный и переименовываем).
+        Можно вызывать из рабочего потока.
+        """
+        self.flush()
+        temp_path = target_path + ".part"
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+        def on_step(status, remaining, total):
+            if progress:
+                progress(total - remaining, total)
+
+        with self.pool.reader() as source:
+            target = sqlite3.connect(temp_path)
+            try:
+                source.execute("BEGIN")
+                source.execute("SELECT 1 FROM sqlite_master LIMIT 1")  # Фиксируем снимок
+                source.backup(target, pages=pages, progress=on_step)
+                # Копия - самостоятельный файл без WAL-журнала рядом
+                target.execute("PRAGMA journal_mode = DELETE")
+            finally:
+                source.rollback()
+                target.close()
+        os.replace(temp_path, target_path)
+
+    def backup_archive_to(self, target_path, pages=BACKUP_STEP_PAGES):
+        """
+        Делает согласованную копию архива (archive.db) через backup API.
+        Архив читается отдельным соединением: если его изменят между шагами,
+        backup API начнет копирование заново, а запись заметок не ждет.
+        Возвращает False, если архива еще нет.
+        """
+        if not os.path.exists(self.archive_path):
+            return False
+        temp_path = target_path + ".part"
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        source = sqlite3.connect(self.archive_path)
+        target = sqlite3.connect(temp_path)
+        try:
+            source.backup(target, pages=pages)
+        finally:
+            source.close()
+            target.close()
+        os.replace(temp_path, target_path)
+        return True
+
+    def _with_pending_titles(self, rows):
+        """Подставляет в строки дерева заголовки еще не записанных сохранений."""
+        if pending := self.write_queue.pending_titles():
+            for row in rows:
+                if row['id'] in pending:
+                    row['title'] = pending[row['id']]
+        return rows
+
+    def checkpoint(self):
+        """Сбрасывает WAL в основной файл, чтобы его можно было скопировать."""
+        self.flush()
+        self.pool.checkpoint()
+
+    def run_maintenance(self, archive_after_months=0):
+        """
+        Плановое обслуживание базы (для рабочего потока в простое):
+        переносит в архив элементы, не менявшиеся archive_after_months месяцев
+        (0 - не переносить), обновляет статистику планировщика (ANALYZE,
+        PRAGMA optimize) и возвращает свободные страницы файловой системе
+        (incremental_vacuum). При первом запуске переводит базу в режим
+        auto_vacuum = INCREMENTAL полным VACUUM.
+        Возвращает {'freed_bytes', 'file_bytes', 'full_vacuum', 'archived_ids'}.
+        """
+        self.flush()
+        # Архивация - до очистки: освободившиеся страницы вернутся сразу
+        archived_ids = self.archive_stale_items(archive_after_months) if archive_after_months > 0 else []
+        with self._write() as con:
+            page_size = con.execute("PRAGMA page_size").fetchone()[0]
+            free_before = con.execute("PRAGMA freelist_count").fetchone()[0]
+            con.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+            con.execute("ANALYZE")
+            con.execute("PRAGMA optimize")
+            con.commit()
+            full_vacuum = con.execute("PRAGMA auto_vacuum").fetchone()[0] != 2
+            if full_vacuum:
+                # Режим auto_vacuum меняется только вместе с перестройкой файла
+                con.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                con.execute("VACUUM")
+            else:
+                # execute() делает один шаг прагмы и освобождает одну страницу,
+                # executescript() выполняет ее до конца
+                con.executescript("PRAGMA incremental_vacuum")
+            free_after = con.execute("PRAGMA freelist_count").fetchone()[0]
+            # Файл БД укорачивается, когда страницы из WAL переносятся в него
+            con.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        size_after = self._file_bytes()
+        report = {
+            'freed_bytes': (free_before - free_after) * page_size,
+            'file_bytes': size_after,
+            'full_vacuum': full_vacuum,
+            'archived_ids': archived_ids,
+        }
+        print(f"Обслуживание БД: освобождено {report['freed_bytes'] // 1024} КБ, "
+              f"размер файла {size_after // 1024} КБ")
+        return report
+
+    # --- Профилирование запросов ---
+
+    PROFILER_API = ('set_profiling', 'get_profile', 'reset_profile')
+
+    def set_profiling(self, enabled, slow_ms=SLOW_QUERY_MS, log_path=None):
+        """
+        Включает или выключает профилирование: статистику по публичным методам
+        и SQL-запросам и журнал запросов дольше slow_ms (log_path - файл журнала
+        с ротацией; None - только в памяти, см. get_profile()['slow']).
+        """
+        if enabled:
+            self.profiler.enable(slow_ms, log_path)
+            methods = [name for name in dir(type(self))
+                       if not name.startswith('_') and name not in self.PROFILER_API
+                       and callable(getattr(type(self), name))]
+            self.profiler.instrument(self, methods)
+        else:
+            self.profiler.uninstrument(self)
+            self.profiler.disable()
+
+    def get_profile(self, limit=None):
+        """
+        Статистика профилирования: {'enabled', 'since', 'slow_ms',
+        'methods': [{'method', 'count', 'total_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms', 'rows'}],
+        'statements': [то же с ключом 'sql'], 'slow': [{'time', 'ms', 'rows', 'method', 'sql', 'plan'}]}.
+        """
+        return self.profiler.report(limit)
+
+    def reset_profile(self):
+        """Обнуляет накопленную статистику профилирования."""
+        self.profiler.reset()
+
+    def _file_bytes(self):
+        """Размер файла БД вместе с WAL-журналом."""
+        return sum(os.path.getsize(path) for path in (self.db_path, self.db_path + "-wal") if os.path.exists(path))
+
+    def close(self):
+        """Закрывает все соединения с базой данных (вызывается при выходе)."""
+        # Последняя попытка записать сохранения, которые ждут повтора после ошибки
+        self.write_queue.flush(retry_failed=True)
+        if failed_ids := self.write_queue.failed_ids():
+            print(f"Ошибка: не удалось сохранить заметки {sorted(failed_ids)} перед закрытием базы")
+        self.pool.close()
+
+    def reopen(self):
+        """Повторно открывает соединения после close()."""
+        self.pool.open()
+
+    def restore_from(self, source_path, archive_source_path=None):
+        """
+        Восстанавливает базу из файла копии без перезапуска приложения:
+        дописывает отложенные сохранения, проверяет копию, атомарно заменяет
+        содержимое базы (backup API), переоткрывает соединения и доводит схему
+        копии до текущей версии миграциями.
+        archive_source_path - копия архива из того же снимка; без нее остается
+        текущий архив. В обоих случаях архив согласуется с восстановленной
+        базой (см. _reconcile_archive).
+        """
+        self.flush()
+        wrapped_key = self._stored_note_keys().get('note_key')
+        source = self._open_checked_copy(source_path)
+        archive_source = None
+        try:
+            if archive_source_path:
+                archive_source = self._open_checked_copy(archive_source_path)
+            self.pool.replace_from(source)
+            if archive_source:
+                # Архив подключается только на время операций, файл сейчас свободен
+                target = sqlite3.connect(self.archive_path)
+                try:
+                    archive_source.backup(target)
+                finally:
+                    target.close()
+        finally:
+            source.close()
+            if archive_source:
+                archive_source.close()
+        # Копия могла быть сделана до последних миграций
+        self._migrate()
+        self._reconcile_archive()
+        self.decrypted_cache.clear()
+        if self._stored_note_keys().get('note_key') != wrapped_key:
+            # У копии другой ключ хранилища: заметки откроются после повторного входа
+            self._note_key = None
+
+    @staticmethod
+    def _open_checked_copy(path):
+        """Открывает файл копии и проверяет его целостность (PRAGMA quick_check)."""
+        con = sqlite3.connect(path)
+        try:
+            check = con.execute("PRAGMA quick_check").fetchone()[0]
+            if check != "ok":
+                raise sqlite3.DatabaseError(f"Копия повреждена: {check}")
+        except BaseException:
+            con.close()
+            raise
         return con
 
-    def _create_tables(self):
-        """Создает таблицы, если они еще не существуют."""
-        with self._get_connection() as con:
+    @property
+    def schema_version(self):
+        """Текущая версия схемы базы данных (PRAGMA user_version)."""
+        with self._read() as con:
+            return con.execute("PRAGMA user_version").fetchone()[0]
+
+    def _migrate(self):
+        """
+        Применяет недостающие миграции по порядку. Каждая миграция выполняется
+        в своей транзакции вместе с записью новой версии, поэтому сбой
+        оставляет базу в последнем согласованном состоянии.
+        Если схема актуальна, при запуске выполняется только чтение user_version.
+        """
+        current_version = self.schema_version
+        for version, method_name in self.MIGRATIONS:
+            if version <= current_version:
+                continue
+            with self._write() as con:
+                con.execute("BEGIN IMMEDIATE")
+                getattr(self, method_name)(con.cursor())
+                con.execute(f"PRAGMA user_version = {version}")
+
+    def _create_tables(self, cursor):
+        """Миграция 1: создает базовые таблицы, если они еще не существуют."""
+        # Таблица для заметок и папок (древовидная структура)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS notes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                parent_id INTEGER,
+                type TEXT NOT NULL CHECK(type IN ('folder', 'note')),
+                title TEXT,
+                content TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                is_pinned INTEGER DEFAULT 0,
+                is_hidden INTEGER DEFAULT 0,
+                password_hash TEXT,
+                FOREIGN KEY (parent_id) REFERENCES notes (id) ON DELETE CASCADE
+            )
+        """)
+        
+        # Таблица для списков задач
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS task_lists (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT UNIQUE NOT NULL,
+                order_index INTEGER
+            )
+        """)
+
+        # Таблица для самих задач
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                list_id INTEGER NOT NULL,
+                content TEXT NOT NULL,
+                is_completed INTEGER DEFAULT 0,
+                order_index INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (list_id) REFERENCES task_lists (id) ON DELETE CASCADE
+            )
+        """)
+        
+        # Триггеры для автоматического обновления поля updated_at
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS update_note_timestamp
+            AFTER UPDATE ON notes
+            FOR EACH ROW
+            BEGIN
+                UPDATE notes SET updated_at = CURRENT_TIMESTAMP WHERE id = OLD.id;
+            END;
+        """)
+
+        # Проверяем, есть ли хоть один список задач, если нет - создаем "Default"
+        cursor.execute("SELECT COUNT(*) FROM task_lists")
+        if cursor.fetchone()[0] == 0:
+            cursor.execute("INSERT INTO task_lists (name, order_index) VALUES (?, ?)", ("Default", 0))
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS security (
+                id INTEGER PRIMARY KEY CHECK (id = 1), -- Гарантирует только одну строку
+                password_hash TEXT,
+                question1 TEXT,
+                answer1_hash TEXT,
+                question2 TEXT,
+                answer2_hash TEXT
+            )
+        """)
+
+    def _create_performance_indexes(self, cursor):
+        """Миграция 4: индексы по горячим колонкам и сбор статистики для планировщика."""
+        # Индекс для постраничной загрузки дочерних элементов дерева (get_children);
+        # его префикс (parent_id) обслуживает и поиск по родителю
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_notes_children
+            ON notes (parent_id, type, is_pinned DESC, title COLLATE NOCASE)
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_notes_type ON notes (type)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_list_order ON tasks (list_id, order_index, created_at)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_task_lists_order ON task_lists (order_index, name)")
+        cursor.execute("ANALYZE")
+
+    def _compress_large_notes(self, cursor):
+        """
+        Миграция 7: хранение больших заметок в сжатом виде.
+        Добавляет колонки content_blob/content_codec/content_size, сжимает уже
+        существующие большие заметки и перестраивает полнотекстовый индекс:
+        теперь он берет текст из представления notes_fts_source, которое
+        распаковывает заметки функцией note_text().
+        """
+        cursor.execute("ALTER TABLE notes ADD COLUMN content_blob BLOB")
+        cursor.execute("ALTER TABLE notes ADD COLUMN content_codec TEXT")
+        cursor.execute("ALTER TABLE notes ADD COLUMN content_size INTEGER")
+
+        # Старые триггеры индекса и updated_at не должны срабатывать на пересжатие
+        for trigger in ("notes_fts_insert", "notes_fts_delete", "notes_fts_update", "update_note_timestamp"):
+            cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        cursor.execute("DROP TABLE IF EXISTS notes_fts")
+
+        cursor.execute(
+            "SELECT id, content FROM notes WHERE type = 'note' AND length(CAST(content AS BLOB)) >= ?",
+            (COMPRESS_MIN_BYTES,)
+        )
+        updates = []
+        for row in cursor.fetchall():
+            content, blob, codec, size = pack_note_content(row['content'])
+            if codec:
+                updates.append((content, blob, codec, size, row['id']))
+        cursor.executemany(
+            "UPDATE notes SET content = ?, content_blob = ?, content_codec = ?, content_size = ? WHERE id = ?",
+            updates
+        )
+
+        cursor.execute("""
+            CREATE VIEW IF NOT EXISTS notes_fts_source AS
+            SELECT id, title, note_text(content, content_blob, content_codec) AS content
+            FROM notes WHERE type = 'note'
+        """)
+        cursor.execute("""
+            CREATE VIRTUAL TABLE notes_fts USING fts5(
+                title, content,
+                content='notes_fts_source', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2',
+                prefix='2 3'
+            )
+        """)
+        cursor.execute("""
+            CREATE TRIGGER notes_fts_insert AFTER INSERT ON notes
+            WHEN new.type = 'note' BEGIN
+                INSERT INTO notes_fts (rowid, title, content)
+                VALUES (new.id, new.title, note_text(new.content, new.content_blob, new.content_codec));
+            END;
+        """)
+        cursor.execute("""
+            CREATE TRIGGER notes_fts_delete AFTER DELETE ON notes
+            WHEN old.type = 'note' BEGIN
+                INSERT INTO notes_fts (notes_fts, rowid, title, content)
+                VALUES ('delete', old.id, old.title, note_text(old.content, old.content_blob, old.content_codec));
+            END;
+        """)
+        cursor.execute("""
+            CREATE TRIGGER notes_fts_update AFTER UPDATE OF title, content, content_blob, content_codec ON notes
+            WHEN new.type = 'note' BEGIN
+                INSERT INTO notes_fts (notes_fts, rowid, title, content)
+                VALUES ('delete', old.id, old.title, note_text(old.content, old.content_blob, old.content_codec));
+                INSERT INTO notes_fts (rowid, title, content)
+                VALUES (new.id, new.title, note_text(new.content, new.content_blob, new.content_codec));
+            END;
+        """)
+        cursor.execute(
+            "INSERT INTO notes_fts (notes_fts, rank) VALUES ('rank', ?)",
+            (f"bm25({FTS_TITLE_WEIGHT}, {FTS_CONTENT_WEIGHT})",)
+        )
+        cursor.execute("INSERT INTO notes_fts (notes_fts) VALUES ('rebuild')")
+        self._create_timestamp_trigger(cursor)
+
+        if updates:
+            report = self._compression_report(cursor)
+            print(f"Сжато заметок: {report['compressed_notes']}, "
+                  f"сэкономлено {report['saved_bytes'] // 1024} КБ")
+
+    def _create_revision_history(self, cursor):
+        """
+        Миграция 8: таблица версий заметок. Версия хранит состояние заметки
+        до перезаписи: целиком (snapshot) или разницей с предыдущей версией
+        (delta); данные сжаты zlib.
+        """
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS note_revisions (
+                note_id INTEGER NOT NULL,
+                revision INTEGER NOT NULL,
+                kind TEXT NOT NULL CHECK(kind IN ('snapshot', 'delta')),
+                title TEXT,
+                data BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (note_id, revision),
+                FOREIGN KEY (note_id) REFERENCES notes (id) ON DELETE CASCADE
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS note_revisions_on_note_delete AFTER DELETE ON notes BEGIN
+                DELETE FROM note_revisions WHERE note_id = old.id;
+            END;
+        """)
+
+    def _create_note_encryption(self, cursor):
+        """
+        Миграция 9: ключ шифрования заметок в таблице security.
+        note_key_salt - соль scrypt, note_key - ключ хранилища, зашифрованный
+        ключом из пароля, note_key_recovery - он же под ключом из ответов на
+        контрольные вопросы. Зашифрованные заметки помечаются notes.is_hidden = 1.
+        """
+        cursor.execute("ALTER TABLE security ADD COLUMN note_key_salt BLOB")
+        cursor.execute("ALTER TABLE security ADD COLUMN note_key BLOB")
+        cursor.execute("ALTER TABLE security ADD COLUMN note_key_recovery BLOB")
+
+    def _collect_orphans(self, cursor):
+        """
+        Миграция 10: удаляет записи, оставшиеся от удалений без внешних ключей:
+        содержимое удаленных папок (на любой глубине), задачи удаленных списков,
+        связи с тегами и версии удаленных заметок.
+        """
+        notes_before = cursor.execute("SELECT COUNT(*) FROM notes").fetchone()[0]
+        cursor.execute("""
+            WITH RECURSIVE orphans(id) AS (
+                SELECT id FROM notes
+                WHERE parent_id IS NOT NULL AND parent_id NOT IN (SELECT id FROM notes)
+                UNION
+                SELECT n.id FROM notes n JOIN orphans o ON n.parent_id = o.id
+            )
+            DELETE FROM notes WHERE id IN orphans
+        """)
+        # rowcount не заполняется для запросов, начинающихся с WITH
+        removed = notes_before - cursor.execute("SELECT COUNT(*) FROM notes").fetchone()[0]
+        cursor.execute("DELETE FROM tasks WHERE list_id NOT IN (SELECT id FROM task_lists)")
+        removed += cursor.rowcount
+        cursor.execute("DELETE FROM note_tags WHERE note_id NOT IN (SELECT id FROM notes)")
+        removed += cursor.rowcount
+        cursor.execute("DELETE FROM note_revisions WHERE note_id NOT IN (SELECT id FROM notes)")
+        removed += cursor.rowcount
+        if removed:
+            print(f"Удалено потерянных записей: {removed}")
+
+    def _create_note_paths(self, cursor):
+        """
+        Миграция 11: таблица замыкания note_paths - по строке на каждую пару
+        (предок, потомок) с расстоянием depth, включая пару элемента с самим
+        собой (depth = 0). Предки, глубина, проверка циклов и счетчики папок
+        становятся одним индексированным запросом. Таблица поддерживается
+        триггерами на notes, поэтому ее не нужно помнить в каждом методе записи
+        (create_note, create_folder, move_item, импорт, удаление).
+        """
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS note_paths (
+                ancestor_id INTEGER NOT NULL,
+                descendant_id INTEGER NOT NULL,
+                depth INTEGER NOT NULL,
+                PRIMARY KEY (ancestor_id, descendant_id)
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_note_paths_descendant ON note_paths (descendant_id, depth)")
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS note_paths_on_insert AFTER INSERT ON notes BEGIN
+                INSERT INTO note_paths (ancestor_id, descendant_id, depth) VALUES (new.id, new.id, 0);
+                INSERT INTO note_paths (ancestor_id, descendant_id, depth)
+                    SELECT ancestor_id, new.id, depth + 1 FROM note_paths WHERE descendant_id = new.parent_id;
+            END;
+        """)
+        # Перемещение: поддерево отрывается от старых предков и подвешивается к новым
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS note_paths_on_move AFTER UPDATE OF parent_id ON notes
+            WHEN old.parent_id IS NOT new.parent_id BEGIN
+                DELETE FROM note_paths
+                WHERE descendant_id IN (SELECT descendant_id FROM note_paths WHERE ancestor_id = new.id)
+                  AND ancestor_id IN (SELECT ancestor_id FROM note_paths WHERE descendant_id = new.id AND depth > 0);
+                INSERT INTO note_paths (ancestor_id, descendant_id, depth)
+                    SELECT up.ancestor_id, down.descendant_id, up.depth + down.depth + 1
+                    FROM note_paths up CROSS JOIN note_paths down
+                    WHERE up.descendant_id = new.parent_id AND down.ancestor_id = new.id;
+            END;
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS note_paths_on_delete AFTER DELETE ON notes BEGIN
+                DELETE FROM note_paths WHERE descendant_id = old.id;
+                DELETE FROM note_paths WHERE ancestor_id = old.id;
+            END;
+        """)
+        # Заполнение для существующих заметок
+        cursor.execute("""
+            WITH RECURSIVE paths(ancestor_id, descendant_id, depth) AS (
+                SELECT id, id, 0 FROM notes
+                UNION ALL
+                SELECT p.ancestor_id, n.id, p.depth + 1 FROM notes n JOIN paths p ON n.parent_id = p.descendant_id
+            )
+            INSERT OR IGNORE INTO note_paths (ancestor_id, descendant_id, depth) SELECT * FROM paths
+        """)
+
+    def _create_note_order_keys(self, cursor):
+        """
+        Миграция 12: ключи порядка (order_key) для заметок и папок - ручной порядок
+        внутри папки. Существующие элементы получают ключи в текущем порядке
+        отображения. Индекс дерева покрывает весь ORDER BY, так что дочерние
+        элементы читаются уже отсортированными.
+        """
+        cursor.execute("ALTER TABLE notes ADD COLUMN order_key TEXT")
+        cursor.execute("SELECT id, parent_id FROM notes ORDER BY parent_id, type, is_pinned DESC, title COLLATE NOCASE")
+        by_parent = {}
+        for row in cursor.fetchall():
+            by_parent.setdefault(row['parent_id'], []).append(row['id'])
+        for item_ids in by_parent.values():
+            self._assign_order_keys(cursor, "notes", item_ids)
+
+        cursor.execute("DROP INDEX IF EXISTS idx_notes_children")
+        cursor.execute(f"""
+            CREATE INDEX IF NOT EXISTS idx_notes_children
+            ON notes (parent_id, {NOTE_ORDER_SQL.replace('n.', '')})
+        """)
+
+    def _create_order_keys(self, cursor):
+        """
+        Миграция 6: строковые ключи порядка (order_key) для задач и списков задач.
+        Существующие записи получают ключи в их текущем порядке отображения.
+        """
+        cursor.execute("ALTER TABLE tasks ADD COLUMN order_key TEXT")
+        cursor.execute("ALTER TABLE task_lists ADD COLUMN order_key TEXT")
+
+        cursor.execute("SELECT id FROM task_lists ORDER BY order_index, name")
+        self._assign_order_keys(cursor, "task_lists", [row['id'] for row in cursor.fetchall()])
+        cursor.execute("SELECT id, list_id FROM tasks ORDER BY list_id, order_index, created_at, id")
+        by_list = {}
+        for row in cursor.fetchall():
+            by_list.setdefault(row['list_id'], []).append(row['id'])
+        for task_ids in by_list.values():
+            self._assign_order_keys(cursor, "tasks", task_ids)
+
+        cursor.execute("DROP INDEX IF EXISTS idx_tasks_list_order")
+        cursor.execute("DROP INDEX IF EXISTS idx_task_lists_order")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_list_order ON tasks (list_id, order_key)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_task_lists_order ON task_lists (order_key)")
+
+    def _create_timestamp_trigger(self, cursor):
+        """
+        Миграция 5: триггер updated_at срабатывает, только если запрос сам
+        не обновил метку времени. Сохранение заметки выставляет updated_at
+        в том же UPDATE и не порождает второй UPDATE.
+        """
+        cursor.execute("DROP TRIGGER IF EXISTS update_note_timestamp")
+        cursor.execute("""
+            CREATE TRIGGER update_note_timestamp
+            AFTER UPDATE ON notes
+            FOR EACH ROW WHEN NEW.updated_at IS OLD.updated_at
+            BEGIN
+                UPDATE notes SET updated_at = CURRENT_TIMESTAMP WHERE id = OLD.id;
+            END;
+        """)
+
+    def _create_search_index(self, cursor):
+        """
+        Миграция 2: создает полнотекстовый индекс FTS5 по заметкам (title, content).
+        Индекс хранит только токены, сам текст берется из таблицы notes.
+        Папки в индекс не попадают. Для уже существующих баз индекс
+        один раз заполняется из таблицы notes.
+        """
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'notes_fts'")
+        needs_backfill = cursor.fetchone() is None
+
+        cursor.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(
+                title, content,
+                content='notes', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2',
+                prefix='2 3'
+            )
+        """)
+        # Синхронизация индекса с таблицей notes
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS notes_fts_insert AFTER INSERT ON notes
+            WHEN new.type = 'note' BEGIN
+                INSERT INTO notes_fts (rowid, title, content) VALUES (new.id, new.title, new.content);
+            END;
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS notes_fts_delete AFTER DELETE ON notes
+            WHEN old.type = 'note' BEGIN
+                INSERT INTO notes_fts (notes_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+            END;
+        """)
+        # Только при изменении title/content: обновление updated_at индекс не трогает
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS notes_fts_update AFTER UPDATE OF title, content ON notes
+            WHEN new.type = 'note' BEGIN
+                INSERT INTO notes_fts (notes_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+                INSERT INTO notes_fts (rowid, title, content) VALUES (new.id, new.title, new.content);
+            END;
+        """)
+
+        if needs_backfill:
+            # Ранжирование по умолчанию: совпадения в заголовке весят больше
+            cursor.execute(
+                "INSERT INTO notes_fts (notes_fts, rank) VALUES ('rank', ?)",
+                (f"bm25({FTS_TITLE_WEIGHT}, {FTS_CONTENT_WEIGHT})",)
+            )
+            cursor.execute(
+                "INSERT INTO notes_fts (rowid, title, content) SELECT id, title, content FROM notes WHERE type = 'note'"
+            )
+
+    def _create_tag_index(self, cursor):
+        """
+        Миграция 3: создает нормализованный индекс тегов: tags (справочник) и
+        note_tags (связь заметка-тег). Индекс обновляется инкрементально
+        при сохранении заметок; для существующих баз заполняется один раз.
+        """
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'note_tags'")
+        needs_backfill = cursor.fetchone() is None
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS tags (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT UNIQUE NOT NULL
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS note_tags (
+                tag_id INTEGER NOT NULL,
+                note_id INTEGER NOT NULL,
+                PRIMARY KEY (tag_id, note_id),
+                FOREIGN KEY (tag_id) REFERENCES tags (id) ON DELETE CASCADE,
+                FOREIGN KEY (note_id) REFERENCES notes (id) ON DELETE CASCADE
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_note_tags_note ON note_tags (note_id)")
+        # Удаление заметки убирает ее связи, а тег без заметок удаляется из справочника
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS note_tags_on_note_delete AFTER DELETE ON notes BEGIN
+                DELETE FROM note_tags WHERE note_id = old.id;
+            END;
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS tags_drop_unused AFTER DELETE ON note_tags BEGIN
+                DELETE FROM tags WHERE id = old.tag_id
+                    AND NOT EXISTS (SELECT 1 FROM note_tags WHERE tag_id = old.tag_id);
+            END;
+        """)
+
+        if needs_backfill:
+            cursor.execute("SELECT id, content FROM notes WHERE type = 'note' AND content LIKE '%#%'")
+            for row in cursor.fetchall():
+                self._sync_note_tags(cursor, row['id'], row['content'], old_tags=set())
+
+    @staticmethod
+    def _extract_tags(content):
+        """Возвращает множество тегов (#tag) из текста заметки."""
+        return set(TAG_PATTERN.findall(content)) if content else set()
+
+    def _get_note_tags(self, cursor, note_id):
+        cursor.execute(
+            "SELECT t.name FROM note_tags nt JOIN tags t ON t.id = nt.tag_id WHERE nt.note_id = ?",
+            (note_id,)
+        )
+        return {row['name'] for row in cursor.fetchall()}
+
+    def _sync_note_tags(self, cursor, note_id, content, old_tags=None):
+        """
+        Приводит связи заметки с тегами в соответствие с ее текстом.
+        Пишет в БД только разницу между старым и новым набором тегов.
+        """
+        new_tags = self._extract_tags(content)
+        if old_tags is None:
+            old_tags = self._get_note_tags(cursor, note_id)
+
+        removed = old_tags - new_tags
+        added = new_tags - old_tags
+        if removed:
+            cursor.executemany(
+                "DELETE FROM note_tags WHERE note_id = ? AND tag_id = (SELECT id FROM tags WHERE name = ?)",
+                [(note_id, name) for name in removed]
+            )
+        if added:
+            cursor.executemany("INSERT OR IGNORE INTO tags (name) VALUES (?)", [(name,) for name in added])
+            cursor.executemany(
+                "INSERT OR IGNORE INTO note_tags (tag_id, note_id) SELECT id, ? FROM tags WHERE name = ?",
+                [(note_id, name) for name in added]
+            )
+
+    @staticmethod
+    def _build_fts_query(search_text):
+        """
+        Превращает пользовательский ввод в запрос FTS5: каждое слово ищется
+        как префикс ("заме"*), все слова должны встречаться в заметке.
+        """
+        words = re.findall(r'\w+', search_text)
+        return " ".join('"' + word.replace('"', '""') + '"*' for word in words)
+
+    # --- Методы для работы с Заметками и Папками ---
+
+    def get_note_tree(self):
+        """
+        Извлекает все заметки и папки и строит из них древовидную структуру.
+        Возвращает список словарей.
+        """
+        with self._read() as con:
             cursor = con.cursor()
-            # Таблица для заметок и папок (древовидная структура)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS notes (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    parent_id INTEGER,
-                    type TEXT NOT NULL CHECK(type IN ('folder', 'note')),
-                    title TEXT,
-                    content TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    is_pinned INTEGER DEFAULT 0,
-                    is_hidden INTEGER DEFAULT 0,
-                    password_hash TEXT,
-                    FOREIGN KEY (parent_id) REFERENCES notes (id) ON DELETE CASCADE
-                )
+            # Порядок задает БД (индекс idx_notes_children): дети добавляются уже отсортированными
+            cursor.execute(f"""
+                SELECT n.id, n.parent_id, n.type, n.title, n.is_pinned, n.is_hidden
+                FROM notes n ORDER BY {NOTE_ORDER_SQL}
             """)
+            rows = self._with_pending_titles([dict(row) for row in cursor.fetchall()])
+            return self._build_tree(rows)
+
+    @staticmethod
+    def _build_tree(rows):
+        """Собирает дерево из строк, сохраняя их порядок среди соседей."""
+        nodes = {row['id']: row for row in rows}
+        tree = []
+        for node in rows:
+            if node['parent_id'] is None:
+                tree.append(node)
+            elif parent := nodes.get(node['parent_id']):
+                parent.setdefault('children', []).append(node)
+        return tree
             
-            # Таблица для списков задач
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS task_lists (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT UNIQUE NOT NULL,
-                    order_index INTEGER
+    def get_all_notes_flat(self):
+        """Возвращает плоский список всех заметок со всем их содержимым."""
+        return list(self.iter_notes(fields=('id', 'content', 'created_at')))
+
+    # --- Потоковое чтение ---
+    # Генераторы ниже отдают строки пачками через fetchmany, поэтому в памяти
+    # одновременно находится не больше batch_size текстов. Все строки читаются
+    # из одного снимка базы; читающее соединение занято, пока генератор не
+    # исчерпан или не закрыт.
+
+    def iter_notes(self, batch_size=ITER_BATCH_SIZE, fields=('id', 'title', 'content', 'created_at'), since=None,
+                   by_created=False):
+        """
+        Перебирает все заметки (без папок) в порядке добавления (по id).
+        fields - поля из NOTE_FIELDS; since - только заметки, измененные
+        не раньше этого момента ('YYYY-MM-DD HH:MM:SS' UTC);
+        by_created=True - сортировка по created_at средствами SQLite.
+        Зашифрованные заметки отдаются расшифрованными, если ключ доступен.
+        """
+        query = f"SELECT {self._note_columns(fields)} FROM notes n WHERE n.type = 'note'"
+        if since is not None:
+            query += " AND n.updated_at >= :since"
+        query += " ORDER BY n.created_at, n.id" if by_created else " ORDER BY n.id"
+        yield from self._iter_rows(query, {'since': since}, batch_size)
+
+    def iter_subtree(self, folder_id=None, batch_size=ITER_BATCH_SIZE,
+                     fields=('id', 'parent_id', 'type', 'title', 'content'), notes_only=False, by_created=False):
+        """
+        Перебирает папку folder_id вместе со всем содержимым (на любой глубине);
+        при folder_id=None - все дерево. Обход идет по уровням, поэтому папка
+        всегда отдается раньше своих потомков. К каждой строке добавляется
+        поле 'depth' (0 - сама папка или элементы корня).
+        notes_only=True - только заметки поддерева, без папок;
+        by_created=True - вместо обхода по уровням сортировка по created_at.
+        """
+        query = self._subtree_cte(folder_id) + f"""
+            SELECT {self._note_columns(fields)}, s.depth AS depth
+            FROM subtree s CROSS JOIN notes n ON n.id = s.id
+        """
+        if notes_only:
+            query += " WHERE n.type = 'note'"
+        if by_created:
+            query += " ORDER BY n.created_at, n.id"
+        yield from self._iter_rows(query, {'root_id': folder_id}, batch_size)
+
+    @staticmethod
+    def _subtree_cte(root_id):
+        """CTE subtree(id, depth) для элемента :root_id или (при None) для всего дерева."""
+        return SUBTREE_CTE.format(start="id = :root_id" if root_id is not None else "parent_id IS NULL")
+
+    @staticmethod
+    def _note_columns(fields):
+        unknown = set(fields) - NOTE_FIELDS.keys()
+        if unknown:
+            raise ValueError(f"Неизвестные поля заметки: {', '.join(sorted(unknown))}")
+        columns = [NOTE_FIELDS[field] for field in fields]
+        if 'content' in fields:
+            # Зашифрованный текст отдается отдельно и расшифровывается в Python
+            columns.append("CASE WHEN n.content_codec = :encrypted_codec THEN n.content_blob END AS sealed, n.id AS sealed_id")
+        return ", ".join(columns)
+
+    def _iter_rows(self, query, params, batch_size):
+        self.flush()
+        with self._read() as con:
+            cursor = con.cursor()
+            cursor.execute(query, {'encrypted_codec': ENCRYPTED_CODEC, **params})
+            while rows := cursor.fetchmany(batch_size):
+                for row in rows:
+                    item = dict(row)
+                    if 'sealed' in item:
+                        sealed, note_id = item.pop('sealed'), item.pop('sealed_id')
+                        if sealed is not None:
+                            item['content'] = self._open_note_content(note_id, sealed, cache=False)
+                    yield item
+
+    def get_all_notes_for_refresh(self):
+        """Возвращает плоский список всех заметок с полями для обновления UI."""
+        with self._read() as con:
+            cursor = con.cursor()
+            cursor.execute("SELECT id, title, is_pinned FROM notes WHERE type = 'note'")
+            return self._with_pending_titles([dict(row) for row in cursor.fetchall()])
+
+    def get_notes_metadata(self):
+        """
+        Возвращает метаданные всех заметок и папок без текстов:
+        {'id', 'parent_id', 'type', 'title', 'is_pinned', 'is_hidden', 'order_key', 'updated_at'}.
+        """
+        with self._read() as con:
+            cursor = con.cursor()
+            cursor.execute("SELECT id, parent_id, type, title, is_pinned, is_hidden, order_key, updated_at FROM notes")
+            return self._with_pending_titles([dict(row) for row in cursor.fetchall()])
+
+    def get_item_metadata(self, item_id):
+        """Метаданные одного элемента (как в get_notes_metadata) или None."""
+        with self._read() as con:
+            cursor = con.cursor()
+            cursor.execute(
+                "SELECT id, parent_id, type, title, is_pinned, is_hidden, order_key, updated_at FROM notes WHERE id = ?",
+                (item_id,)
+            )
+            row = cursor.fetchone()
+            return self._with_pending_titles([dict(row)])[0] if row else None
+
+    def get_note_content(self, note_id):
+        """Возвращает только текст заметки (с учетом отложенных сохранений) или None."""
+        if pending := self.write_queue.peek(note_id):
+            return pending[1]
+        with self._read() as con:
+            cursor = con.cursor()
+            cursor.execute("SELECT content, content_blob, content_codec FROM notes WHERE id = ?", (note_id,))
+            row = cursor.fetchone()
+        if not row:
+            return None
+        if row['content_codec'] == ENCRYPTED_CODEC:
+            return self._open_note_content(note_id, row['content_blob'])
+        return unpack_note_content(row['content'], row['content_blob'], row['content_codec'])
+
+    def get_note_details(self, note_id):
+        """Возвращает полную информацию о заметке по ее ID."""
+        with self._read() as con:
+            cursor = con.cursor()
+            cursor.execute("SELECT * FROM notes WHERE id = ?", (note_id,))
+            row = cursor.fetchone()
+            if not row:
+                return None
+            note = dict(row)
+        content_blob, content_codec = note.pop('content_blob'), note.pop('content_codec')
+        if content_codec == ENCRYPTED_CODEC:
+            note['content'] = self._open_note_content(note_id, content_blob)
+        else:
+            note['content'] = unpack_note_content(note['content'], content_blob, content_codec)
+        note.pop('content_size', None)
+        # Еще не записанное сохранение новее того, что лежит в БД
+        if pending := self.write_queue.peek(note_id):
+            note['title'], note['content'] = pending
+        return note
+
+    @staticmethod
+    def _note_title(title, content):
+        """Генерирует заголовок заметки без хештегов."""
+        if not title and content:
+            first_line = content.split('\n', 1)[0].strip()
+            # Удаляем все символы # из первой строки для создания заголовка
+            clean_title = re.sub(r'#', '', first_line).strip()
+            return clean_title or "Новая заметка"
+        elif title:
+            clean_title = re.sub(r'#', '', title).strip()
+            return clean_title or "Новая заметка"
+        return title
+
+    def create_note(self, parent_id, title="Новая заметка", content=""):
+        """Создает новую заметку."""
+        title = self._note_title(title, content)
+
+        with self._write() as con:
+            cursor = con.cursor()
+            cursor.execute(
+                """INSERT INTO notes (parent_id, type, title, content, content_blob, content_codec, content_size, order_key)
+                   VALUES (?, 'note', ?, ?, ?, ?, ?, ?)""",
+                (parent_id, title, *pack_note_content(content), self._last_order_key(cursor, parent_id))
+            )
+            note_id = cursor.lastrowid
+            self._sync_note_tags(cursor, note_id, content, old_tags=set())
+            return note_id
+
+    def create_folder(self, parent_id, title="Новая папка"):
+        """Создает новую папку."""
+        with self._write() as con:
+            cursor = con.cursor()
+            cursor.execute(
+                "INSERT INTO notes (parent_id, type, title, order_key) VALUES (?, 'folder', ?, ?)",
+                (parent_id, title, self._last_order_key(cursor, parent_id))
+            )
+            return cursor.lastrowid
+
+    def _last_order_key(self, cursor, parent_id):
+        """
+        Ключ порядка для нового элемента папки - после всех существующих.
+        Слишком длинный ключ ставит содержимое папки в очередь на перенумерацию
+        (она начнется после текущей транзакции: фоновый поток ждет писателя).
+        """
+        cursor.execute("SELECT MAX(order_key) FROM notes WHERE parent_id IS ?", (parent_id,))
+        order_key = order_key_between(cursor.fetchone()[0], None)
+        self._check_order_key(order_key, "notes", "parent_id IS ?", (parent_id,))
+        return order_key
+
+    def bulk_import(self, records, parent_id=None, batch_size=IMPORT_BATCH_SIZE, progress=None):
+        """
+        Массово вставляет папки и заметки.
+        records - итератор словарей {'type': 'folder'|'note', 'key', 'parent_key',
+        'title', 'content'}. key - любой идентификатор папки на стороне вызывающего
+        (например, путь), parent_key ссылается на ранее переданную папку;
+        None означает parent_id. Папка должна идти раньше своего содержимого.
+        Записи вставляются через executemany, по одной транзакции на batch_size
+        строк; ID назначаются заранее, поэтому папки разрешаются в памяти.
+        progress(notes, folders) вызывается после каждой зафиксированной пачки.
+        Возвращает (количество заметок, количество папок).
+        """
+        folder_ids = {None: parent_id}
+        note_count = folder_count = 0
+        parents = set()  # Папки, в которые что-то добавлено: им нужны ключи порядка
+        records = iter(records)
+
+        while True:
+            chunk = []
+            for record in records:
+                chunk.append(record)
+                if len(chunk) >= batch_size:
+                    break
+            if not chunk:
+                break
+
+            with self._write() as con:
+                cursor = con.cursor()
+                # Следующий свободный ID с учетом AUTOINCREMENT (ID удаленных не переиспользуем)
+                cursor.execute("""
+                    SELECT MAX(COALESCE((SELECT MAX(id) FROM notes), 0),
+                               COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'notes'), 0))
+                """)
+                next_id = cursor.fetchone()[0] + 1
+
+                rows = []
+                note_tags = []
+                for record in chunk:
+                    item_id = next_id
+                    next_id += 1
+                    parent = folder_ids.get(record.get('parent_key'), parent_id)
+                    parents.add(parent)
+                    if record['type'] == 'folder':
+                        folder_ids[record['key']] = item_id
+                        rows.append((item_id, parent, 'folder', record.get('title') or "Новая папка",
+                                     None, None, None, None))
+                        folder_count += 1
+                    else:
+                        content = record.get('content') or ""
+                        rows.append((item_id, parent, 'note', self._note_title(record.get('title'), content),
+                                     *pack_note_content(content)))
+                        note_tags.extend((item_id, name) for name in self._extract_tags(content))
+                        note_count += 1
+
+                cursor.executemany(
+                    """INSERT INTO notes (id, parent_id, type, title, content, content_blob, content_codec, content_size)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?)""", rows
                 )
-            """)
+                if note_tags:
+                    cursor.executemany("INSERT OR IGNORE INTO tags (name) VALUES (?)",
+                                       [(name,) for name in {name for _, name in note_tags}])
+                    cursor.executemany(
+                        "INSERT OR IGNORE INTO note_tags (tag_id, note_id) SELECT id, ? FROM tags WHERE name = ?",
+                        note_tags
+                    )
 
-            # Таблица для самих задач
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS tasks (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    list_id INTEGER NOT NULL,
-                    content TEXT NOT NULL,
-                    is_completed INTEGER DEFAULT 0,
-                    order_index INTEGER,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (list_id) REFERENCES task_lists (id) ON DELETE CASCADE
+            if progress:
+                progress(note_count, folder_count)
+
+        # Новые элементы вставлены без ключей: ставим их после существующих, по названию
+        with self._write() as con:
+            cursor = con.cursor()
+            for parent in parents:
+                cursor.execute(
+                    """SELECT id FROM notes WHERE parent_id IS ?
+                       ORDER BY order_key IS NULL, order_key, title COLLATE NOCASE, id""",
+                    (parent,)
                 )
-            """)
-            
-            # Триггеры для автоматического обновления поля updated_at
+                self._assign_order_keys(cursor, "notes", [row['id'] for row in cursor.fetchall()])
+
+        return note_count, folder_count
+
+    def update_note_content(self, note_id, title, content):
+        """
+        Обновляет заголовок и содержимое заметки.
+        Запись выполняется отложенно в фоновом потоке (см. WriteBehindQueue);
+        чтобы дождаться ее, используйте flush(). Возвращает заголовок в том
+        виде, в котором он будет сохранен.
+        """
+        # --- НОВАЯ ЛОГИКА: Очищаем title от хештегов ---
+        if title:
+            clean_title = re.sub(r'#', '', title).strip()
+            title = clean_title or "Обновленная заметка"
+        # --- КОНЕЦ НОВОЙ ЛОГИКИ ---
+
+        if self.pool.holds_writer():
+            # Внутри открытой транзакции пишем сразу, в ее составе
+            with self.pool.writer() as con:
+                self._update_note_row(con.cursor(), note_id, title, content)
+        else:
+            self.write_queue.put(note_id, title, content)
+        return title
+
+    def _update_note_row(self, cursor, note_id, title, content, force_revision=False):
+        cursor.execute("SELECT is_hidden FROM notes WHERE id = ?", (note_id,))
+        row = cursor.fetchone()
+        if row and row['is_hidden']:
+            # Зашифрованная заметка: без истории версий и тегов, чтобы текст не утек в открытом виде
+            cursor.execute(
+                """UPDATE notes SET title = ?, content = ?, content_blob = ?, content_codec = ?, content_size = ?,
+                                    updated_at = CURRENT_TIMESTAMP WHERE id = ?""",
+                (title, *self._seal_note_content(note_id, content), note_id)
+            )
+            return
+        self._record_revision(cursor, note_id, title, content, force=force_revision)
+        cursor.execute(
+            """UPDATE notes SET title = ?, content = ?, content_blob = ?, content_codec = ?, content_size = ?,
+                                updated_at = CURRENT_TIMESTAMP WHERE id = ?""",
+            (title, *pack_note_content(content), note_id)
+        )
+        self._sync_note_tags(cursor, note_id, content)
+
+    def _apply_queued_updates(self, take_batch):
+        """
+        Записывает пачку отложенных сохранений одной транзакцией (поток записи).
+        Возвращает [(note_id, title, content, ошибка)] для незаписанных - очередь повторит их.
+        """
+        batch = []
+        try:
+            with self.pool.writer() as con:
+                batch = take_batch()
+                cursor = con.cursor()
+                for note_id, title, content in batch:
+                    self._update_note_row(cursor, note_id, title, content)
+            return []
+        except Exception as e:
+            # Пачка откатилась целиком: пишем по одной, чтобы не задерживать остальные
+            print(f"Ошибка пакетной записи заметок, запись по одной: {e}")
+        failed = []
+        for note_id, title, content in batch:
+            try:
+                with self.pool.writer() as con:
+                    self._update_note_row(con.cursor(), note_id, title, content)
+            except Exception as item_error:
+                failed.append((note_id, title, content, item_error))
+        return failed
+
+    def _report_write_error(self, note_ids, message):
+        if self.on_write_error:
+            self.on_write_error(note_ids, message)
+
+    def delete_note_or_folder(self, item_id):
+        """Удаляет заметку или папку (и все ее содержимое). Возвращает ID удаленных элементов."""
+        return self.delete_subtree(item_id)
+
+    # --- Поддеревья и предки ---
+    # Все операции над содержимым папки - один запрос к БД, независимо от того,
+    # какие ветки уже загружены в виджет дерева. Точечные запросы идут по
+    # таблице замыкания note_paths, потоковый обход - через WITH RECURSIVE.
+
+    def get_descendant_ids(self, item_id):
+        """ID всех потомков элемента на любой глубине (без него самого)."""
+        with self._read() as con:
+            cursor = con.cursor()
+            cursor.execute("SELECT descendant_id FROM note_paths WHERE ancestor_id = ? AND depth > 0", (item_id,))
+            return [row['descendant_id'] for row in cursor.fetchall()]
+
+    def get_ancestors(self, item_id):
+        """Папки от корня до родителя элемента (для "хлебных крошек"): [{'id', 'title'}]."""
+        with self._read() as con:
+            cursor = con.cursor()
             cursor.execute("""
-                CREATE TRIGGER IF NOT EXISTS update_note_timestamp
-                AFTER UPDATE ON notes
-                FOR EACH ROW
-                BEGIN
-                    UPDATE notes SET updated_at = CURRENT_TIMESTAMP WHERE id = OLD.id;
-                END;
-            """)
+                SELECT n.id, n.title FROM note_paths p JOIN notes n ON n.id = p.ancestor_id
+                WHERE p.descendant_id = ? AND p.depth > 0
+                ORDER BY p.depth DESC
+            """, (item_id,))
+            return self._with_pending_titles([dict(row) for row in cursor.fetchall()])
+
+    def get_depth(self, item_id):
+        """Глубина элемента: 0 - в корне, 1 - в папке верхнего уровня и т.д."""
+        with self._read() as con:
+            cursor = con.cursor()
+            cursor.execute("SELECT MAX(depth) FROM note_paths WHERE descendant_id = ?", (item_id,))
+            return cursor.fetchone()[0] or 0
+
+    def get_descendant_notes(self, folder_id, fields=('id', 'title', 'content', 'created_at')):
+        """Заметки папки на любой глубине (список; для потоковой обработки - iter_subtree)."""
+        return list(self.iter_subtree(folder_id, fields=fields, notes_only=True))
 
-            # Проверяем, есть ли хоть один список задач, если нет - создаем "Default"
-            cursor.execute("SELECT COUNT(*) FROM task_lists")
-            if cursor.fetchone()[0] == 0:
-                cursor.execute("INSERT INTO task_lists (name, order_index) VALUES (?, ?)", ("Default", 0))
+    def count_descendants(self, item_id):
+        """Считает содержимое папки на любой глубине: {'notes', 'folders'}."""
+        with self._read() as con:
+            cursor = con.cursor()
+            cursor.execute("""
+                SELECT COALESCE(SUM(n.type = 'note'), 0) AS notes, COALESCE(SUM(n.type = 'folder'), 0) AS folders
+                FROM note_paths p JOIN notes n ON n.id = p.descendant_id
+                WHERE p.ancestor_id = ? AND p.depth > 0
+            """, (item_id,))
+            return dict(cursor.fetchone())
 
+    def get_folder_note_counts(self):
+        """Число заметок в каждой папке с учетом вложенных: {folder_id: count}."""
+        with self._read() as con:
+            cursor = con.cursor()
+            # Каждая заметка засчитывается всем своим предкам
             cursor.execute("""
-                CREATE TABLE IF NOT EXISTS security (
-                    id INTEGER PRIMARY KEY CHECK (id = 1), -- Гарантирует только одну строку
-                    password_hash TEXT,
-                    question1 TEXT,
-                    answer1_hash TEXT,
-                    question2 TEXT,
-                    answer2_hash TEXT
-                )
+                SELECT p.ancestor_id, COUNT(*) AS notes
+                FROM note_paths p JOIN notes n ON n.id = p.descendant_id
+                WHERE p.depth > 0 AND n.type = 'note'
+                GROUP BY p.ancestor_id
             """)
+            return {row['ancestor_id']: row['notes'] for row in cursor.fetchall()}
 
-            con.commit()
+    def delete_subtree(self, item_id):
+        """
+        Удаляет элемент со всеми потомками одним запросом (не полагаясь на каскад).
+        Связи с тегами и версии удаляются каскадом внешних ключей.
+        Возвращает ID удаленных элементов.
+        """
+        with self._write() as con:
+            cursor = con.cursor()
+            cursor.execute("SELECT descendant_id FROM note_paths WHERE ancestor_id = ? ORDER BY depth", (item_id,))
+            removed_ids = [row['descendant_id'] for row in cursor.fetchall()]
+            cursor.execute("DELETE FROM notes WHERE id IN (SELECT descendant_id FROM note_paths WHERE ancestor_id = ?)",
+                           (item_id,))
+        return removed_ids
 
-    # --- Методы для работы с Заметками и Папками ---
+    def would_create_cycle(self, item_id, new_parent_id):
+        """True, если new_parent_id - сам элемент или его потомок (папку нельзя вложить в себя)."""
+        with self._read() as con:
+            return self._creates_cycle(con.cursor(), item_id, new_parent_id)
 
-    def get_note_tree(self):
+    @staticmethod
+    def _creates_cycle(cursor, item_id, new_parent_id):
+        if new_parent_id is None:
+            return False
+        cursor.execute("SELECT 1 FROM note_paths WHERE ancestor_id = ? AND descendant_id = ?",
+                       (item_id, new_parent_id))
+        return cursor.fetchone() is not None
+
+    def _check_move(self, cursor, item_id, new_parent_id):
+        if self._creates_cycle(cursor, item_id, new_parent_id):
+            raise ValueError(f"Нельзя переместить элемент {item_id} внутрь самого себя")
+
+        # --- НОВЫЕ МЕТОДЫ ДЛЯ ПЕРЕМЕЩЕНИЯ ---
+    def move_item(self, item_id, new_parent_id):
+        """Перемещает заметку или папку к новому родителю (ValueError, если это создаст цикл)."""
+        with self._write() as con:
+            cursor = con.cursor()
+            self._check_move(cursor, item_id, new_parent_id)
+            # new_parent_id может быть None для перемещения в корень; элемент встает в конец папки
+            cursor.execute(
+                "UPDATE notes SET parent_id = ?, order_key = ? WHERE id = ?",
+                (new_parent_id, self._last_order_key(cursor, new_parent_id), item_id)
+            )
+
+    def update_item_parent_and_order(self, item_id, new_parent_id, siblings_ids):
         """
-        Извлекает все заметки и папки и строит из них древовидную структуру.
-        Возвращает список словарей.
+        Обновляет родителя для элемента и порядок всех элементов
+        на том же уровне.
         """
-        with self._get_connection() as con:
+        with self._write() as con:
             cursor = con.cursor()
-            cursor.execute("SELECT id, parent_id, type, title, is_pinned FROM notes ORDER BY title COLLATE NOCASE")
-            rows = cursor.fetchall()
-            
-            nodes = {row['id']: dict(row) for row in rows}
-            tree = []
-            
-            for node_id, node in nodes.items():
-                if node['parent_id'] is None:
-                    tree.append(node)
-                else:
-                    parent = nodes.get(node['parent_id'])
-                    if parent:
-                        if 'children' not in parent:
-                            parent['children'] = []
-                        parent['children'].append(node)
-            
-            # Сортировка: сначала папки, потом заметки, затем по названию
-            def sort_key(item):
-                is_folder = 1 if item['type'] == 'folder' else 2
-                is_pinned = 0 if item.get('is_pinned', 0) else 1
-                return (is_pinned, is_folder, item['title'])
-
-            def sort_tree(nodes_list):
-                nodes_list.sort(key=sort_key)
-                for node in nodes_list:
-                    if 'children' in node:
-                        sort_tree(node['children'])
-            
-            sort_tree(tree)
-            return tree
-            
-    def get_all_notes_flat(self):
-        """Возвращает плоский список всех заметок со всем их содержимым."""
-        with self._get_connection() as con:
+            self._check_move(cursor, item_id, new_parent_id)
+            cursor.execute("SELECT parent_id FROM notes WHERE id = ?", (item_id,))
+            row = cursor.fetchone()
+            if not row:
+                return
+            # 1. Обновляем родителя для перетаскиваемого элемента
+            if row['parent_id'] != new_parent_id:
+                cursor.execute(
+                    "UPDATE notes SET parent_id = ?, order_key = ? WHERE id = ?",
+                    (new_parent_id, self._last_order_key(cursor, new_parent_id), item_id)
+                )
+
+            # 2. Ставим элемент между соседями: меняется только его order_key
+            if item_id in siblings_ids:
+                before_id, after_id = self._order_neighbours(cursor, item_id, siblings_ids)
+                self._move_ordered_row("notes", item_id, before_id, after_id)
+
+    @staticmethod
+    def _order_neighbours(cursor, item_id, siblings_ids):
+        """
+        Ближайшие соседи элемента из той же группы сортировки (тип и закрепление)
+        в порядке siblings_ids: (выше, ниже). Элементы другой группы стоят
+        отдельно, их ключи с ключом элемента не сравниваются.
+        """
+        placeholders = ", ".join("?" * len(siblings_ids))
+        cursor.execute(f"SELECT id, type, is_pinned FROM notes WHERE id IN ({placeholders})", list(siblings_ids))
+        groups = {row['id']: (row['type'], row['is_pinned']) for row in cursor.fetchall()}
+        index = siblings_ids.index(item_id)
+        group = groups.get(item_id)
+        before_id = next((sid for sid in reversed(siblings_ids[:index]) if groups.get(sid) == group), None)
+        after_id = next((sid for sid in siblings_ids[index + 1:] if groups.get(sid) == group), None)
+        return before_id, after_id
+
+
+    def get_parent_id(self, item_id):
+        """Возвращает ID родителя для указанного элемента."""
+        with self._read() as con:
             cursor = con.cursor()
-            cursor.execute("SELECT id, content, created_at FROM notes WHERE type = 'note'")
-            return [dict(row) for row in cursor.fetchall()]
+            cursor.execute("SELECT parent_id FROM notes WHERE id = ?", (item_id,))
+            row = cursor.fetchone()
+            return row['parent_id'] if row else None
+
+    def get_compression_report(self):
+        """
+        Возвращает отчет о сжатии заметок: {'compressed_notes',
+        'original_bytes', 'stored_bytes', 'saved_bytes'}.
+        """
+        with self._read() as con:
+            return self._compression_report(con.cursor())
+
+    @staticmethod
+    def _compression_report(cursor):
+        cursor.execute("""
+            SELECT COUNT(*) AS compressed_notes,
+                   COALESCE(SUM(content_size), 0) AS original_bytes,
+                   COALESCE(SUM(length(content_blob)), 0) AS stored_bytes
+            FROM notes WHERE content_codec IS NOT NULL AND content_codec != ?
+        """, (ENCRYPTED_CODEC,))
+        report = dict(cursor.fetchone())
+        report['saved_bytes'] = report['original_bytes'] - report['stored_bytes']
+        return report
+
+    def get_children(self, parent_id, offset=0, limit=None):
+        """
+        Возвращает непосредственных потомков папки (None - корень) в порядке
+        дерева: закрепленные выше; папки, затем заметки; по ручному порядку
+        (order_key), затем по названию.
+        У каждого элемента есть флаг has_children, чтобы дерево могло
+        подгружать содержимое папки только при ее раскрытии.
+        """
+        with self._read() as con:
+            cursor = con.cursor()
+            cursor.execute(
+                f"""
+                SELECT n.id, n.parent_id, n.type, n.title, n.is_pinned, n.is_hidden, n.order_key,
+                       CASE WHEN n.type = 'folder'
+                            THEN EXISTS (SELECT 1 FROM notes c WHERE c.parent_id = n.id)
+                            ELSE 0 END AS has_children
+                FROM notes n
+                WHERE n.parent_id IS ?
+                ORDER BY {NOTE_ORDER_SQL}
+                LIMIT ? OFFSET ?
+                """,
+                (parent_id, -1 if limit is None else limit, offset)
+            )
+            return self._with_pending_titles([dict(row) for row in cursor.fetchall()])
+
+    def get_ancestor_ids(self, item_id):
+        """Возвращает ID папок от корня до родителя указанного элемента."""
+        with self._read() as con:
+            cursor = con.cursor()
+            cursor.execute(
+                "SELECT ancestor_id FROM note_paths WHERE descendant_id = ? AND depth > 0 ORDER BY depth DESC",
+                (item_id,)
+            )
+            return [row['ancestor_id'] for row in cursor.fetchall()]
+    # --- КОНЕЦ НОВЫХ МЕТОДОВ ---
+
+
+    # --- Холодный архив ---
+    # Давно не менявшиеся заметки и папки переносятся в отдельный файл
+    # archive.db: основная база, ее сканы и бэкапы остаются маленькими.
+    # Архив подключается (ATTACH) к соединению только на время операции.
+    # ID элементов в архиве сохраняются (AUTOINCREMENT их не переиспользует),
+    # поэтому при возврате зашифрованные заметки открываются тем же ключом.
 
-    def get_all_notes_for_refresh(self):
-        """Возвращает плоский список всех заметок с полями для обновления UI."""
-        with self._get_connection() as con:
+    @contextmanager
+    def _archive_connection(self, write=False):
+        """
+        Соединение с подключенным архивом (схема archive).
+        write=True - пишущая транзакция, фиксируется до отключения архива.
+        В режиме WAL транзакция с двумя файлами атомарна только для каждого
+        из них отдельно, поэтому перенос фиксирует копию до удаления
+        оригинала: при сбое элемент может задвоиться, но не пропасть.
+        """
+        if self.pool.holds_writer():
+            raise sqlite3.ProgrammingError("Архив нельзя подключить внутри открытой транзакции.")
+        with (self._write() if write else self._read()) as con:
+            con.execute("ATTACH DATABASE ? AS archive", (self.archive_path,))
+            try:
+                if write:
+                    self._create_archive_schema(con.cursor())
+                yield con
+                if write:
+                    con.commit()
+            except BaseException:
+                if write:
+                    con.rollback()
+                raise
+            finally:
+                con.execute("DETACH DATABASE archive")
+
+    @staticmethod
+    def _create_archive_schema(cursor):
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS archive.archived_notes (
+                id INTEGER PRIMARY KEY,
+                parent_id INTEGER,
+                type TEXT NOT NULL,
+                title TEXT,
+                content TEXT,
+                content_blob BLOB,
+                content_codec TEXT,
+                content_size INTEGER,
+                is_pinned INTEGER DEFAULT 0,
+                is_hidden INTEGER DEFAULT 0,
+                order_key TEXT,
+                created_at TIMESTAMP,
+                updated_at TIMESTAMP,
+                archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                is_root INTEGER DEFAULT 0,   -- Верхний элемент архивированного поддерева
+                origin_path TEXT             -- Путь папок, где элемент лежал до архивации
+            )
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS archive.idx_archived_children
+            ON archived_notes (parent_id, type, order_key)
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS archive.idx_archived_roots ON archived_notes (is_root)")
+        # История версий уходит в архив вместе с заметкой и возвращается при восстановлении
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS archive.archived_revisions (
+                note_id INTEGER NOT NULL,
+                revision INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                title TEXT,
+                data BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created_at TIMESTAMP,
+                PRIMARY KEY (note_id, revision)
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("""
+            CREATE VIEW IF NOT EXISTS archive.archive_fts_source AS
+            SELECT id, title, note_text(content, content_blob, content_codec) AS content
+            FROM archived_notes WHERE type = 'note'
+        """)
+        # Индекс обновляется явно при переносе в архив и обратно (без триггеров)
+        cursor.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS archive.archive_fts USING fts5(
+                title, content,
+                content='archive_fts_source', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2',
+                prefix='2 3'
+            )
+        """)
+
+    @staticmethod
+    def _fill_archive_ids(cursor, ids):
+        """Кладет ID во временную таблицу temp.archive_ids (вместо длинных списков параметров)."""
+        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS archive_ids (id INTEGER PRIMARY KEY)")
+        cursor.execute("DELETE FROM temp.archive_ids")
+        cursor.executemany("INSERT OR IGNORE INTO temp.archive_ids (id) VALUES (?)", [(item_id,) for item_id in ids])
+
+    @staticmethod
+    def _archive_ready(cursor):
+        """Создана ли в подключенном архиве схема (файл мог появиться пустым)."""
+        cursor.execute("SELECT 1 FROM archive.sqlite_master WHERE type = 'table' AND name = 'archived_notes'")
+        return cursor.fetchone() is not None
+
+    def has_archive(self):
+        """Есть ли в архиве хотя бы один элемент."""
+        if not os.path.exists(self.archive_path):
+            return False
+        with self._archive_connection() as con:
             cursor = con.cursor()
-            cursor.execute("SELECT id, title, is_pinned FROM notes WHERE type = 'note'")
-            return [dict(row) for row in cursor.fetchall()]
+            if not self._archive_ready(cursor):
+                return False
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM archive.archived_notes)")
+            return bool(cursor.fetchone()[0])
 
-    def get_note_details(self, note_id):
-        """Возвращает полную информацию о заметке по ее ID."""
-        with self._get_connection() as con:
+    def find_stale_items(self, months):
+        """
+        Верхние элементы, которые не менялись months месяцев: заметки и папки,
+        у которых ни сам элемент, ни один потомок не обновлялся позже порога
+        и нет закрепленных. Вложенные элементы таких папок не перечисляются.
+        """
+        with self._read() as con:
             cursor = con.cursor()
-            cursor.execute("SELECT * FROM notes WHERE id = ?", (note_id,))
-            row = cursor.fetchone()
-            return dict(row) if row else None
+            cursor.execute("""
+                WITH stale AS (
+                    SELECT p.ancestor_id AS id
+                    FROM note_paths p JOIN notes d ON d.id = p.descendant_id
+                    GROUP BY p.ancestor_id
+                    HAVING MAX(d.updated_at) < datetime('now', ?) AND MAX(d.is_pinned) = 0
+                )
+                SELECT n.id FROM notes n JOIN stale s ON s.id = n.id
+                WHERE n.parent_id IS NULL OR n.parent_id NOT IN (SELECT id FROM stale)
+            """, (f"-{int(months)} months",))
+            return [row['id'] for row in cursor.fetchall()]
 
-    def create_note(self, parent_id, title="Новая заметка", content=""):
-        """Создает новую заметку."""
-        # --- НОВАЯ ЛОГИКА: Генерируем title без хештегов ---
-        if not title and content:
-            first_line = content.split('\n', 1)[0].strip()
-            # Удаляем все символы # из первой строки для создания заголовка
-            clean_title = re.sub(r'#', '', first_line).strip()
-            title = clean_title or "Новая заметка"
-        elif title:
-            clean_title = re.sub(r'#', '', title).strip()
-            title = clean_title or "Новая заметка"
-        # --- КОНЕЦ НОВОЙ ЛОГИКИ ---
-            
-        with self._get_connection() as con:
+    def archive_stale_items(self, months):
+        """Переносит в архив все, что не менялось months месяцев. Возвращает ID перенесенных."""
+        root_ids = self.find_stale_items(months)
+        return self.archive_items(root_ids) if root_ids else []
+
+    def archive_items(self, item_ids):
+        """
+        Переносит элементы вместе с поддеревьями в архив.
+        История версий переносится в archive.archived_revisions; теги в
+        основной базе удаляются (при возврате они восстанавливаются из текста).
+        Возвращает ID всех перенесенных элементов.
+        """
+        if not item_ids:
+            return []
+        with self._archive_connection(write=True) as con:
             cursor = con.cursor()
-            cursor.execute(
-                "INSERT INTO notes (parent_id, type, title, content) VALUES (?, 'note', ?, ?)",
-                (parent_id, title, content)
+            self._fill_archive_ids(cursor, item_ids)
+            subtree = "SELECT descendant_id FROM note_paths WHERE ancestor_id IN (SELECT id FROM temp.archive_ids)"
+            cursor.execute(subtree)
+            archived_ids = [row['descendant_id'] for row in cursor.fetchall()]
+            # Копии, оставшиеся в архиве после сбоя между двумя фиксациями, заменяются
+            cursor.execute(f"""
+                INSERT INTO archive.archive_fts (archive_fts, rowid, title, content)
+                SELECT 'delete', id, title, content FROM archive.archive_fts_source WHERE id IN ({subtree})
+            """)
+            cursor.execute(f"DELETE FROM archive.archived_notes WHERE id IN ({subtree})")
+            cursor.execute(f"DELETE FROM archive.archived_revisions WHERE note_id IN ({subtree})")
+            cursor.execute(f"""
+                INSERT INTO archive.archived_revisions (note_id, revision, kind, title, data, size, created_at)
+                SELECT note_id, revision, kind, title, data, size, created_at
+                FROM note_revisions WHERE note_id IN ({subtree})
+            """)
+            cursor.execute(f"""
+                INSERT INTO archive.archived_notes
+                    (id, parent_id, type, title, content, content_blob, content_codec, content_size,
+                     is_pinned, is_hidden, order_key, created_at, updated_at, is_root)
+                SELECT id, parent_id, type, title, content, content_blob, content_codec, content_size,
+                       is_pinned, is_hidden, order_key, created_at, updated_at,
+                       id IN (SELECT id FROM temp.archive_ids)
+                FROM notes WHERE id IN ({subtree})
+            """)
+            # Путь папок для верхних элементов: показывается в архиве и нужен пользователю при поиске
+            cursor.executemany(
+                """UPDATE archive.archived_notes SET origin_path = (
+                       SELECT group_concat(title, ' / ') FROM (
+                           SELECT a.title FROM note_paths p JOIN notes a ON a.id = p.ancestor_id
+                           WHERE p.descendant_id = ? AND p.depth > 0 ORDER BY p.depth DESC
+                       )
+                   ) WHERE id = ?""",
+                [(item_id, item_id) for item_id in item_ids]
             )
+            # Ранее архивированные элементы этих папок становятся обычными потомками
+            cursor.execute(f"""
+                UPDATE archive.archived_notes SET is_root = 0
+                WHERE is_root = 1 AND parent_id IN ({subtree})
+            """)
+            cursor.execute(f"""
+                INSERT INTO archive.archive_fts (rowid, title, content)
+                SELECT id, title, content FROM archive.archive_fts_source WHERE id IN ({subtree})
+            """)
+            self._reserve_archived_ids(cursor)
+            # Архив фиксируется первым: при сбое элемент задвоится, но не пропадет.
+            # История версий в основной базе удаляется триггером вместе с заметками
             con.commit()
-            return cursor.lastrowid
+            cursor.execute(f"DELETE FROM notes WHERE id IN ({subtree})")
+        for item_id in archived_ids:
+            self.decrypted_cache.discard(item_id)
+        return archived_ids
 
-    def create_folder(self, parent_id, title="Новая папка"):
-        """Создает новую папку."""
-        with self._get_connection() as con:
+    def restore_from_archive(self, item_id):
+        """
+        Возвращает элемент архива вместе с его архивным поддеревом.
+        Верхний элемент попадает в исходную папку, если она еще существует,
+        иначе в корень. Возвращенные элементы считаются измененными сейчас,
+        чтобы следующее обслуживание не унесло их обратно.
+        Элементы возвращаются под прежними ID (к ним привязано шифрование);
+        если какой-то ID уже занят в основной базе, возврат отменяется
+        с sqlite3.IntegrityError и элемент остается в архиве.
+        Возвращает ID возвращенных элементов (первым - сам элемент).
+        """
+        if not os.path.exists(self.archive_path):
+            return []
+        with self._archive_connection(write=True) as con:
             cursor = con.cursor()
-            cursor.execute(
-                "INSERT INTO notes (parent_id, type, title) VALUES (?, 'folder', ?)",
-                (parent_id, title)
-            )
-            con.commit()
-            return cursor.lastrowid
+            cursor.execute("SELECT parent_id, is_root FROM archive.archived_notes WHERE id = ?", (item_id,))
+            row = cursor.fetchone()
+            if not row:
+                return []
+            parent_id = None
+            if row['is_root'] and row['parent_id'] is not None:
+                cursor.execute("SELECT 1 FROM notes WHERE id = ? AND type = 'folder'", (row['parent_id'],))
+                if cursor.fetchone():
+                    parent_id = row['parent_id']
 
-    def update_note_content(self, note_id, title, content):
-        """Обновляет заголовок и содержимое заметки."""
-        # --- НОВАЯ ЛОГИКА: Очищаем title от хештегов ---
-        if title:
-            clean_title = re.sub(r'#', '', title).strip()
-            title = clean_title or "Обновленная заметка"
-        # --- КОНЕЦ НОВОЙ ЛОГИКИ ---
-        
-        with self._get_connection() as con:
-            con.execute(
-                "UPDATE notes SET title = ?, content = ? WHERE id = ?",
-                (title, content, note_id)
+            # Родители вставляются раньше потомков (этого требуют note_paths и внешний ключ)
+            cursor.execute("""
+                WITH RECURSIVE subtree(id, depth) AS (
+                    SELECT ?, 0
+                    UNION ALL
+                    SELECT a.id, s.depth + 1 FROM archive.archived_notes a JOIN subtree s ON a.parent_id = s.id
+                )
+                SELECT a.*, note_text(a.content, a.content_blob, a.content_codec) AS text
+                FROM subtree s JOIN archive.archived_notes a ON a.id = s.id
+                ORDER BY s.depth
+            """, (item_id,))
+            rows = cursor.fetchall()
+            restored_ids = [row['id'] for row in rows]
+            self._fill_archive_ids(cursor, restored_ids)
+            cursor.execute("SELECT id FROM notes WHERE id IN (SELECT id FROM temp.archive_ids)")
+            if taken_ids := [taken['id'] for taken in cursor.fetchall()]:
+                raise sqlite3.IntegrityError(f"ID {taken_ids} уже заняты в основной базе, элемент оставлен в архиве.")
+            cursor.executemany(
+                """INSERT INTO notes (id, parent_id, type, title, content, content_blob, content_codec,
+                                      content_size, is_pinned, is_hidden, order_key, created_at, updated_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)""",
+                [(row['id'], parent_id if row['id'] == item_id else row['parent_id'], row['type'], row['title'],
+                  row['content'], row['content_blob'], row['content_codec'], row['content_size'],
+                  row['is_pinned'], row['is_hidden'],
+                  self._last_order_key(cursor, parent_id) if row['id'] == item_id else row['order_key'],
+                  row['created_at'])
+                 for row in rows]
             )
+            for row in rows:
+                if row['type'] == 'note':
+                    self._sync_note_tags(cursor, row['id'], row['text'], old_tags=set())
+            cursor.execute("""
+                INSERT OR IGNORE INTO note_revisions (note_id, revision, kind, title, data, size, created_at)
+                SELECT note_id, revision, kind, title, data, size, created_at
+                FROM archive.archived_revisions WHERE note_id IN (SELECT id FROM temp.archive_ids)
+            """)
+            # Сначала фиксируется возврат в основную базу, затем удаление из архива
             con.commit()
 
-    def delete_note_or_folder(self, item_id):
-        """Удаляет заметку или папку (и все ее содержимое)."""
-        with self._get_connection() as con:
-            # Благодаря ON DELETE CASCADE, удаление папки удалит все вложенные элементы.
-            con.execute("DELETE FROM notes WHERE id = ?", (item_id,))
-            con.commit()
+            cursor.execute("""
+                INSERT INTO archive.archive_fts (archive_fts, rowid, title, content)
+                SELECT 'delete', id, title, content FROM archive.archive_fts_source
+                WHERE id IN (SELECT id FROM temp.archive_ids)
+            """)
+            cursor.execute("DELETE FROM archive.archived_notes WHERE id IN (SELECT id FROM temp.archive_ids)")
+            cursor.execute("DELETE FROM archive.archived_revisions WHERE note_id IN (SELECT id FROM temp.archive_ids)")
+        return restored_ids
 
-        # --- НОВЫЕ МЕТОДЫ ДЛЯ ПЕРЕМЕЩЕНИЯ ---
-    def move_item(self, item_id, new_parent_id):
-        """Перемещает заметку или папку к новому родителю."""
-        with self._get_connection() as con:
-            # new_parent_id может быть None для перемещения в корень
-            con.execute("UPDATE notes SET parent_id = ? WHERE id = ?", (new_parent_id, item_id))
-            con.commit()
+    @staticmethod
+    def _reserve_archived_ids(cursor):
+        """
+        Не дает AUTOINCREMENT снова выдать ID, занятые в архиве: счетчик notes
+        в sqlite_sequence поднимается до наибольшего архивного ID. Иначе новая
+        заметка заняла бы ID архивной, и вернуть ту было бы некуда.
+        """
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM archive.archived_notes")
+        max_archived = cursor.fetchone()[0]
+        if not max_archived:
+            return
+        cursor.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'notes'", (max_archived,))
+        if not cursor.rowcount:
+            cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('notes', ?)", (max_archived,))
 
-    def update_item_parent_and_order(self, item_id, new_parent_id, siblings_ids):
+    def _reconcile_archive(self):
         """
-        Обновляет родителя для элемента и порядок всех элементов
-        на том же уровне.
+        Согласует архив с основной базой (при запуске и после восстановления
+        из копии). Из архива удаляются элементы, которые есть в основной базе:
+        их оставила копия, снятая до архивации, или сбой между двумя фиксациями
+        переноса. Архивные потомки таких элементов становятся верхними
+        элементами архива и при возврате попадают в свою папку, если она есть.
+        Затем архивные ID резервируются (_reserve_archived_ids).
+        Возвращает число удаленных из архива элементов.
         """
-        with self._get_connection() as con:
+        if not os.path.exists(self.archive_path):
+            return 0
+        with self._archive_connection(write=True) as con:
             cursor = con.cursor()
-            # 1. Обновляем родителя для перетаскиваемого элемента
-            cursor.execute("UPDATE notes SET parent_id = ? WHERE id = ?", (new_parent_id, item_id))
-            
-            # 2. Обновляем порядок для всех "соседей"
-            # (эта часть пока не используется, но будет полезна для сортировки)
-            # for index, sibling_id in enumerate(siblings_ids):
-            #     cursor.execute("UPDATE notes SET order_index = ? WHERE id = ?", (index, sibling_id))
+            self._fill_archive_ids(cursor, [])
+            cursor.execute("""
+                INSERT INTO temp.archive_ids (id)
+                SELECT a.id FROM archive.archived_notes a JOIN notes n ON n.id = a.id
+            """)
+            dropped = cursor.rowcount
+            if dropped:
+                cursor.execute("""
+                    INSERT INTO archive.archive_fts (archive_fts, rowid, title, content)
+                    SELECT 'delete', id, title, content FROM archive.archive_fts_source
+                    WHERE id IN (SELECT id FROM temp.archive_ids)
+                """)
+                cursor.execute("DELETE FROM archive.archived_notes WHERE id IN (SELECT id FROM temp.archive_ids)")
+                cursor.execute("DELETE FROM archive.archived_revisions WHERE note_id IN (SELECT id FROM temp.archive_ids)")
+                cursor.execute("""
+                    UPDATE archive.archived_notes SET is_root = 1
+                    WHERE is_root = 0 AND parent_id IN (SELECT id FROM temp.archive_ids)
+                """)
+            self._reserve_archived_ids(cursor)
+        if dropped:
+            print(f"Из архива убраны элементы, которые есть в основной базе: {dropped}")
+        return dropped
 
-            con.commit()
+    def get_archived_children(self, parent_id=None):
+        """
+        Содержимое архива для ленивого дерева: parent_id=None - верхние
+        элементы архива, иначе - потомки архивной папки. Поля как у
+        get_children плюс archived=True, origin_path и archived_at.
+        """
+        if not os.path.exists(self.archive_path):
+            return []
+        with self._archive_connection() as con:
+            cursor = con.cursor()
+            if not self._archive_ready(cursor):
+                return []
+            condition = "n.is_root = 1" if parent_id is None else "n.parent_id = ? AND n.is_root = 0"
+            cursor.execute(f"""
+                SELECT n.id, n.parent_id, n.type, n.title, n.is_pinned, n.is_hidden, n.order_key,
+                       n.origin_path, n.archived_at, 1 AS archived,
+                       CASE WHEN n.type = 'folder'
+                            THEN EXISTS (SELECT 1 FROM archive.archived_notes c WHERE c.parent_id = n.id)
+                            ELSE 0 END AS has_children
+                FROM archive.archived_notes n
+                WHERE {condition}
+                ORDER BY {NOTE_ORDER_SQL}
+            """, () if parent_id is None else (parent_id,))
+            return [dict(row) for row in cursor.fetchall()]
 
-    def get_parent_id(self, item_id):
-        """Возвращает ID родителя для указанного элемента."""
-        with self._get_connection() as con:
+    def get_archived_note(self, note_id):
+        """
+        Архивная заметка для просмотра: {'id', 'title', 'content', 'is_hidden',
+        'origin_path', 'updated_at', 'archived_at'} или None.
+        Текст зашифрованной заметки расшифровывается, если ключ доступен.
+        """
+        if not os.path.exists(self.archive_path):
+            return None
+        with self._archive_connection() as con:
             cursor = con.cursor()
-            cursor.execute("SELECT parent_id FROM notes WHERE id = ?", (item_id,))
+            cursor.execute("""
+                SELECT id, title, content, content_blob, content_codec, is_hidden,
+                       origin_path, updated_at, archived_at
+                FROM archive.archived_notes WHERE id = ? AND type = 'note'
+            """, (note_id,))
             row = cursor.fetchone()
-            return row['parent_id'] if row else None
-    # --- КОНЕЦ НОВЫХ МЕТОДОВ ---
+        if not row:
+            return None
+        note = dict(row)
+        content, blob, codec = note.pop('content'), note.pop('content_blob'), note.pop('content_codec')
+        if codec == ENCRYPTED_CODEC:
+            note['content'] = self._open_note_content(note_id, blob, cache=False)
+        else:
+            note['content'] = unpack_note_content(content, blob, codec)
+        return note
+
+    def _search_archive(self, fts_query, search_text, tag, limit):
+        """Поиск по архиву для search_notes(include_archive=True)."""
+        if not os.path.exists(self.archive_path):
+            return []
+        with self._archive_connection() as con:
+            cursor = con.cursor()
+            if not self._archive_ready(cursor):
+                return []
+            params = []
+            if fts_query:
+                query = """SELECT f.rowid AS id, a.title, a.origin_path FROM archive.archive_fts f
+                           JOIN archive.archived_notes a ON a.id = f.rowid
+                           WHERE archive_fts MATCH ?"""
+                params.append(fts_query)
+            elif search_text:
+                query = """SELECT a.id, a.title, a.origin_path FROM archive.archived_notes a WHERE a.type = 'note'
+                           AND (a.title LIKE ? OR note_text(a.content, a.content_blob, a.content_codec) LIKE ?)"""
+                params.extend([f'%{search_text}%', f'%{search_text}%'])
+            else:
+                query = "SELECT a.id, a.title, a.origin_path FROM archive.archived_notes a WHERE a.type = 'note'"
+            if tag:
+                # Индекса тегов у архива нет: тег ищется в тексте
+                query += " AND note_text(a.content, a.content_blob, a.content_codec) LIKE ?"
+                params.append(f'%#{tag}%')
+            if fts_query:
+                query += " ORDER BY rank"
+            if limit:
+                query += " LIMIT ?"
+                params.append(limit)
+            cursor.execute(query, params)
+            return [{**dict(row), 'snippet': None, 'archived': True} for row in cursor.fetchall()]
 
 
     # --- Методы для работы с Задачами ---
 
     def get_all_task_lists(self):
         """Возвращает все списки задач."""
-        with self._get_connection() as con:
+        with self._read() as con:
             cursor = con.cursor()
-            cursor.execute("SELECT id, name FROM task_lists ORDER BY order_index, name")
+            cursor.execute("SELECT id, name FROM task_lists ORDER BY order_key, id")
             return [dict(row) for row in cursor.fetchall()]
 
     def get_tasks_for_list(self, list_id):
         """Возвращает все задачи для конкретного списка."""
-        with self._get_connection() as con:
+        with self._read() as con:
             cursor = con.cursor()
             cursor.execute(
-                "SELECT id, content, is_completed FROM tasks WHERE list_id = ? ORDER BY order_index, created_at",
+                "SELECT id, content, is_completed FROM tasks WHERE list_id = ? ORDER BY order_key, id",
                 (list_id,)
             )
             return [dict(row) for row in cursor.fetchall()]
 
     def add_task(self, list_id, content):
         """Добавляет новую задачу в список."""
-        with self._get_connection() as con:
-            con.execute(
-                "INSERT INTO tasks (list_id, content) VALUES (?, ?)",
-                (list_id, content)
+        with self._write() as con:
+            cursor = con.cursor()
+            # Новая задача встает в конец списка
+            cursor.execute("SELECT MAX(order_key) FROM tasks WHERE list_id = ?", (list_id,))
+            order_key = order_key_between(cursor.fetchone()[0], None)
+            cursor.execute(
+                "INSERT INTO tasks (list_id, content, order_key) VALUES (?, ?, ?)",
+                (list_id, content, order_key)
             )
-            con.commit()
+        self._check_order_key(order_key, "tasks", "list_id = ?", (list_id,))
 
     def update_task(self, task_id, new_content=None, is_completed=None):
         """Обновляет текст или статус выполнения задачи."""
-        with self._get_connection() as con:
+        with self._write() as con:
             if new_content is not None:
                 con.execute("UPDATE tasks SET content = ? WHERE id = ?", (new_content, task_id))
             if is_completed is not None:
                 con.execute("UPDATE tasks SET is_completed = ? WHERE id = ?", (is_completed, task_id))
-            con.commit()
 
     def delete_task(self, task_id):
         """Удаляет задачу."""
-        with self._get_connection() as con:
+        with self._write() as con:
             con.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
-            con.commit()
 
     def update_tasks_order(self, list_id, ordered_task_ids):
-        """Обновляет порядок задач в списке."""
-        with self._get_connection() as con:
+        """Полностью перезаписывает порядок задач в списке (перенумерация ключей)."""
+        with self._write() as con:
+            self._assign_order_keys(con.cursor(), "tasks", ordered_task_ids, list_id=list_id)
+
+    def move_task(self, task_id, before_id=None, after_id=None):
+        """
+        Перемещает задачу между соседями: before_id - задача, которая окажется
+        непосредственно перед ней (выше), after_id - сразу после нее (ниже).
+        None означает начало или конец списка. Меняется только одна строка.
+        """
+        self._move_ordered_row("tasks", task_id, before_id, after_id)
+
+    def move_task_list(self, list_id, before_id=None, after_id=None):
+        """Перемещает список задач между соседями (аналогично move_task)."""
+        self._move_ordered_row("task_lists", list_id, before_id, after_id)
+
+    def _assign_order_keys(self, cursor, table, ordered_ids, list_id=None):
+        """Выдает строкам равномерно распределенные ключи в указанном порядке."""
+        keys = spread_order_keys(len(ordered_ids))
+        if table == "tasks" and list_id is not None:
+            cursor.executemany(
+                "UPDATE tasks SET order_key = ? WHERE id = ? AND list_id = ?",
+                [(key, row_id, list_id) for key, row_id in zip(keys, ordered_ids)]
+            )
+        else:
+            cursor.executemany(
+                f"UPDATE {table} SET order_key = ? WHERE id = ?",
+                list(zip(keys, ordered_ids))
+            )
+
+    def _order_group(self, cursor, table, row_id):
+        """Возвращает (условие, параметры) для строк той же группы, что и row_id."""
+        if table == "tasks":
+            cursor.execute("SELECT list_id FROM tasks WHERE id = ?", (row_id,))
+            row = cursor.fetchone()
+            return ("list_id = ?", (row['list_id'],)) if row else (None, None)
+        if table == "notes":
+            cursor.execute("SELECT parent_id, type, is_pinned FROM notes WHERE id = ?", (row_id,))
+            row = cursor.fetchone()
+            if not row:
+                return (None, None)
+            return ("parent_id IS ? AND type = ? AND is_pinned = ?", (row['parent_id'], row['type'], row['is_pinned']))
+        return ("1 = 1", ())
+
+    def _move_ordered_row(self, table, row_id, before_id, after_id):
+        with self._write() as con:
             cursor = con.cursor()
-            for index, task_id in enumerate(ordered_task_ids):
+            group_sql, group_params = self._order_group(cursor, table, row_id)
+            if group_sql is None:
+                return
+
+            def neighbour_key(neighbour_id):
+                if neighbour_id is None:
+                    return None
                 cursor.execute(
-                    "UPDATE tasks SET order_index = ? WHERE id = ? AND list_id = ?",
-                    (index, task_id, list_id)
+                    f"SELECT order_key FROM {table} WHERE id = ? AND {group_sql}",
+                    (neighbour_id, *group_params)
                 )
-            con.commit()
+                row = cursor.fetchone()
+                return row['order_key'] if row else None
+
+            before_key, after_key = neighbour_key(before_id), neighbour_key(after_id)
+            if before_key is not None and after_key is not None and before_key >= after_key:
+                # Ключи соседей испорчены (совпадают) - перенумеровываем группу сразу
+                self._rebalance_order(cursor, table, group_sql, group_params)
+                before_key, after_key = neighbour_key(before_id), neighbour_key(after_id)
+
+            new_key = order_key_between(before_key, after_key)
+            cursor.execute(f"UPDATE {table} SET order_key = ? WHERE id = ?", (new_key, row_id))
+
+        self._check_order_key(new_key, table, group_sql, group_params)
+
+    def _check_order_key(self, key, table, group_sql, group_params):
+        """Ставит группу в очередь на перенумерацию, если записанный ключ стал слишком длинным."""
+        if len(key) > ORDER_KEY_REBALANCE_LENGTH:
+            self._schedule_rebalance(table, group_sql, group_params)
+
+    def _rebalance_order(self, cursor, table, group_sql, group_params):
+        cursor.execute(f"SELECT id FROM {table} WHERE {group_sql} ORDER BY order_key, id", group_params)
+        self._assign_order_keys(cursor, table, [row['id'] for row in cursor.fetchall()])
+
+    def _schedule_rebalance(self, table, group_sql, group_params):
+        """
+        Перенумеровывает ключи группы в потоке записи, когда они стали слишком
+        длинными. Одна группа не встает в очередь дважды.
+        """
+        def run():
+            try:
+                with self._write() as con:
+                    self._rebalance_order(con.cursor(), table, group_sql, group_params)
+            except sqlite3.Error as e:
+                print(f"Ошибка перенумерации порядка ({table}): {e}")
+
+        self.write_queue.put_job((table, group_params), run)
 
 
         # --- НОВЫЕ МЕТОДЫ ДЛЯ СПИСКОВ ЗАДАЧ ---
     def add_task_list(self, name):
         """Добавляет новый список задач."""
-        with self._get_connection() as con:
+        with self._write() as con:
             cursor = con.cursor()
-            cursor.execute("SELECT MAX(order_index) FROM task_lists")
-            max_order = cursor.fetchone()[0]
-            next_order = (max_order or 0) + 1
-            cursor.execute("INSERT INTO task_lists (name, order_index) VALUES (?, ?)", (name, next_order))
-            con.commit()
-            return cursor.lastrowid
+            cursor.execute("SELECT MAX(order_key) FROM task_lists")
+            order_key = order_key_between(cursor.fetchone()[0], None)
+            cursor.execute("INSERT INTO task_lists (name, order_key) VALUES (?, ?)", (name, order_key))
+            list_id = cursor.lastrowid
+        self._check_order_key(order_key, "task_lists", "1 = 1", ())
+        return list_id
 
     def rename_task_list(self, list_id, new_name):
         """Переименовывает список задач."""
-        with self._get_connection() as con:
+        with self._write() as con:
             con.execute("UPDATE task_lists SET name = ? WHERE id = ?", (new_name, list_id))
-            con.commit()
 
     def delete_task_list(self, list_id):
         """Удаляет список задач и все задачи в нем."""
-        with self._get_connection() as con:
+        with self._write() as con:
             # ON DELETE CASCADE в схеме автоматически удалит все задачи
             con.execute("DELETE FROM task_lists WHERE id = ?", (list_id,))
-            con.commit()
 
     def rename_item(self, item_id, new_title):
-        """Обновляет ТОЛЬКО заголовок заметки или папки."""
+        """Обновляет ТОЛЬКО заголовок заметки или папки. Возвращает сохраненный заголовок."""
         clean_title = re.sub(r'#', '', new_title).strip()
         if not clean_title:
             clean_title = "Без названия"
             
-        with self._get_connection() as con:
+        with self._write() as con:
             con.execute(
                 "UPDATE notes SET title = ? WHERE id = ?",
                 (clean_title, item_id)
             )
-            con.commit()
+        return clean_title
 
     # --- НОВЫЙ МЕТОД ПОИСКА ---
-    def search_notes(self, search_text="", tag=""):
+    def search_notes(self, search_text="", tag="", limit=None, snippets=True, include_archive=False):
         """
         Ищет заметки по тексту и/или тегу.
-        Возвращает список ID подходящих заметок.
+        Текст ищется через полнотекстовый индекс notes_fts (по префиксам слов).
+        Возвращает список словарей {'id', 'snippet'}, отсортированный по
+        релевантности (bm25, совпадения в заголовке весят больше).
+        snippets=False пропускает построение фрагментов, если нужны только ID.
+        include_archive=True добавляет в конец совпадения из архива:
+        {'id', 'title', 'origin_path', 'snippet': None, 'archived': True}.
         """
-        with self._get_connection() as con:
+        # Индекс поиска обновляется при записи: дожидаемся отложенных сохранений
+        self.flush()
+        with self._read() as con:
             cursor = con.cursor()
-            
-            query = "SELECT id FROM notes WHERE type = 'note'"
             params = []
-            
-            if search_text:
-                # Ищем в заголовке ИЛИ в контенте
-                query += " AND (title LIKE ? OR content LIKE ?)"
+            fts_query = self._build_fts_query(search_text) if search_text else ""
+
+            if fts_query:
+                snippet_sql = (f"snippet(notes_fts, -1, ?, ?, '…', {SNIPPET_TOKENS})"
+                               if snippets else "NULL")
+                if snippets:
+                    params.extend([SNIPPET_OPEN, SNIPPET_CLOSE])
+                query = f"SELECT notes_fts.rowid AS id, {snippet_sql} AS snippet FROM notes_fts"
+                if tag:
+                    query += " JOIN notes n ON n.id = notes_fts.rowid"
+                query += " WHERE notes_fts MATCH ?"
+                params.append(fts_query)
+            elif search_text:
+                # В запросе нет ни одного слова (только символы) - индекс не поможет
+                query = """SELECT id, NULL AS snippet FROM notes n WHERE type = 'note'
+                           AND (title LIKE ? OR note_text(content, content_blob, content_codec) LIKE ?)"""
                 params.extend([f'%{search_text}%', f'%{search_text}%'])
-            
+            else:
+                query = "SELECT id, NULL AS snippet FROM notes n WHERE type = 'note'"
+
             if tag:
-                # Ищем тег как отдельное слово
-                query += " AND content LIKE ?"
-                params.append(f'%#{tag}%')
-            
+                # Фильтр по тегу берем из индекса note_tags
+                query += """ AND n.id IN (
+                    SELECT nt.note_id FROM note_tags nt JOIN tags t ON t.id = nt.tag_id WHERE t.name = ?
+                )"""
+                params.append(tag)
+
+            if fts_query:
+                # rank = bm25 с весами колонок; snippet() считается только для выданных строк
+                query += " ORDER BY rank"
+            if limit:
+                query += " LIMIT ?"
+                params.append(limit)
+
             cursor.execute(query, params)
-            return [row['id'] for row in cursor.fetchall()]
+            found = [dict(row) for row in cursor.fetchall()]
+        if include_archive and (search_text or tag):
+            found.extend(self._search_archive(fts_query, search_text, tag, limit))
+        return found
 
     def get_all_tags(self):
-        """Извлекает все теги из всех заметок."""
-        with self._get_connection() as con:
+        """Возвращает отсортированный список всех тегов из индекса."""
+        self.flush()
+        with self._read() as con:
             cursor = con.cursor()
-            cursor.execute("SELECT content FROM notes WHERE type = 'note'")
-            all_content = [row['content'] for row in cursor.fetchall() if row['content']]
-            
-            tags = set()
-            for text in all_content:
-                found = re.findall(r'#(\w+)', text)
-                tags.update(found)
-            return sorted(list(tags))
+            cursor.execute("SELECT name FROM tags ORDER BY name")
+            return [row['name'] for row in cursor.fetchall()]
+
+    def get_tag_counts(self):
+        """Возвращает список словарей {'name', 'count'}: сколько заметок у каждого тега."""
+        self.flush()
+        with self._read() as con:
+            cursor = con.cursor()
+            cursor.execute("""
+                SELECT t.name, COUNT(nt.note_id) AS count
+                FROM tags t JOIN note_tags nt ON nt.tag_id = t.id
+                GROUP BY t.id
+                ORDER BY count DESC, t.name
+            """)
+            return [dict(row) for row in cursor.fetchall()]
+
+    def get_note_ids_by_tag(self, tag):
+        """Возвращает ID заметок, содержащих указанный тег."""
+        self.flush()
+        with self._read() as con:
+            cursor = con.cursor()
+            cursor.execute(
+                "SELECT nt.note_id FROM note_tags nt JOIN tags t ON t.id = nt.tag_id WHERE t.name = ?",
+                (tag,)
+            )
+            return [row['note_id'] for row in cursor.fetchall()]
     # --- КОНЕЦ ---
     def remove_tag_from_all_notes(self, tag):
         """Удаляет указанный тег (#tag) из всех заметок."""
-        with self._get_connection() as con:
-            cursor = con.cursor()
-            cursor.execute("SELECT id, content FROM notes WHERE type = 'note' AND content LIKE ?", (f'%#{tag}%',))
-            notes_to_update = cursor.fetchall()
+        return self.delete_tag(tag)
 
-            for note in notes_to_update:
-                note_id = note['id']
-                old_content = note['content']
-                # Заменяем тег, учитывая, что он может быть отдельным словом
-                new_content = re.sub(r'\s*#' + re.escape(tag) + r'\b', ' ', old_content).strip()
-                
-                # Обновляем заголовок, если он изменился
-                new_title = new_content.split('\n', 1)[0].strip() or "Без названия"
-                clean_title = re.sub(r'#', '', new_title).strip()
+    # --- Массовые операции с тегами: переименование, слияние, удаление ---
 
-                con.execute(
-                    "UPDATE notes SET title = ?, content = ? WHERE id = ?",
-                    (new_content, clean_title, note_id)
+    @staticmethod
+    def _normalize_tag(tag):
+        """Убирает ведущий # и проверяет, что тег состоит из букв, цифр и _."""
+        name = (tag or "").strip().lstrip('#')
+        if not re.fullmatch(r'\w+', name):
+            raise ValueError(f"Недопустимое имя тега: {tag!r}")
+        return name
+
+    def count_tag_notes(self, tag):
+        """Возвращает количество заметок с тегом (предпросмотр операций над тегами)."""
+        return self.delete_tag(tag, dry_run=True)
+
+    def rename_tag(self, old_tag, new_tag, dry_run=False):
+        """
+        Переименовывает тег во всех заметках. Если new_tag уже существует,
+        теги сливаются. Возвращает количество затронутых заметок;
+        при dry_run=True ничего не меняет.
+        """
+        return self.merge_tags([old_tag], new_tag, dry_run=dry_run)
+
+    def merge_tags(self, source_tags, target_tag, dry_run=False):
+        """
+        Сливает теги source_tags в target_tag одной транзакцией.
+        Возвращает количество затронутых заметок.
+        """
+        target = self._normalize_tag(target_tag)
+        sources = {self._normalize_tag(tag) for tag in source_tags} - {target}
+        return self._rewrite_tags(sources, target, dry_run)
+
+    def delete_tag(self, tag, dry_run=False):
+        """
+        Удаляет тег из текста всех заметок и из индекса одной транзакцией.
+        Возвращает количество затронутых заметок.
+        """
+        return self._rewrite_tags({self._normalize_tag(tag)}, None, dry_run)
+
+    def _rewrite_tags(self, sources, target, dry_run):
+        """
+        Заменяет #source на #target (или удаляет при target=None) в заметках,
+        найденных через индекс note_tags, и переносит связи в индексе.
+        """
+        if not sources:
+            return 0
+        placeholders = ", ".join("?" * len(sources))
+        source_list = sorted(sources)
+
+        if dry_run:
+            with self._read() as con:
+                cursor = con.cursor()
+                cursor.execute(f"""
+                    SELECT COUNT(DISTINCT nt.note_id) FROM note_tags nt
+                    JOIN tags t ON t.id = nt.tag_id WHERE t.name IN ({placeholders})
+                """, source_list)
+                return cursor.fetchone()[0]
+
+        # Тег - это # и слово целиком: #work не должен задевать #workshop
+        pattern = re.compile(
+            (r'[ \t]*' if target is None else '') +
+            r'#(' + "|".join(re.escape(name) for name in source_list) + r')(?!\w)'
+        )
+        replacement = "" if target is None else f"#{target}"
+
+        with self._write() as con:
+            cursor = con.cursor()
+            cursor.execute(f"""
+                SELECT n.id, note_text(n.content, n.content_blob, n.content_codec) AS content FROM notes n
+                WHERE n.id IN (
+                    SELECT nt.note_id FROM note_tags nt
+                    JOIN tags t ON t.id = nt.tag_id WHERE t.name IN ({placeholders})
                 )
-            con.commit()
+            """, source_list)
+            updates = []
+            for row in cursor.fetchall():
+                new_content = pattern.sub(replacement, row['content'] or "")
+                if new_content != row['content']:
+                    updates.append((*pack_note_content(new_content), row['id']))
+            cursor.executemany(
+                "UPDATE notes SET content = ?, content_blob = ?, content_codec = ?, content_size = ? WHERE id = ?",
+                updates
+            )
+
+            # Индекс правим множествами, без повторного разбора текста
+            if target is not None:
+                cursor.execute("INSERT OR IGNORE INTO tags (name) VALUES (?)", (target,))
+                cursor.execute(f"""
+                    INSERT OR IGNORE INTO note_tags (tag_id, note_id)
+                    SELECT (SELECT id FROM tags WHERE name = ?), nt.note_id
+                    FROM note_tags nt JOIN tags t ON t.id = nt.tag_id
+                    WHERE t.name IN ({placeholders})
+                """, [target, *source_list])
+            cursor.execute(f"""
+                DELETE FROM note_tags
+                WHERE tag_id IN (SELECT id FROM tags WHERE name IN ({placeholders}))
+            """, source_list)
+            return len(updates)
+
+    # --- История версий заметок ---
+
+    def _record_revision(self, cursor, note_id, new_title, new_content, force=False):
+        """
+        Сохраняет текущее состояние заметки как версию перед ее перезаписью.
+        Не чаще раза в REVISION_MIN_INTERVAL_SEC (если не force), и только
+        если состояние отличается от последней сохраненной версии.
+        """
+        cursor.execute("""
+            SELECT revision, created_at > datetime('now', ?) AS is_recent
+            FROM note_revisions WHERE note_id = ? ORDER BY revision DESC LIMIT 1
+        """, (f"-{REVISION_MIN_INTERVAL_SEC} seconds", note_id))
+        last = cursor.fetchone()
+        if last and last['is_recent'] and not force:
+            return
+
+        cursor.execute(
+            """SELECT title, note_text(content, content_blob, content_codec) AS content
+               FROM notes WHERE id = ? AND type = 'note' AND is_hidden = 0""",
+            (note_id,)
+        )
+        current = cursor.fetchone()
+        if not current:
+            return
+        old_title, old_content = current['title'], current['content'] or ""
+        if old_title == new_title and old_content == (new_content or ""):
+            return
+
+        revision = 1
+        kind = 'snapshot'
+        payload = old_content
+        if last:
+            revision = last['revision'] + 1
+            prev_title, prev_content = self._reconstruct_revision(cursor, note_id, last['revision'])
+            if prev_title == old_title and prev_content == old_content:
+                return  # Это состояние уже есть в истории
+            if revision % REVISION_SNAPSHOT_EVERY != 1:
+                kind = 'delta'
+                payload = json.dumps(make_text_delta(prev_content, old_content), ensure_ascii=False)
+
+        cursor.execute(
+            "INSERT INTO note_revisions (note_id, revision, kind, title, data, size) VALUES (?, ?, ?, ?, ?, ?)",
+            (note_id, revision, kind, old_title, zlib.compress(payload.encode('utf-8')), len(old_content))
+        )
+        self._prune_note_revisions(cursor, note_id)
+
+    def _reconstruct_revision(self, cursor, note_id, revision):
+        """Восстанавливает (title, content) версии: ближайший snapshot + разницы после него."""
+        cursor.execute("""
+            SELECT kind, title, data FROM note_revisions
+            WHERE note_id = ? AND revision <= ? AND revision >= (
+                SELECT MAX(revision) FROM note_revisions
+                WHERE note_id = ? AND revision <= ? AND kind = 'snapshot'
+            )
+            ORDER BY revision
+        """, (note_id, revision, note_id, revision))
+        title, content = None, None
+        for row in cursor.fetchall():
+            payload = zlib.decompress(row['data']).decode('utf-8')
+            if row['kind'] == 'snapshot':
+                content = payload
+            else:
+                content = apply_text_delta(content, json.loads(payload))
+            title = row['title']
+        if content is None:
+            raise LookupError(f"Версия {revision} заметки {note_id} не найдена")
+        return title, content
+
+    def _prune_note_revisions(self, cursor, note_id):
+        """
+        Применяет политику хранения к версиям заметки. Если самая старая из
+        оставшихся версий хранится разницей, она превращается в snapshot.
+        Возвращает количество удаленных версий.
+        """
+        cursor.execute("""
+            SELECT MIN(revision) FROM (
+                SELECT revision FROM note_revisions
+                WHERE note_id = ? AND created_at >= datetime('now', ?)
+                ORDER BY revision DESC LIMIT ?
+            )
+        """, (note_id, f"-{REVISION_KEEP_DAYS} days", REVISION_MAX_PER_NOTE))
+        oldest_kept = cursor.fetchone()[0]
+        if oldest_kept is None:
+            cursor.execute("DELETE FROM note_revisions WHERE note_id = ?", (note_id,))
+            return cursor.rowcount
+
+        cursor.execute("SELECT kind FROM note_revisions WHERE note_id = ? AND revision = ?", (note_id, oldest_kept))
+        if cursor.fetchone()['kind'] == 'delta':
+            _, content = self._reconstruct_revision(cursor, note_id, oldest_kept)
+            cursor.execute(
+                "UPDATE note_revisions SET kind = 'snapshot', data = ? WHERE note_id = ? AND revision = ?",
+                (zlib.compress(content.encode('utf-8')), note_id, oldest_kept)
+            )
+        cursor.execute("DELETE FROM note_revisions WHERE note_id = ? AND revision < ?", (note_id, oldest_kept))
+        return cursor.rowcount
+
+    def prune_revisions(self):
+        """Применяет политику хранения ко всем заметкам. Возвращает количество удаленных версий."""
+        removed = 0
+        with self._write() as con:
+            cursor = con.cursor()
+            cursor.execute("""
+                SELECT note_id FROM note_revisions
+                GROUP BY note_id
+                HAVING COUNT(*) > ? OR MIN(created_at) < datetime('now', ?)
+            """, (REVISION_MAX_PER_NOTE, f"-{REVISION_KEEP_DAYS} days"))
+            for row in cursor.fetchall():
+                removed += self._prune_note_revisions(cursor, row['note_id'])
+        return removed
+
+    def get_note_revisions(self, note_id):
+        """Возвращает версии заметки (новые сверху): {'revision', 'title', 'size', 'created_at'}."""
+        with self._read() as con:
+            cursor = con.cursor()
+            cursor.execute("""
+                SELECT revision, title, size, created_at FROM note_revisions
+                WHERE note_id = ? ORDER BY revision DESC
+            """, (note_id,))
+            return [dict(row) for row in cursor.fetchall()]
+
+    def get_note_revision(self, note_id, revision):
+        """Возвращает {'title', 'content'} указанной версии заметки."""
+        with self._read() as con:
+            title, content = self._reconstruct_revision(con.cursor(), note_id, revision)
+            return {'title': title, 'content': content}
+
+    def restore_note_revision(self, note_id, revision):
+        """
+        Возвращает заметку к указанной версии. Текущее состояние перед этим
+        сохраняется в историю, так что восстановление можно отменить.
+        """
+        with self._write() as con:
+            cursor = con.cursor()
+            title, content = self._reconstruct_revision(cursor, note_id, revision)
+            self._update_note_row(cursor, note_id, title, content, force_revision=True)
+
+    def get_revision_stats(self):
+        """Возвращает {'revisions', 'stored_bytes'} - сколько места занимает история."""
+        with self._read() as con:
+            cursor = con.cursor()
+            cursor.execute("SELECT COUNT(*) AS revisions, COALESCE(SUM(length(data)), 0) AS stored_bytes FROM note_revisions")
+            return dict(cursor.fetchone())
 
     # --- НОВЫЕ МЕТОДЫ ДЛЯ БЕЗОПАСНОСТИ ---
     def _hash_string(self, text):
@@ -414,7 +2871,7 @@ class DatabaseManager:
 
     def is_password_set(self):
         """Проверяет, установлен ли пароль в приложении."""
-        with self._get_connection() as con:
+        with self._read() as con:
             cursor = con.cursor()
             cursor.execute("SELECT password_hash FROM security WHERE id = 1")
             row = cursor.fetchone()
@@ -424,7 +2881,7 @@ class DatabaseManager:
         """
         Устанавливает или обновляет пароль и контрольные вопросы.
         """
-        with self._get_connection() as con:
+        with self._write() as con:
             cursor = con.cursor()
             cursor.execute("SELECT * FROM security WHERE id = 1")
             existing = cursor.fetchone()
@@ -436,6 +2893,10 @@ class DatabaseManager:
             ans1_hash = self._hash_string(a1.lower().strip()) if a1 else (existing['answer1_hash'] if existing and a1 is None else None)
             ans2_hash = self._hash_string(a2.lower().strip()) if a2 else (existing['answer2_hash'] if existing and a2 is None else None)
 
+            if pass_hash is None and existing and existing['note_key'] and not self._decrypt_all_notes(cursor):
+                print("Ошибка: пароль не снят - есть зашифрованные заметки, которые нельзя расшифровать")
+                return
+
             # Если записи еще нет, создаем ее
             if not existing:
                 con.execute(
@@ -453,24 +2914,34 @@ class DatabaseManager:
                     (pass_hash, q1, ans1_hash, q2, ans2_hash)
                 )
             
-            con.commit()
             # --- КОНЕЦ ---
 
+            # Ключ восстановления строится из обоих ответов, поэтому обновить его
+            # можно, только если известны все действующие ответы
+            keep_recovery = a1 is None and a2 is None
+            recovery_secret = None
+            if a1 and (a2 or not ans2_hash):
+                recovery_secret = self._recovery_secret(a1, a2 if ans2_hash else "")
+            self._update_note_keys(cursor, password, recovery_secret, keep_recovery)
+
     def check_password(self, password):
         """Проверяет правильность введенного пароля."""
         if not self.is_password_set():
             return True # Если пароль не установлен, доступ разрешен
         
         pass_hash = self._hash_string(password)
-        with self._get_connection() as con:
+        with self._read() as con:
             cursor = con.cursor()
             cursor.execute("SELECT password_hash FROM security WHERE id = 1")
             row = cursor.fetchone()
-            return row and row['password_hash'] == pass_hash
+            is_correct = row and row['password_hash'] == pass_hash
+        if is_correct:
+            self._unlock_note_key(password, 'note_key')
+        return is_correct
 
     def get_security_questions(self):
         """Возвращает контрольные вопросы."""
-        with self._get_connection() as con:
+        with self._read() as con:
             cursor = con.cursor()
             cursor.execute("SELECT question1, question2 FROM security WHERE id = 1")
             row = cursor.fetchone()
@@ -483,15 +2954,18 @@ class DatabaseManager:
         ans2_hash_to_check = self._hash_string(a2.lower().strip())
         # --- КОНЕЦ ---
 
-        with self._get_connection() as con:
+        with self._read() as con:
             cursor = con.cursor()
             cursor.execute("SELECT answer1_hash, answer2_hash FROM security WHERE id = 1")
             row = cursor.fetchone()
             
             # Сравниваем хэш с хэшем
-            return (row and 
+            is_correct = (row and 
                     row['answer1_hash'] == ans1_hash_to_check and
                     (row['answer2_hash'] == ans2_hash_to_check or not row['answer2_hash'])) # Учитываем, что второго ответа может не быть
+        if is_correct:
+            self._unlock_note_key(self._recovery_secret(a1, a2 if row['answer2_hash'] else ""), 'note_key_recovery')
+        return is_correct
 
     def reset_all_data(self):
         """Создает флаг для сброса данных при следующем запуске."""
@@ -505,37 +2979,217 @@ class DatabaseManager:
             return False
     # --- КОНЕЦ ---
 
+    # --- Шифрование заметок ---
+
+    @staticmethod
+    def _recovery_secret(a1, a2):
+        """Секрет для ключа восстановления: нормализованные ответы на оба вопроса."""
+        return f"{a1.lower().strip()}\n{(a2 or '').lower().strip()}"
+
+    def _stored_note_keys(self):
+        with self._read() as con:
+            cursor = con.cursor()
+            cursor.execute("SELECT note_key_salt, note_key, note_key_recovery FROM security WHERE id = 1")
+            row = cursor.fetchone()
+            return dict(row) if row else {}
+
+    def _unlock_note_key(self, secret, column):
+        """
+        Расшифровывает ключ хранилища секретом (пароль или ответы) - один раз
+        за сеанс. Если пароль задан до появления шифрования, ключ создается здесь.
+        """
+        if AESGCM is None:
+            return
+        keys = self._stored_note_keys()
+        if not keys.get('note_key'):
+            if column == 'note_key':
+                with self._write() as con:
+                    self._update_note_keys(con.cursor(), secret, None, True)
+            return
+        if not keys.get(column):
+            return
+        try:
+            self._note_key = open_sealed_bytes(derive_key(secret, keys['note_key_salt']), keys[column], column.encode())
+        except InvalidTag:
+            print("Ошибка: не удалось расшифровать ключ заметок")
+
+    def _update_note_keys(self, cursor, password, recovery_secret, keep_recovery):
+        """
+        Перешифровывает ключ хранилища под новый пароль и/или ответы.
+        password: None - не менялся, "" - снят. Новый ключ создается,
+        только если его еще нет и задан пароль.
+        """
+        if password == "":
+            # Заметки к этому моменту расшифрованы (см. set_password_and_questions)
+            cursor.execute("UPDATE security SET note_key_salt = NULL, note_key = NULL, note_key_recovery = NULL WHERE id = 1")
+            self.decrypted_cache.clear()
+            self._note_key = None
+            return
+        if AESGCM is None:
+            return
+        cursor.execute("SELECT note_key_salt, note_key, note_key_recovery FROM security WHERE id = 1")
+        salt, wrapped, recovery = cursor.fetchone()
+        if self._note_key is None:
+            if wrapped:
+                if password:
+                    print("Ошибка: ключ заметок не разблокирован, зашифрованные заметки откроются только старым паролем")
+                return
+            if not password:
+                return
+            self._note_key = os.urandom(NOTE_KEY_BYTES)
+            salt = os.urandom(KDF_SALT_BYTES)
+            recovery = None
+        if password:
+            wrapped = seal_bytes(derive_key(password, salt), self._note_key, b'note_key')
+        if recovery_secret:
+            recovery = seal_bytes(derive_key(recovery_secret, salt), self._note_key, b'note_key_recovery')
+        elif not keep_recovery:
+            recovery = None
+        cursor.execute(
+            "UPDATE security SET note_key_salt = ?, note_key = ?, note_key_recovery = ? WHERE id = 1",
+            (salt, wrapped, recovery)
+        )
+
+    def can_encrypt_notes(self):
+        """Можно ли сейчас шифровать заметки: есть пакет cryptography и ключ разблокирован."""
+        return AESGCM is not None and self._note_key is not None
+
+    def lock(self):
+        """
+        Забывает ключ заметок и расшифрованные тексты (блокировка приложения).
+        Отложенные сохранения перед этим записываются - им еще нужен ключ.
+        """
+        self.flush()
+        self.decrypted_cache.clear()
+        self._note_key = None
+
+    def _seal_note_content(self, note_id, content):
+        """
+        Шифрует текст заметки; возвращает (content, content_blob, content_codec,
+        content_size), как pack_note_content. Большой текст сначала сжимается.
+        """
+        if not self.can_encrypt_notes():
+            raise PermissionError(f"Заметка {note_id} зашифрована, а ключ не разблокирован")
+        raw = (content or "").encode('utf-8')
+        payload = b'-' + raw
+        if len(raw) >= COMPRESS_MIN_BYTES:
+            packed = zlib.compress(raw, ZLIB_LEVEL)
+            if len(packed) < len(raw) * COMPRESS_MAX_RATIO:
+                payload = b'z' + packed
+        # id заметки входит в проверку подлинности: шифротекст нельзя подставить в другую заметку
+        sealed = seal_bytes(self._note_key, payload, str(note_id).encode())
+        self.decrypted_cache.discard(note_id)
+        return None, sealed, ENCRYPTED_CODEC, len(raw)
+
+    def _open_note_content(self, note_id, sealed, cache=True):
+        """
+        Возвращает расшифрованный текст заметки (из кэша) или None, если ключ недоступен.
+        cache=False - не класть результат в кэш (массовое чтение не вытесняет открытые заметки).
+        """
+        if (content := self.decrypted_cache.get(note_id)) is not None:
+            return content
+        if not self.can_encrypt_notes():
+            return None
+        try:
+            payload = open_sealed_bytes(self._note_key, sealed, str(note_id).encode())
+        except InvalidTag:
+            print(f"Ошибка расшифровки заметки {note_id}: неверный ключ или данные повреждены")
+            return None
+        raw = zlib.decompress(payload[1:]) if payload[:1] == b'z' else payload[1:]
+        content = raw.decode('utf-8')
+        if cache:
+            self.decrypted_cache.put(note_id, content)
+        return content
+
+    @staticmethod
+    def _has_encrypted_notes(cursor):
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM notes WHERE is_hidden = 1)")
+        return bool(cursor.fetchone()[0])
+
+    def encrypt_note(self, note_id):
+        """
+        Шифрует текст заметки. Открытый текст удаляется из истории версий,
+        индекса тегов и полнотекстового индекса ('delete' в FTS5 оставляет
+        лишь отметку, поэтому сегменты индекса сливаются командой 'optimize').
+        Освобожденные страницы затираются (secure_delete), а после фиксации
+        WAL-журнал переносится в файл БД и усекается; если в этот момент
+        идет чтение, старые кадры журнала исчезнут при следующем checkpoint.
+        Уже сделанные резервные копии по-прежнему содержат открытый текст.
+        Возвращает False, если шифрование недоступно или заметка уже зашифрована.
+        """
+        if not self.can_encrypt_notes():
+            return False
+        with self._write() as con:
+            cursor = con.cursor()
+            cursor.execute(
+                """SELECT note_text(content, content_blob, content_codec) AS content
+                   FROM notes WHERE id = ? AND type = 'note' AND is_hidden = 0""",
+                (note_id,)
+            )
+            row = cursor.fetchone()
+            if not row:
+                return False
+            con.execute("PRAGMA secure_delete = ON")
+            try:
+                cursor.execute(
+                    """UPDATE notes SET content = ?, content_blob = ?, content_codec = ?, content_size = ?,
+                                        is_hidden = 1 WHERE id = ?""",
+                    (*self._seal_note_content(note_id, row['content']), note_id)
+                )
+                cursor.execute("DELETE FROM note_revisions WHERE note_id = ?", (note_id,))
+                self._sync_note_tags(cursor, note_id, "")
+                cursor.execute("INSERT INTO notes_fts (notes_fts) VALUES ('optimize')")
+            finally:
+                con.execute("PRAGMA secure_delete = OFF")
+        self.pool.checkpoint()
+        return True
+
+    def decrypt_note(self, note_id):
+        """Снимает шифрование с заметки. Возвращает False, если ключ недоступен."""
+        with self._write() as con:
+            return self._decrypt_note_row(con.cursor(), note_id)
+
+    def _decrypt_note_row(self, cursor, note_id):
+        cursor.execute(
+            "SELECT content_blob FROM notes WHERE id = ? AND is_hidden = 1 AND content_codec = ?",
+            (note_id, ENCRYPTED_CODEC)
+        )
+        row = cursor.fetchone()
+        if not row:
+            return False
+        content = self._open_note_content(note_id, row['content_blob'])
+        if content is None:
+            return False
+        cursor.execute(
+            """UPDATE notes SET content = ?, content_blob = ?, content_codec = ?, content_size = ?,
+                                is_hidden = 0 WHERE id = ?""",
+            (*pack_note_content(content), note_id)
+        )
+        self._sync_note_tags(cursor, note_id, content, old_tags=set())
+        self.decrypted_cache.discard(note_id)
+        return True
+
+    def _decrypt_all_notes(self, cursor):
+        """Расшифровывает все заметки (перед снятием пароля). False, если хоть одна не удалась."""
+        cursor.execute("SELECT id FROM notes WHERE is_hidden = 1")
+        note_ids = [row['id'] for row in cursor.fetchall()]
+        return all([self._decrypt_note_row(cursor, note_id) for note_id in note_ids])
+
     
     def get_full_note_tree(self):
         """Извлекает полное дерево заметок со всем содержимым."""
-        with self._get_connection() as con:
+        self.flush()
+        with self._read() as con:
             cursor = con.cursor()
             # Выбираем все поля
-            cursor.execute("SELECT id, parent_id, type, title, content, is_pinned FROM notes ORDER BY title COLLATE NOCASE")
-            rows = cursor.fetchall()
-            
-            nodes = {row['id']: dict(row) for row in rows}
-            tree = []
-            
-            for node_id, node in nodes.items():
-                if node['parent_id'] is None:
-                    tree.append(node)
-                else:
-                    parent = nodes.get(node['parent_id'])
-                    if parent:
-                        if 'children' not in parent:
-                            parent['children'] = []
-                        parent['children'].append(node)
-            
-            def sort_key(item):
-                is_folder = 1 if item['type'] == 'folder' else 2
-                return (is_folder, item['title'])
-
-            def sort_tree(nodes_list):
-                nodes_list.sort(key=sort_key)
-                for node in nodes_list:
-                    if 'children' in node:
-                        sort_tree(node['children'])
-            
-            sort_tree(tree)
-            return tree
\ No newline at end of file
+            cursor.execute(f"""
+                SELECT n.id, n.parent_id, n.type, n.title,
+                       note_text(n.content, n.content_blob, n.content_codec) AS content, n.is_pinned,
+                       CASE WHEN n.content_codec = ? THEN n.content_blob END AS sealed
+                FROM notes n ORDER BY {NOTE_ORDER_SQL}
+            """, (ENCRYPTED_CODEC,))
+            rows = [dict(row) for row in cursor.fetchall()]
+            for node in rows:
+                if (sealed := node.pop('sealed')) is not None:
+                    node['content'] = self._open_note_content(node['id'], sealed)
+            return self._build_tree(rows)
\ No newline at end of file
@@ -2,8 +2,8 @@ import sys
 import json
 import os
 import re
-import shutil
-from datetime import datetime
+import html
+from datetime import datetime, timezone
 from glob import glob
 
 from PyQt6.QtWidgets import (
@@ -15,11 +15,11 @@ from PyQt6.QtWidgets import (
     QFontComboBox, QButtonGroup, QColorDialog, QTabWidget, QStatusBar,
     QToolButton, QAbstractItemView, QFrame, QPlainTextEdit, QAbstractSpinBox,
     QTreeWidget, QTreeWidgetItem, QSlider, QStackedWidget, QStyleOption, QGridLayout, QSizePolicy, QSizeGrip, QMainWindow, QLayout,
-    QGroupBox
+    QGroupBox, QProgressDialog
 )
 from PyQt6.QtCore import (
     Qt, QPoint, QRectF, QUrl, QPropertyAnimation, QEasingCurve, pyqtSignal, QByteArray,
-    QSize, QTimer, QEvent, QParallelAnimationGroup, QObject, QDateTime, QRect, QMargins, QPointF
+    QSize, QTimer, QEvent, QParallelAnimationGroup, QObject, QDateTime, QRect, QMargins, QPointF, QThread
 )
 from PyQt6.QtGui import (
     QAction, QMouseEvent, QPainter, QPixmap, QColor, QFont, QIcon, QTextCursor,
@@ -39,7 +39,10 @@ except ImportError:
 from PyQt6.QtWidgets import QTextBrowser
 import markdown
 
-from database import DatabaseManager
+from database import DatabaseManager, ARCHIVE_FILE_NAME
+from backup_store import BackupStore
+from note_store import NoteStore
+from async_db import AsyncDatabase
 
 # --- Файлы и константы ---
 
@@ -51,6 +54,8 @@ else:
 SETTINGS_FILE = os.path.join(BASE_PATH, "settings.json")
 DATA_FILE = os.path.join(BASE_PATH, "data.json")
 BACKUP_DIR = os.path.join(BASE_PATH, "backups")
+SLOW_QUERY_LOG = os.path.join(BASE_PATH, "slow_queries.log")
+DB_PROFILE_FILE = os.path.join(BASE_PATH, "db_profile.json")
 
 
 DEFAULT_SETTINGS = {
@@ -104,6 +109,10 @@ DEFAULT_SETTINGS = {
     "backup_interval_min": 60,
     "backup_max_count": 10,
 
+    # Холодный архив: 0 - не переносить старые заметки автоматически
+    "archive_after_months": 0,
+    "search_include_archive": False,
+
     "pdf_font_family": "Times New Roman",
     "pdf_font_size": 11,
     "pdf_text_color": "#000000",
@@ -115,10 +124,19 @@ DEFAULT_SETTINGS = {
     "popup_editor_font_size": 12,
     "startup_mode": "panel", # "panel", "window"
     "zen_background_type": "procedural", # "color", "procedural", "image"
+
+    # Скрытые настройки (только в settings.json): профилирование запросов к БД.
+    # Медленные запросы пишутся в slow_queries.log, статистика - в db_profile.json при выходе
+    "db_profiling_enabled": False,
+    "db_slow_query_ms": 50,
 }
 
 POMODORO_WORK_TIME = 25 * 60
 POMODORO_BREAK_TIME = 5 * 60
+TREE_PAGE_SIZE = 500 # Сколько дочерних элементов папки загружать за один раз
+MAINTENANCE_FIRST_DELAY_MS = 10 * 60 * 1000 # Первое обслуживание БД после запуска
+MAINTENANCE_INTERVAL_MS = 6 * 60 * 60 * 1000 # Период обслуживания БД
+MAINTENANCE_RETRY_MS = 5 * 60 * 1000 # Повтор, если приложение в этот момент занято
 
 def resolve_path(relative_or_absolute_path):
     """Преобразует относительный путь в абсолютный, оставляя абсолютные без изменений."""
@@ -368,6 +386,366 @@ class ThemedMenuMixin:
         menu.setStyleSheet(stylesheet)
         return menu
 
+class LazyNotesTreeMixin:
+    """
+    Миксин для ленивой загрузки дерева заметок: содержимое папки
+    запрашивается у БД (get_children) только при ее раскрытии.
+    Изменения из NoteStore применяются к уже загруженным элементам точечно.
+    Полное дерево (для фильтрации) читается в фоне через AsyncDatabase; ключом
+    запроса служит сам виджет дерева, так что устаревшие ответы отбрасываются.
+    Требует атрибуты 'db', 'async_db', 'note_store', 'data_manager', 'loc' и метод '_populate_tree(parent_item, nodes)'.
+    """
+    def _connect_lazy_tree(self, tree):
+        tree.itemExpanded.connect(self._ensure_children_loaded)
+        tree.itemClicked.connect(self._on_lazy_item_clicked)
+
+    @staticmethod
+    def _is_service_item(item):
+        """
+        Служебные элементы - "Показать еще...", узел "Архив" и его содержимое:
+        это не заметки и папки живого дерева, их нельзя открыть, перетащить или изменить.
+        """
+        item_data = (item.data(0, Qt.ItemDataRole.UserRole) or {}) if item else {}
+        return item_data.get('type') in ('more', 'archive') or bool(item_data.get('archived'))
+
+    @staticmethod
+    def _is_archive_item(item):
+        """Узел "Архив" или элемент внутри него."""
+        item_data = (item.data(0, Qt.ItemDataRole.UserRole) or {}) if item else {}
+        return item_data.get('type') == 'archive' or bool(item_data.get('archived'))
+
+    def _load_tree_lazily(self, tree):
+        """Загружает только корень дерева, сохраняя раскрытые ранее папки."""
+        expanded_ids = self._expanded_folder_ids(tree.invisibleRootItem())
+        # Ответ на еще не выполненный запрос полного дерева больше не нужен
+        self.async_db.cancel(tree)
+        tree.clear()
+        self._load_children_page(tree.invisibleRootItem(), None)
+        self._add_archive_node(tree.invisibleRootItem())
+        self._restore_expanded_folders(tree.invisibleRootItem(), expanded_ids)
+
+    def _load_full_tree(self, tree, on_loaded=None):
+        """
+        Загружает дерево целиком (нужно для фильтрации по всем заметкам).
+        Запрос выполняется в фоне; после заполнения дерева вызывается on_loaded().
+        """
+        def populate(nodes):
+            # Пока дерево перестраивается, обработчики выделения не реагируют
+            was_building = getattr(self, '_building', False)
+            self._building = True
+            try:
+                tree.clear()
+                self._populate_tree(tree.invisibleRootItem(), nodes)
+                tree.expandAll()
+                if on_loaded:
+                    on_loaded()
+            finally:
+                self._building = was_building
+        self.async_db.call('get_note_tree', on_result=populate, owner=tree, key=tree)
+
+    def _load_children_page(self, parent_item, parent_id, offset=0):
+        """Добавляет в parent_item очередную страницу дочерних элементов."""
+        nodes = self.db.get_children(parent_id, offset, TREE_PAGE_SIZE + 1)
+        has_more = len(nodes) > TREE_PAGE_SIZE
+        existing_ids = {
+            (parent_item.child(i).data(0, Qt.ItemDataRole.UserRole) or {}).get('id')
+            for i in range(parent_item.childCount())
+        }
+        self._populate_tree(parent_item, [n for n in nodes[:TREE_PAGE_SIZE] if n['id'] not in existing_ids])
+        if has_more:
+            more_item = QTreeWidgetItem(parent_item, [self.loc.get("tree_load_more", "Показать еще...")])
+            more_item.setData(0, Qt.ItemDataRole.UserRole, {'type': 'more', 'parent_id': parent_id, 'offset': offset + TREE_PAGE_SIZE})
+            more_item.setFlags(Qt.ItemFlag.ItemIsEnabled)
+
+    def _ensure_children_loaded(self, item):
+        """Подгружает содержимое папки при первом раскрытии."""
+        item_data = item.data(0, Qt.ItemDataRole.UserRole) or {}
+        if item_data.get('type') not in ('folder', 'archive') or not item_data.get('has_children') or item_data.get('children_loaded'):
+            return
+        item_data['children_loaded'] = True
+        item.setData(0, Qt.ItemDataRole.UserRole, item_data)
+        if self._is_archive_item(item):
+            self._populate_archived(item, self.db.get_archived_children(item_data.get('id')))
+        else:
+            self._load_children_page(item, item_data.get('id'))
+
+    def _load_more(self, more_item):
+        parent_item = more_item.parent() or more_item.treeWidget().invisibleRootItem()
+        more_data = more_item.data(0, Qt.ItemDataRole.UserRole)
+        parent_item.removeChild(more_item)
+        self._load_children_page(parent_item, more_data.get('parent_id'), more_data.get('offset', 0))
+        self._keep_archive_last(parent_item)
+
+    def _on_lazy_item_clicked(self, item, column):
+        item_data = (item.data(0, Qt.ItemDataRole.UserRole) or {}) if item else {}
+        if item_data.get('type') == 'more':
+            self._load_more(item)
+        elif item_data.get('archived') and item_data.get('type') == 'note':
+            self._show_archived_note(item_data.get('id'))
+
+    def _expanded_folder_ids(self, parent_item):
+        ids = set()
+        for i in range(parent_item.childCount()):
+            child = parent_item.child(i)
+            if child.isExpanded():
+                ids.add((child.data(0, Qt.ItemDataRole.UserRole) or {}).get('id'))
+                ids |= self._expanded_folder_ids(child)
+        return ids
+
+    def _restore_expanded_folders(self, parent_item, expanded_ids):
+        if not expanded_ids:
+            return
+        for i in range(parent_item.childCount()):
+            child = parent_item.child(i)
+            if (child.data(0, Qt.ItemDataRole.UserRole) or {}).get('id') in expanded_ids:
+                self._ensure_children_loaded(child)
+                child.setExpanded(True)
+                self._restore_expanded_folders(child, expanded_ids)
+
+    def _find_child_loading_pages(self, parent_item, child_id):
+        """Ищет непосредственного потомка по ID, при необходимости догружая страницы."""
+        while True:
+            more_item = None
+            for i in range(parent_item.childCount()):
+                child = parent_item.child(i)
+                child_data = child.data(0, Qt.ItemDataRole.UserRole) or {}
+                if child_data.get('id') == child_id:
+                    return child
+                if child_data.get('type') == 'more':
+                    more_item = child
+            if more_item is None:
+                return None
+            self._load_more(more_item)
+
+    def _reveal_item(self, tree, item_id):
+        """Загружает и раскрывает цепочку папок до элемента, возвращает сам элемент."""
+        parent_item = tree.invisibleRootItem()
+        path = self.note_store.ancestor_ids(item_id) + [item_id]
+        for node_id in path:
+            item = self._find_child_loading_pages(parent_item, node_id)
+            if item is None:
+                return None
+            if node_id != item_id:
+                self._ensure_children_loaded(item)
+                item.setExpanded(True)
+            parent_item = item
+        return parent_item
+
+    # --- Архив ---
+
+    def _add_archive_node(self, parent_item, found_rows=None):
+        """
+        Добавляет в конец корня виртуальную папку "Архив". Без found_rows ее
+        содержимое читается из архива при раскрытии; с found_rows в ней
+        показываются только найденные в архиве заметки (результаты поиска).
+        """
+        if found_rows is None and not self.db.has_archive():
+            return None
+        item = QTreeWidgetItem(parent_item, [self.loc.get("archive_folder_title")])
+        item.setData(0, Qt.ItemDataRole.UserRole, {
+            'type': 'archive', 'id': None, 'has_children': True, 'children_loaded': found_rows is not None,
+        })
+        item.setIcon(0, ThemedIconProvider.icon("folder", self.data_manager.get_settings()))
+        item.setFlags(Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable)
+        if found_rows is None:
+            item.setChildIndicatorPolicy(QTreeWidgetItem.ChildIndicatorPolicy.ShowIndicator)
+        else:
+            self._populate_archived(item, [dict(row, type='note') for row in found_rows])
+        return item
+
+    def _populate_archived(self, parent_item, nodes):
+        """Заполняет архивную ветку: элементы только для чтения, без перетаскивания."""
+        first_index = parent_item.childCount()
+        self._populate_tree(parent_item, [dict(node, archived=True) for node in nodes])
+        for index in range(first_index, parent_item.childCount()):
+            child = parent_item.child(index)
+            child.setFlags(Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable)
+            child_data = child.data(0, Qt.ItemDataRole.UserRole) or {}
+            if child_data.get('origin_path'):
+                child.setToolTip(0, self.loc.get("archive_origin_tooltip").format(path=child_data['origin_path']))
+            if child_data.get('type') == 'folder' and child_data.get('has_children'):
+                child.setChildIndicatorPolicy(QTreeWidgetItem.ChildIndicatorPolicy.ShowIndicator)
+
+    def _find_archive_node(self, tree):
+        root = tree.invisibleRootItem()
+        for index in range(root.childCount()):
+            if (root.child(index).data(0, Qt.ItemDataRole.UserRole) or {}).get('type') == 'archive':
+                return root.child(index)
+        return None
+
+    def _keep_archive_last(self, parent_item):
+        """После догрузки страницы корня узел архива снова ставится последним."""
+        tree = self._store_tree
+        if parent_item is not tree.invisibleRootItem() or (node := self._find_archive_node(tree)) is None:
+            return
+        was_expanded = node.isExpanded()
+        parent_item.addChild(parent_item.takeChild(parent_item.indexOfChild(node)))
+        node.setExpanded(was_expanded)
+
+    def _refresh_archive_node(self):
+        """Перестраивает узел архива после переноса в архив или возврата из него."""
+        root = self._store_tree.invisibleRootItem()
+        was_expanded = False
+        if (node := self._find_archive_node(self._store_tree)) is not None:
+            was_expanded = node.isExpanded()
+            root.removeChild(node)
+        node = self._add_archive_node(root)
+        if node is not None and was_expanded:
+            self._ensure_children_loaded(node)
+            node.setExpanded(True)
+
+    def _show_found_in_archive(self, rows):
+        """Показывает найденные в архиве заметки отдельным узлом после отфильтрованного дерева."""
+        found_rows = [row for row in rows if row.get('archived')]
+        if found_rows:
+            self._add_archive_node(self._store_tree.invisibleRootItem(), found_rows).setExpanded(True)
+
+    def _exec_archive_menu(self, item, global_pos):
+        """Контекстное меню архивного элемента: кроме возврата в дерево, с ним ничего делать нельзя."""
+        item_data = item.data(0, Qt.ItemDataRole.UserRole) or {}
+        if not item_data.get('archived'):
+            return
+        menu = self._create_themed_menu()
+        menu.addAction(self.loc.get("restore_from_archive_action"), lambda: self._restore_archived(item_data.get('id')))
+        menu.exec(global_pos)
+
+    def _restore_archived(self, item_id):
+        """Возвращает элемент из архива и показывает его в дереве."""
+        try:
+            restored_ids = self.note_store.restore_from_archive(item_id)
+        except Exception as e:
+            print(f"Ошибка возврата из архива: {e}")
+            update_style_for_dialogs(self.data_manager.get_settings())
+            QMessageBox.critical(self._store_tree.window(), self.loc.get("error_title"),
+                                 self.loc.get("archive_restore_error").format(error=e))
+            return
+        if restored_ids and (restored_item := self._reveal_item(self._store_tree, restored_ids[0])):
+            self._store_tree.setCurrentItem(restored_item)
+
+    def _show_archived_note(self, note_id):
+        """Открывает архивную заметку только для чтения; из окна ее можно вернуть в дерево."""
+        note = self.db.get_archived_note(note_id)
+        if note is None:
+            return
+        dialog = ArchivedNoteDialog(self._store_tree.window(), self.loc, note, self.data_manager.get_settings())
+        if dialog.exec():
+            self._restore_archived(note_id)
+
+    # --- Обновление дерева по сигналам NoteStore ---
+
+    def _connect_note_store(self, tree):
+        """Подписывает дерево на изменения NoteStore вместо полной перезагрузки."""
+        self._store_tree = tree
+        self.note_store.note_created.connect(self._on_store_note_created)
+        self.note_store.note_updated.connect(self._on_store_note_updated)
+        self.note_store.note_moved.connect(self._on_store_note_moved)
+        self.note_store.notes_deleted.connect(self._on_store_notes_deleted)
+        self.note_store.archive_changed.connect(self._refresh_archive_node)
+
+    def _save_drop_position(self, moved_item, new_parent, new_parent_id):
+        """
+        Сохраняет место перетащенного элемента. Соседи берутся из дерева
+        после переноса; в БД меняется только order_key самого элемента.
+        """
+        moved_id = moved_item.data(0, Qt.ItemDataRole.UserRole).get('id')
+        siblings_ids = [
+            new_parent.child(index).data(0, Qt.ItemDataRole.UserRole).get('id')
+            for index in range(new_parent.childCount())
+            if not self._is_service_item(new_parent.child(index))
+        ]
+        self.note_store.update_item_parent_and_order(moved_id, new_parent_id, siblings_ids)
+        self._keep_archive_last(new_parent)
+        if meta := self.note_store.get(moved_id):
+            item_data = moved_item.data(0, Qt.ItemDataRole.UserRole) or {}
+            item_data['order_key'] = meta.get('order_key')
+            moved_item.setData(0, Qt.ItemDataRole.UserRole, item_data)
+
+    @staticmethod
+    def _tree_item_text(title):
+        title = title or ""
+        return title[:30] + '...' if len(title) > 30 else title
+
+    def _find_loaded_item(self, item_id):
+        """Ищет элемент только среди уже загруженных (None - корень), не обращаясь к БД."""
+        if item_id is None:
+            return self._store_tree.invisibleRootItem()
+
+        def find(parent):
+            for i in range(parent.childCount()):
+                child = parent.child(i)
+                if (child.data(0, Qt.ItemDataRole.UserRole) or {}).get('id') == item_id:
+                    return child
+                if found := find(child):
+                    return found
+            return None
+        return find(self._store_tree.invisibleRootItem())
+
+    def _loaded_parent_item(self, parent_id):
+        """
+        Элемент-родитель, если его содержимое уже загружено и в него можно
+        добавить потомка; иначе None (потомок появится при раскрытии папки).
+        """
+        parent_item = self._find_loaded_item(parent_id)
+        if parent_item is None or parent_id is None:
+            return parent_item
+        parent_data = parent_item.data(0, Qt.ItemDataRole.UserRole) or {}
+        if parent_data.get('has_children') and not parent_data.get('children_loaded'):
+            return None
+        parent_data['has_children'] = parent_data['children_loaded'] = True
+        parent_item.setData(0, Qt.ItemDataRole.UserRole, parent_data)
+        return parent_item
+
+    def _insert_sorted(self, parent_item, item):
+        """Вставляет элемент на его место в порядке дерева (перед "Показать еще...")."""
+        key = NoteStore.sort_key(item.data(0, Qt.ItemDataRole.UserRole))
+        index = 0
+        while index < parent_item.childCount():
+            sibling_data = parent_item.child(index).data(0, Qt.ItemDataRole.UserRole) or {}
+            if sibling_data.get('type') in ('more', 'archive') or NoteStore.sort_key(sibling_data) > key:
+                break
+            index += 1
+        parent_item.insertChild(index, item)
+
+    def _on_store_note_created(self, meta):
+        parent_item = self._loaded_parent_item(meta['parent_id'])
+        if parent_item is None or self._find_loaded_item(meta['id']):
+            return
+        self._populate_tree(parent_item, [meta])
+        self._insert_sorted(parent_item, parent_item.takeChild(parent_item.childCount() - 1))
+
+    def _on_store_note_updated(self, meta):
+        item = self._find_loaded_item(meta['id'])
+        if item is None:
+            return
+        item_data = item.data(0, Qt.ItemDataRole.UserRole) or {}
+        item_data.update({key: meta[key] for key in ('title', 'is_pinned', 'is_hidden')})
+        item.setData(0, Qt.ItemDataRole.UserRole, item_data)
+        item.setText(0, self._tree_item_text(meta['title']))
+        if meta['type'] == 'note':
+            icon_name = "lock" if meta.get('is_hidden') else "pin" if meta.get('is_pinned') else "file"
+            item.setIcon(0, ThemedIconProvider.icon(icon_name, self.data_manager.get_settings()))
+
+    def _on_store_note_moved(self, meta, old_parent_id):
+        item = self._find_loaded_item(meta['id'])
+        if item is None:
+            self._on_store_note_created(meta)
+            return
+        # При перетаскивании элемент уже стоит в новом родителе - только пересортируем
+        current_parent = item.parent() or self._store_tree.invisibleRootItem()
+        current_parent.removeChild(item)
+        new_parent_item = self._loaded_parent_item(meta['parent_id'])
+        if new_parent_item is not None:
+            item_data = item.data(0, Qt.ItemDataRole.UserRole) or {}
+            item_data['parent_id'] = meta['parent_id']
+            item_data['order_key'] = meta.get('order_key')
+            item.setData(0, Qt.ItemDataRole.UserRole, item_data)
+            self._insert_sorted(new_parent_item, item)
+
+    def _on_store_notes_deleted(self, item_ids):
+        for item_id in item_ids:
+            if item := self._find_loaded_item(item_id):
+                (item.parent() or self._store_tree.invisibleRootItem()).removeChild(item)
+
 class ThemedLineEdit(QLineEdit):
     """Поле ввода, которое создает стилизованное контекстное меню."""
     def __init__(self, main_parent=None, parent=None):
@@ -514,12 +892,18 @@ class LocalizationManager(QObject):
                 "list_management_tooltip": "Клик правой кнопкой для управления списками",
                 "open_window_menu": "Открыть оконный режим…", "open_window_tooltip": "Открыть в оконном режиме",
                 "to_panel_button": "Панель", "to_panel_tooltip": "Открыть боковую панель", "tags_label": "Теги:",
+                "tag_rename_action": "Переименовать тег...", "tag_delete_action": "Удалить тег",
+                "tag_rename_title": "Переименование тега", "tag_rename_prompt": "Новое имя для #{tag} (существующий тег - слияние):",
+                "tag_rename_confirm": "Переименовать #{old} в #{new}?\nБудет изменено заметок: {count}",
+                "tag_merge_confirm": "Тег #{new} уже существует. Слить #{old} с #{new}?\nБудет изменено заметок: {count}",
+                "tag_delete_confirm": "Удалить #{tag} из текста всех заметок?\nБудет изменено заметок: {count}",
+                "tag_invalid_name": "Имя тега может содержать только буквы, цифры и _.",
                 "to_task_btn": "➕ в задачи", "to_task_tooltip": "Добавить выделенный текст в задачи",
                 "import_settings": "Импорт настроек…", "export_settings": "Экспорт настроек…",
                 "task_templates_title": "Шаблоны задач", "task_templates_hint": "Один шаблон — одна строка:",
                 "tree_new_folder": "Новая папка...", "tree_rename_folder": "Переименовать папку...",
                 "tree_delete_folder": "Удалить папку", "tree_delete_note": "Удалить заметку", "tree_new_note_here": "Новая заметка здесь",
-                "tree_confirm_delete_folder": "Удалить папку '{name}' со всем содержимым?",
+                "tree_confirm_delete_folder": "Удалить папку '{name}' со всем содержимым?", "tree_load_more": "Показать еще...",
                 "audio_toggle_tooltip": "Музыка", "audio_prev": "Предыдущий",
                 "audio_next": "Следующий", "audio_play": "Воспроизвести", "audio_pause": "Пауза", "audio_stop": "Стоп",
                 "audio_volume": "Громкость",
@@ -529,6 +913,12 @@ class LocalizationManager(QObject):
                 "task_filter_all": "Все", "task_filter_active": "Активные", "task_filter_completed": "Выполненные",
                 "settings_padding_top": "Отступ сверху (px):", "settings_padding_bottom": "Отступ снизу (px):",
                 "settings_padding_left": "Отступ слева (px):", "settings_padding_right": "Отступ справа (px):",
+                "note_history_action": "История версий...", "note_history_title": "История версий",
+                "note_encrypt_action": "Зашифровать заметку", "note_decrypt_action": "Снять шифрование",
+                "note_history_empty": "У этой заметки пока нет сохраненных версий.",
+                "note_history_restore_btn": "Восстановить эту версию", "note_history_close_btn": "Закрыть",
+                "note_history_restore_confirm": "Вернуть заметку к версии от {date}?\nТекущий текст останется в истории.",
+                "backup_in_progress": "Создание резервной копии...",
                 "backup_manager_title": "Менеджер резервных копий", "backup_available_copies": "Доступные копии:",
                 "backup_restore_btn": "Восстановить", "backup_delete_btn": "Удалить", "backup_no_copies": "Резервные копии не найдены.",
                 "backup_confirm_restore": "Вы уверены, что хотите восстановить данные из копии от {date}?",
@@ -537,6 +927,13 @@ class LocalizationManager(QObject):
                 "window_button_tooltip": "Перейти в оконный режим", "font_search_placeholder": "Поиск шрифта...",
                 "settings_backup_interval": "Интервал автосохранения (мин):", "settings_backup_max_count": "Макс. кол-во копий:",
                 "backup_creation_silent_success": "Резервная копия создана (автоматически)",
+                "settings_archive_after": "Переносить в архив заметки без изменений:", "settings_archive_off": "не переносить",
+                "settings_archive_months_suffix": " мес.", "settings_search_include_archive": "Искать также в архиве",
+                "archive_folder_title": "Архив", "archive_item_action": "Перенести в архив",
+                "restore_from_archive_action": "Вернуть из архива", "archive_origin_tooltip": "Было в: {path}",
+                "archived_note_info": "Заметка в архиве с {date}. Было в: {path}",
+                "archived_note_locked": "Заметка зашифрована. Верните ее из архива, чтобы открыть.",
+                "archive_restore_error": "Не удалось вернуть элемент из архива:\n{error}",
                 "day_1": "понедельник", "day_2": "вторник", "day_3": "среда", "day_4": "четверг",
                 "day_5": "пятница", "day_6": "суббота", "day_7": "воскресенье",
                 "settings_tab_security": "Безопасность", "login_title": "Вход в Ассистент",
@@ -574,17 +971,22 @@ class LocalizationManager(QObject):
                 "import_new_folder_button": "Новая папка", "import_new_folder_prompt_title": "Новая папка",
                 "import_new_folder_prompt_label": "Введите имя новой папки:", "import_files_dialog_title": "Выберите файлы для импорта",
                 "import_success_message": "Импорт завершен.\nДобавлено новых заметок: {count}",
+                "import_progress_message": "Импорт заметок... Добавлено: {count}",
                 "import_error_message": "Произошла ошибка при импорте:\n{error}", "import_files_error_message": "Произошла ошибка при импорте файлов:\n{error}",
                 "export_no_notes": "Нет заметок для экспорта.", "export_success_message": "Все заметки успешно экспортированы в папку:\n{dir}",
                 "export_error_message": "Произошла ошибка при экспорте:\n{error}",
                 "unnamed_note_title": "Без названия", "unnamed_folder_title": "Новая папка",
                 "unnamed_note_updated_title": "Обновленная заметка", "unnamed_note_renamed_title": "Переименованная заметка",
                 "delete_item_confirm_title": "Подтверждение", "delete_item_confirm_text": "Удалить '{name}'?",
+                "delete_folder_contents": "Внутри папки заметок: {notes}, папок: {folders}.",
+                "folder_notes_count": "заметок: {count}",
                 "delete_folder_confirm_extra": "\nВЕСЬ контент внутри папки будет удален!",
                 "rename_item_dialog_title": "Переименовать", "rename_item_dialog_label": "Новое имя:",
                 "backup_created_success_popup": "Резервная копия успешно создана!", "backup_title": "Бэкап",
+                "note_save_failed_title": "Ошибка сохранения",
+                "note_save_failed_text": "Не удалось сохранить: {titles}\n{error}\n\nИзменения не потеряны: запись будет повторена автоматически.",
                 "success_title": "Успех", "error_title": "Ошибка",
-                "backup_restore_error": "Не удалось восстановить: {error}", "backup_restored_success": "Данные восстановлены. Приложение будет перезапущено.",
+                "backup_restore_error": "Не удалось восстановить: {error}", "backup_restored_success": "Данные восстановлены.",
                 "export_file_success": "Заметки экспортированы в {path}", "export_file_error": "Не удалось экспортировать: {error}",
                 "settings_export_success": "Настройки экспортированы в {path}", "settings_export_error": "Не удалось экспортировать: {error}",
                 "settings_import_success": "Настройки импортированы", "settings_import_error": "Не удалось импортировать: {error}",
@@ -649,13 +1051,19 @@ class LocalizationManager(QObject):
                 "task_menu_edit": "Edit...", "task_menu_toggle_completed": "Toggle completed", "note_pin_menu": "Pin", "note_unpin_menu": "Unpin",
                 "list_management_tooltip": "Right-click to manage lists", "open_window_menu": "Open window mode…",
                 "open_window_tooltip": "Open in window mode", "to_panel_button": "Panel",
-                "to_panel_tooltip": "Open side panel", "tags_label": "Tags:", "to_task_btn": "➕ to tasks",
+                "to_panel_tooltip": "Open side panel", "tags_label": "Tags:",
+                "tag_rename_action": "Rename tag...", "tag_delete_action": "Delete tag",
+                "tag_rename_title": "Rename Tag", "tag_rename_prompt": "New name for #{tag} (an existing tag will be merged):",
+                "tag_rename_confirm": "Rename #{old} to #{new}?\nNotes to be changed: {count}",
+                "tag_merge_confirm": "Tag #{new} already exists. Merge #{old} into #{new}?\nNotes to be changed: {count}",
+                "tag_delete_confirm": "Remove #{tag} from the text of all notes?\nNotes to be changed: {count}",
+                "tag_invalid_name": "A tag name may contain only letters, digits and _.", "to_task_btn": "➕ to tasks",
                 "to_task_tooltip": "Add selected text to tasks", "import_settings": "Import settings…",
                 "export_settings": "Export settings…", "task_templates_title": "Task templates",
                 "task_templates_hint": "One template per line:",
                 "tree_new_folder": "New folder...", "tree_rename_folder": "Rename folder...", "tree_delete_folder": "Delete folder",
                 "tree_delete_note": "Delete note", "tree_new_note_here": "New note here",
-                "tree_confirm_delete_folder": "Delete folder '{name}' with all contents?",
+                "tree_confirm_delete_folder": "Delete folder '{name}' with all contents?", "tree_load_more": "Show more...",
                 "audio_toggle_tooltip": "Music", "audio_prev": "Previous",
                 "audio_next": "Next", "audio_play": "Play", "audio_pause": "Pause", "audio_stop": "Stop",
                 "audio_volume": "Volume", "new_note_title": "New Note",
@@ -665,6 +1073,12 @@ class LocalizationManager(QObject):
                 "task_filter_all": "All", "task_filter_active": "Active", "task_filter_completed": "Completed",
                 "settings_padding_top": "Padding Top (px):", "settings_padding_bottom": "Padding Bottom (px):",
                 "settings_padding_left": "Padding Left (px):", "settings_padding_right": "Padding Right (px):",
+                "note_history_action": "Version history...", "note_history_title": "Version History",
+                "note_encrypt_action": "Encrypt note", "note_decrypt_action": "Remove encryption",
+                "note_history_empty": "This note has no saved versions yet.",
+                "note_history_restore_btn": "Restore this version", "note_history_close_btn": "Close",
+                "note_history_restore_confirm": "Restore the note to the version from {date}?\nThe current text will be kept in history.",
+                "backup_in_progress": "Creating backup...",
                 "backup_manager_title": "Backup Manager", "backup_available_copies": "Available copies:",
                 "backup_restore_btn": "Restore", "backup_delete_btn": "Delete", "backup_no_copies": "No backups found.",
                 "backup_confirm_restore": "Are you sure you want to restore data from the copy dated {date}?",
@@ -672,6 +1086,13 @@ class LocalizationManager(QObject):
                 "zen_button_tooltip": "Enter Zen Mode (fullscreen editor)", "window_button_tooltip": "Switch to Window Mode",
                 "font_search_placeholder": "Search font...", "settings_backup_interval": "Backup interval (min):",
                 "settings_backup_max_count": "Max backups to keep:", "backup_creation_silent_success": "Backup created (automatic)",
+                "settings_archive_after": "Archive notes unchanged for:", "settings_archive_off": "never",
+                "settings_archive_months_suffix": " mo.", "settings_search_include_archive": "Also search the archive",
+                "archive_folder_title": "Archive", "archive_item_action": "Move to archive",
+                "restore_from_archive_action": "Restore from archive", "archive_origin_tooltip": "Was in: {path}",
+                "archived_note_info": "Archived on {date}. Was in: {path}",
+                "archived_note_locked": "This note is encrypted. Restore it from the archive to open it.",
+                "archive_restore_error": "Could not restore the item from the archive:\n{error}",
                 "day_1": "monday", "day_2": "tuesday", "day_3": "wednesday", "day_4": "thursday",
                 "day_5": "friday", "day_6": "saturday", "day_7": "sunday",
                 "settings_tab_security": "Security", "login_title": "Assistant Login",
@@ -710,17 +1131,22 @@ class LocalizationManager(QObject):
                 "import_new_folder_button": "New Folder", "import_new_folder_prompt_title": "New Folder",
                 "import_new_folder_prompt_label": "Enter new folder name:", "import_files_dialog_title": "Select Files to Import",
                 "import_success_message": "Import complete.\nNew notes added: {count}",
+                "import_progress_message": "Importing notes... Added: {count}",
                 "import_error_message": "An error occurred during import:\n{error}", "import_files_error_message": "An error occurred during file import:\n{error}",
                 "export_no_notes": "No notes to export.", "export_success_message": "All notes successfully exported to:\n{dir}",
                 "export_error_message": "An error occurred during export:\n{error}",
                 "unnamed_note_title": "Untitled", "unnamed_folder_title": "New Folder",
                 "unnamed_note_updated_title": "Updated Note", "unnamed_note_renamed_title": "Renamed Note",
                 "delete_item_confirm_title": "Confirm", "delete_item_confirm_text": "Delete '{name}'?",
+                "delete_folder_contents": "The folder contains notes: {notes}, folders: {folders}.",
+                "folder_notes_count": "notes: {count}",
                 "delete_folder_confirm_extra": "\nALL content inside the folder will be deleted!",
                 "rename_item_dialog_title": "Rename", "rename_item_dialog_label": "New name:",
                 "backup_created_success_popup": "Backup created successfully!", "backup_title": "Backup",
+                "note_save_failed_title": "Save error",
+                "note_save_failed_text": "Could not save: {titles}\n{error}\n\nYour changes are kept and the save will be retried automatically.",
                 "success_title": "Success", "error_title": "Error",
-                "backup_restore_error": "Failed to restore: {error}", "backup_restored_success": "Data restored. The application will now restart.",
+                "backup_restore_error": "Failed to restore: {error}", "backup_restored_success": "Data restored.",
                 "export_file_success": "Notes exported to {path}", "export_file_error": "Failed to export: {error}",
                 "settings_export_success": "Settings exported to {path}", "settings_export_error": "Failed to export: {error}",
                 "settings_import_success": "Settings imported", "settings_import_error": "Failed to import: {error}",
@@ -1300,52 +1726,53 @@ class Exporter:
             name = self.loc.get("unnamed_note_title")
         return name
 
-    def export_to_directory(self, target_dir, parent_widget, single_folder_data=None):
-        """Главный метод, запускающий экспорт."""
-        if single_folder_data:
-            # Если передана одна папка, работаем только с ней
-            note_tree = [single_folder_data]
-        else:
-            note_tree = self.db.get_full_note_tree()
-        
-        if not note_tree:
-            QMessageBox.information(None, self.loc.get("export"), self.loc.get("export_no_notes"))
-            return
-
+    def export_to_directory(self, target_dir, parent_widget, folder_id=None):
+        """Главный метод, запускающий экспорт (все дерево или одну папку folder_id)."""
         try:
-            self._recursive_export(note_tree, target_dir)
-            QMessageBox.information(parent_widget, self.loc.get("success_title"), self.loc.get("export_success_message"))
+            exported = self.write_to_directory(target_dir, folder_id)
         except Exception as e:
-            QMessageBox.critical(parent_widget, "error_title", self.loc.get("export_error_message"))
+            exported = e
+        self.show_result(parent_widget, exported)
 
-    def _recursive_export(self, nodes, current_path):
-        """Рекурсивно обходит дерево и создает папки/файлы."""
-        for node in nodes:
-            node_type = node.get('type')
-            node_title = node.get('title', self.loc.get("unnamed_note_title"))
-            
-            if node_type == 'folder':
-                folder_name = self._sanitize_filename(node_title)
-                new_path = os.path.join(current_path, folder_name)
-                
+    def write_to_directory(self, target_dir, folder_id=None):
+        """
+        Записывает заметки в папки на диске и возвращает число файлов.
+        Дерево читается потоково (iter_subtree): в памяти только текущая
+        пачка заметок и пути уже созданных папок. Не трогает виджеты,
+        поэтому может выполняться в рабочем потоке.
+        """
+        folder_paths = {None: target_dir}
+        exported = 0
+        for node in self.db.iter_subtree(folder_id):
+            # Папка всегда приходит раньше своих потомков
+            current_path = target_dir if node['depth'] == 0 else folder_paths.get(node['parent_id'])
+            if current_path is None:
+                continue
+            node_title = node.get('title') or self.loc.get("unnamed_note_title")
+
+            if node['type'] == 'folder':
+                new_path = os.path.join(current_path, self._sanitize_filename(node_title))
                 # Создаем папку, если ее нет
-                if not os.path.exists(new_path):
-                    os.makedirs(new_path)
-                
-                # Погружаемся в дочерние элементы
-                if 'children' in node:
-                    self._recursive_export(node.get('children', []), new_path)
+                os.makedirs(new_path, exist_ok=True)
+                folder_paths[node['id']] = new_path
 
-            elif node_type == 'note':
+            elif node['type'] == 'note':
                 # Создаем имя файла. Добавляем ID для уникальности.
-                node_id = node.get('id')
-                file_name = f"{self._sanitize_filename(node_title)}_{node_id}.md"
-                file_path = os.path.join(current_path, file_name)
-                
-                content = node.get('content', '')
-                
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    f.write(content)
+                file_name = f"{self._sanitize_filename(node_title)}_{node['id']}.md"
+                with open(os.path.join(current_path, file_name), 'w', encoding='utf-8') as f:
+                    f.write(node.get('content') or "")
+                exported += 1
+        return exported
+
+    def show_result(self, parent_widget, exported):
+        """Сообщает итог write_to_directory: число заметок или исключение."""
+        if isinstance(exported, Exception):
+            print(f"Ошибка экспорта в папки: {exported}")
+            QMessageBox.critical(parent_widget, self.loc.get("error_title"), self.loc.get("export_error_message"))
+        elif not exported:
+            QMessageBox.information(parent_widget, self.loc.get("export"), self.loc.get("export_no_notes"))
+        else:
+            QMessageBox.information(parent_widget, self.loc.get("success_title"), self.loc.get("export_success_message"))
 
 # --- КЛАСС ДЛЯ ИМПОРТА ИЗ ПАПОК ---
 class Importer:
@@ -1361,7 +1788,7 @@ class Importer:
         Если None - импорт в корень.
         """
         try:
-            self._recursive_import(source_dir, parent_note_id)
+            self._bulk_import(self._iter_directory(source_dir, None), parent_note_id)
             QMessageBox.information(None, self.loc.get("success_title"), self.loc.get("import_success_message").format(count=self.imported_count))
             return True
            
@@ -1369,15 +1796,33 @@ class Importer:
             QMessageBox.critical(None, "error_title", self.loc.get("import_error_message"))
             return False
 
-    def _recursive_import(self, current_path, parent_id_in_db):
-        """Рекурсивно обходит папки и импортирует файлы и подпапки."""
+    def _bulk_import(self, records, parent_id_in_db):
+        """Передает записи в DatabaseManager.bulk_import, показывая прогресс."""
+        progress_dialog = QProgressDialog(self.loc.get("import_progress_message").format(count=0), None, 0, 0)
+        progress_dialog.setWindowModality(Qt.WindowModality.ApplicationModal)
+        progress_dialog.setMinimumDuration(500)
+
+        def on_progress(notes, folders):
+            progress_dialog.setLabelText(self.loc.get("import_progress_message").format(count=self.imported_count + notes))
+            QApplication.processEvents()
+
+        try:
+            notes, _ = self.db.bulk_import(records, parent_id_in_db, progress=on_progress)
+            self.imported_count += notes
+        finally:
+            progress_dialog.close()
+
+    def _iter_directory(self, current_path, parent_key):
+        """
+        Рекурсивно обходит папки и выдает записи для bulk_import.
+        Ключом папки служит ее путь на диске.
+        """
         for entry in os.scandir(current_path):
             if entry.is_dir():
                 # Если это папка, создаем ее в БД
-                folder_name = entry.name
-                new_folder_id = self.db.create_folder(parent_id_in_db, folder_name)
+                yield {'type': 'folder', 'key': entry.path, 'parent_key': parent_key, 'title': entry.name}
                 # И рекурсивно импортируем ее содержимое
-                self._recursive_import(entry.path, new_folder_id)
+                yield from self._iter_directory(entry.path, entry.path)
             
             elif entry.is_file():
                 # Если это файл, проверяем расширение
@@ -1392,21 +1837,23 @@ class Importer:
                             # Если первая строка пустая, берем имя файла без расширения
                             title = os.path.splitext(entry.name)[0]
                         
-                        self.db.create_note(parent_id_in_db, title, content)
-                        self.imported_count += 1
+                        yield {'type': 'note', 'parent_key': parent_key, 'title': title, 'content': content}
                     except Exception as e:
                         print(f"Не удалось прочитать файл {entry.path}: {e}")
+
+    def _iter_files(self, file_paths):
+        """Выдает записи bulk_import для списка отдельных файлов."""
+        for file_path in file_paths:
+            if file_path.lower().endswith(('.md', '.txt')):
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    content = f.read()
+                title = os.path.splitext(os.path.basename(file_path))[0]
+                yield {'type': 'note', 'parent_key': None, 'title': title, 'content': content}
     
     def import_files(self, file_paths, parent_id_in_db):
         """Импортирует список отдельных файлов."""
         try:
-            for file_path in file_paths:
-                if file_path.lower().endswith(('.md', '.txt')):
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                    title = os.path.splitext(os.path.basename(file_path))[0]
-                    self.db.create_note(parent_id_in_db, title, content)
-                    self.imported_count += 1
+            self._bulk_import(self._iter_files(file_paths), parent_id_in_db)
             QMessageBox.information(None, self.loc.get("success_title"), self.loc.get("import_success_message").format(count=self.imported_count))
             return True
         except Exception as e:
@@ -1638,19 +2085,21 @@ class TasksPanel(QWidget):
         """Вызывается после того, как пользователь перетащил задачу."""
         if self.current_list_index == -1: return
 
-        current_list = self.task_lists_cache[self.current_list_index]
-        list_id = current_list['id']
-        
-        # Собираем новый список ID в правильном порядке
-        ordered_ids = []
-        for i in range(self.task_list_widget.count()):
-            item = self.task_list_widget.item(i)
-            task_id = item.data(Qt.ItemDataRole.UserRole).get('id')
+        def task_id_at(index):
+            item = self.task_list_widget.item(index)
+            data = item.data(Qt.ItemDataRole.UserRole) if item else None
+            return data.get('id') if data else None
+
+        # row - позиция вставки до перемещения; находим, где блок оказался теперь
+        count = end - start + 1
+        new_start = row if row < start else row - count
+        after_id = task_id_at(new_start + count)
+
+        # В БД пишем только перемещенные строки: каждая встает между соседями
+        for index in range(new_start, new_start + count):
+            task_id = task_id_at(index)
             if task_id:
-                ordered_ids.append(task_id)
-        
-        # Отправляем новый порядок в базу данных
-        self.db.update_tasks_order(list_id, ordered_ids)
+                self.db.move_task(task_id, task_id_at(index - 1), after_id)
 
     def _get_templates(self):
         return self.data_manager.get_settings().get("task_templates", [])
@@ -1927,7 +2376,7 @@ class TasksPanel(QWidget):
         
         self.update_task_item_style(item)
 
-class NotesPanel(QWidget):
+class NotesPanel(QWidget, LazyNotesTreeMixin):
     tags_updated = pyqtSignal(set)
     zen_mode_requested = pyqtSignal(int)
     note_created = pyqtSignal(str)
@@ -1939,6 +2388,8 @@ class NotesPanel(QWidget):
         super().__init__()
         self.data_manager = data_manager
         self.db = data_manager.db
+        self.async_db = data_manager.async_db
+        self.note_store = data_manager.note_store
         self.loc = data_manager.loc_manager
         self.main_parent = parent
         self.is_dirty = False
@@ -2001,6 +2452,11 @@ class NotesPanel(QWidget):
 
     def _open_context_menu(self, pos):
         item = self.tree_widget.itemAt(pos)
+        if self._is_archive_item(item):
+            self._exec_archive_menu(item, self.tree_widget.viewport().mapToGlobal(pos))
+            return
+        if self._is_service_item(item):
+            item = None
         menu = self._create_themed_menu()
         
         parent_for_new_item = item if (item and item.data(0, Qt.ItemDataRole.UserRole).get('type') == 'folder') else (item.parent() if item else None)
@@ -2024,6 +2480,7 @@ class NotesPanel(QWidget):
                 menu.addAction(self.loc.get("export_note_title"), lambda: self.data_manager.export_notes(scope="note", item=item))
             menu.addSeparator()
 
+            menu.addAction(self.loc.get("archive_item_action"), lambda: self._archive_item(item))
             if item_type == 'folder':
                 menu.addAction(self.loc.get("tree_delete_folder"), lambda: self._delete_item(item))
             else:
@@ -2048,8 +2505,7 @@ class NotesPanel(QWidget):
         grandparent_item = item.parent().parent()
         new_parent_id = grandparent_item.data(0, Qt.ItemDataRole.UserRole).get('id') if grandparent_item else None
         
-        self.db.move_item(item_id, new_parent_id)
-        self.load_notes_for_popup()
+        self.note_store.move_item(item_id, new_parent_id)
 
     def _move_item_to_root(self, item):
         """Перемещает элемент в корень (делает его элементом верхнего уровня)."""
@@ -2058,8 +2514,7 @@ class NotesPanel(QWidget):
         
         item_id = item.data(0, Qt.ItemDataRole.UserRole).get('id')
         
-        self.db.move_item(item_id, None)
-        self.load_notes_for_popup()
+        self.note_store.move_item(item_id, None)
 
 
     def _create_new_item(self, item_type, parent_item_from_menu):
@@ -2081,12 +2536,19 @@ class NotesPanel(QWidget):
             if dialog.exec() == QDialog.DialogCode.Accepted:
                 name = dialog.get_text().strip()
                 if name:
-                    new_folder_id = self.db.create_folder(parent_id, name)
-                    self.load_notes_for_popup()
+                    new_folder_id = self.note_store.create_folder(parent_id, name)
                     new_item = self._find_item_by_id(new_folder_id)
                     if new_item:
                         self.tree_widget.setCurrentItem(new_item)
 
+    def _archive_item(self, item):
+        """Переносит элемент в архив из дерева MainPopup."""
+        self.save_current_note()
+        current_note_id = self.notes_editor.property("current_note_id")
+        self.note_store.archive_item(item.data(0, Qt.ItemDataRole.UserRole).get('id'))
+        if current_note_id is not None and self.note_store.get(current_note_id) is None:
+            self.clear_for_new_note(force=True)
+
     def _delete_item(self, item):
         """Удаляет элемент из дерева MainPopup."""
         item_data = item.data(0, Qt.ItemDataRole.UserRole)
@@ -2103,7 +2565,11 @@ class NotesPanel(QWidget):
 
         msg_box = QMessageBox(self)
         msg_box.setWindowTitle(self.loc.get("delete_item_confirm_title"))
-        msg_box.setText(self.loc.get("delete_item_confirm_text").format(name=display_name)) 
+        msg_text = self.loc.get("delete_item_confirm_text").format(name=display_name)
+        if item_data.get('type') == 'folder':
+            # Содержимое считается по БД: в дереве могут быть загружены не все вложенные папки
+            msg_text += "\n" + self.loc.get("delete_folder_contents").format(**self.db.count_descendants(item_id))
+        msg_box.setText(msg_text)
         msg_box.setStandardButtons(QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
         msg_box.setDefaultButton(QMessageBox.StandardButton.No)
         
@@ -2123,8 +2589,7 @@ class NotesPanel(QWidget):
             if item_id == self.notes_editor.property("current_note_id"):
                 self.clear_for_new_note(force=True)
 
-            self.db.delete_note_or_folder(item_id)
-            self.load_notes_for_popup()
+            self.note_store.delete_item(item_id)
 
             if item_data.get('type') == 'note' and parent_id is not None:
                 new_parent_item = self._find_item_by_id(parent_id)
@@ -2138,10 +2603,7 @@ class NotesPanel(QWidget):
         """Загружает только корневые заметки и папки для MainPopup."""
         active_folder_id = self.active_folder_id 
 
-        self.tree_widget.clear()
-        tree_data = self.db.get_note_tree()
-        self._populate_tree(self.tree_widget.invisibleRootItem(), tree_data)
-        self.tree_widget.expandAll()
+        self._load_tree_lazily(self.tree_widget)
 
         if active_folder_id:
             item_to_reactivate = self._find_item_by_id(active_folder_id)
@@ -2159,7 +2621,7 @@ class NotesPanel(QWidget):
                 if 'children' in node_data and node_data['children']:
                     self._populate_tree(item, node_data['children'])
             else:
-                icon_name = "pin" if node_data.get('is_pinned') else "file"
+                icon_name = "lock" if node_data.get('is_hidden') else "pin" if node_data.get('is_pinned') else "file"
                 item.setIcon(0, ThemedIconProvider.icon(icon_name, settings))
 
     def _on_tree_item_clicked(self, item, column):
@@ -2191,9 +2653,8 @@ class NotesPanel(QWidget):
         self.save_current_note()
         if not note_id: return
         
-        note_details = self.db.get_note_details(note_id)
-        if note_details:
-            content = note_details.get('content', '')
+        content = self.note_store.get_content(note_id)
+        if content is not None:
             self.notes_editor.blockSignals(True)
             self.notes_editor.setPlainText(content)
             self.notes_editor.blockSignals(False)
@@ -2242,19 +2703,14 @@ class NotesPanel(QWidget):
         title = content.split('\n', 1)[0].strip() or self.loc.get("new_note_title")
         
         if note_id:
-            self.db.update_note_content(note_id, title, content)
-            item = self._find_item_by_id(note_id)
-            if item:
-                display_title = re.sub(r'#', '', title).strip()
-                display_title = display_title[:30] + '...' if len(display_title) > 30 else display_title
-                item.setText(0, display_title)
+            # Заголовок в дереве обновит сигнал note_updated
+            self.note_store.update_note(note_id, title, content)
             
         elif content.strip():
             parent_id = self.notes_editor.property("pending_parent_id") or self.active_folder_id
-            new_id = self.db.create_note(parent_id, title, content)
+            new_id = self.note_store.create_note(parent_id, title, content)
             self.notes_editor.setProperty("current_note_id", new_id)
             
-            self.load_notes_for_popup()
             new_item = self._find_item_by_id(new_id)
             if new_item:
                 self.tree_widget.setCurrentItem(new_item)
@@ -2316,10 +2772,13 @@ class NotesPanel(QWidget):
         self.window_button.setToolTip(self.loc.get("window_button_tooltip"))
         self.preview_button.setToolTip(self.loc.get("preview_tooltip"))
         
+        # Список тегов читается в фоне и подставляется, когда готов
+        self.async_db.call('get_all_tags', on_result=self._fill_tag_filter_combo,
+                           owner=self.tag_filter_combo, key=self.tag_filter_combo)
+
+    def _fill_tag_filter_combo(self, all_tags):
         current_text = self.tag_filter_combo.currentText()
         all_tags_text = self.loc.get("all_tags_combo")
-        
-        all_tags = self.db.get_all_tags()
 
         self.tag_filter_combo.blockSignals(True)
         self.tag_filter_combo.clear()
@@ -2510,6 +2969,8 @@ class NotesPanel(QWidget):
 
     def _on_tree_item_clicked(self, item, column):
         """Обрабатывает клик по элементу в дереве."""
+        if self._is_service_item(item):
+            return
         self.save_current_note()
 
         item_data = item.data(0, Qt.ItemDataRole.UserRole)
@@ -2543,7 +3004,8 @@ class NotesPanel(QWidget):
                     return found
             return None
             
-        return find_recursive(self.tree_widget.invisibleRootItem())
+        # Элемент может быть в еще не загруженной папке - догружаем путь до него
+        return find_recursive(self.tree_widget.invisibleRootItem()) or self._reveal_item(self.tree_widget, item_id)
         
     def _rename_item(self, item):
         """Переименовывает и папку, и заметку."""
@@ -2551,15 +3013,14 @@ class NotesPanel(QWidget):
         item_id = item_data.get('id')
         
 
-        fresh_item_data = self.db.get_note_details(item_id) or item_data
-        old_name = fresh_item_data.get('title', "")
+        old_name = self.note_store.title(item_id) or item_data.get('title', "")
 
         
         new_name, ok = QInputDialog.getText(self, "Переименовать", "Новое имя:", text=old_name)
         if not ok or not new_name.strip() or new_name.strip() == old_name:
             return
 
-        self.db.rename_item(item_id, new_name.strip())
+        self.note_store.rename_item(item_id, new_name.strip())
         
         if (self.main_window.current_edit_target and
             self.main_window.current_edit_target[0] == 'note' and
@@ -2569,10 +3030,7 @@ class NotesPanel(QWidget):
             parts = content.split('\n', 1)
             new_content = new_name.strip() + ('\n' + parts[1] if len(parts) > 1 else '')
             self.main_window.notes_panel.notes_editor.setPlainText(new_content)
-            self.db.update_note_content(item_id, new_name.strip(), new_content)
-
-        self.load_tree_from_db()
-        self.select_item_by_id(item_id)
+            self.note_store.update_note(item_id, new_name.strip(), new_content)
 
     def handle_save_and_new_in_window(self):
         """Обработчик для Shift+Enter в WindowMain: сохранить и создать новую."""
@@ -2594,14 +3052,16 @@ class NotesPanel(QWidget):
         if not moved_item:
             return
 
-        moved_item_data = moved_item.data(0, Qt.ItemDataRole.UserRole)
-        moved_id = moved_item_data.get('id')
-
         new_parent_id = None
         if new_parent and new_parent != self.tree_widget.invisibleRootItem():
             new_parent_id = new_parent.data(0, Qt.ItemDataRole.UserRole).get('id')
 
-        self.db.update_item_parent_and_order(moved_id, new_parent_id, [])
+        try:
+            self._save_drop_position(moved_item, new_parent, new_parent_id)
+        except ValueError as e:
+            # Папку перетащили в ее же подпапку - возвращаем дерево к состоянию БД
+            print(f"Ошибка перемещения: {e}")
+            self.load_notes_for_popup()
 
     def _apply_filter_popup(self):
         """Применяет рекурсивный фильтр к дереву заметок в MainPopup."""
@@ -2613,10 +3073,27 @@ class NotesPanel(QWidget):
             selected_tag = ""
             
         if not search_text and not selected_tag:
-            visible_note_ids = {note['id'] for note in self.db.get_all_notes_flat()}
-        else:
-            visible_note_ids = set(self.db.search_notes(search_text, selected_tag))
-        
+            self.async_db.cancel(self.tree_widget)
+            self._filter_popup_tree({note['id'] for note in self.note_store.notes()}, search_text)
+            self._refresh_archive_node()
+            return
+
+        def on_found(rows):
+            visible_note_ids = {row['id'] for row in rows if not row.get('archived')}
+
+            def on_loaded():
+                self._filter_popup_tree(visible_note_ids, search_text)
+                self._show_found_in_archive(rows)
+            # Фильтр проверяет вложенные заметки, поэтому дерево нужно целиком
+            self._load_full_tree(self.tree_widget, on_loaded)
+
+        # Поиск идет в фоне; ответ на устаревший запрос (текст уже изменился) отбрасывается
+        include_archive = self.data_manager.get_settings().get("search_include_archive", False)
+        self.async_db.call('search_notes', search_text, selected_tag, snippets=False, include_archive=include_archive,
+                           on_result=on_found, owner=self.tree_widget, key=self.tree_widget)
+
+    def _filter_popup_tree(self, visible_note_ids, search_text):
+        """Скрывает элементы дерева, не содержащие заметок из visible_note_ids."""
         def is_item_visible(item):
             """Проверяет, должен ли элемент или его дочерние элементы быть видимыми."""
             item_data = item.data(0, Qt.ItemDataRole.UserRole)
@@ -2641,6 +3118,10 @@ class NotesPanel(QWidget):
                 
                 return False # Ни один дочерний элемент не видим
 
+            elif item_type == 'archive':
+                # Узел архива фильтруется при поиске в БД
+                return True
+
         root = self.tree_widget.invisibleRootItem()
         for i in range(root.childCount()):
             item = root.child(i)
@@ -2660,8 +3141,11 @@ class NotesPanel(QWidget):
                 item.setIcon(0, ThemedIconProvider.icon("folder", settings))
                 if 'children' in node_data and node_data['children']:
                     self._populate_tree(item, node_data['children'])
+                elif node_data.get('has_children'):
+                    # Содержимое подгрузится при раскрытии папки
+                    item.setChildIndicatorPolicy(QTreeWidgetItem.ChildIndicatorPolicy.ShowIndicator)
             else:
-                icon_name = "pin" if node_data.get('is_pinned') else "file"
+                icon_name = "lock" if node_data.get('is_hidden') else "pin" if node_data.get('is_pinned') else "file"
                 item.setIcon(0, ThemedIconProvider.icon(icon_name, settings))
     
     def _save_splitter_sizes(self, pos, index):
@@ -2684,7 +3168,7 @@ class NotesPanel(QWidget):
                 # Если папка не активна, берем родителя только что сохраненной заметки
                 saved_id = self.notes_editor.property("current_note_id")
                 if saved_id:
-                    parent_id = self.db.get_parent_id(saved_id)
+                    parent_id = self.note_store.parent_id(saved_id)
             except RuntimeError:
                 pass # На случай, если редактор был удален
         
@@ -2730,6 +3214,8 @@ class NotesPanel(QWidget):
         self.tree_widget.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
         self.tree_widget.customContextMenuRequested.connect(self._open_context_menu)
         self.tree_widget.dropped.connect(self._on_item_dropped)
+        self._connect_lazy_tree(self.tree_widget)
+        self._connect_note_store(self.tree_widget)
         tree_layout.addLayout(filter_layout)
         tree_layout.addWidget(self.tree_widget, 1)
         
@@ -2948,6 +3434,13 @@ class SettingsPanel(QWidget):
         backup_grid.addWidget(self.backup_interval_spin, 0, 1)
         backup_grid.addWidget(self.backup_max_count_label, 1, 0)
         backup_grid.addWidget(self.backup_max_count_spin, 1, 1)
+        self.archive_after_label = QLabel()
+        self.archive_after_spin = QSpinBox()
+        self.archive_after_spin.setRange(0, 120)
+        self.search_archive_check = QCheckBox()
+        backup_grid.addWidget(self.archive_after_label, 2, 0)
+        backup_grid.addWidget(self.archive_after_spin, 2, 1)
+        backup_grid.addWidget(self.search_archive_check, 3, 0, 1, 2)
         backup_grid.setColumnStretch(2, 1)
         layout.addLayout(backup_grid)
         
@@ -3202,6 +3695,8 @@ class SettingsPanel(QWidget):
         
         self.backup_interval_spin.setValue(self.settings.get("backup_interval_min", 60))
         self.backup_max_count_spin.setValue(self.settings.get("backup_max_count", 10))
+        self.archive_after_spin.setValue(self.settings.get("archive_after_months", 0))
+        self.search_archive_check.setChecked(self.settings.get("search_include_archive", False))
         
 
         current_pdf_font = self.settings.get("pdf_font_family", "Times New Roman")
@@ -3282,6 +3777,8 @@ class SettingsPanel(QWidget):
         
         self.backup_interval_spin.valueChanged.connect(self.apply_timer.start)
         self.backup_max_count_spin.valueChanged.connect(self.apply_timer.start)
+        self.archive_after_spin.valueChanged.connect(self.apply_timer.start)
+        self.search_archive_check.toggled.connect(self.apply_timer.start)
 
         self.zen_bg_type_group.buttonClicked.connect(self.apply_timer.start)
         self.zen_bg_type_group.buttonClicked.connect(self._update_zen_bg_settings_visibility)
@@ -3317,6 +3814,10 @@ class SettingsPanel(QWidget):
         self.startup_window_radio.setText(self.loc.get("startup_window_radio"))
         self.backup_interval_label.setText(self.loc.get("settings_backup_interval"))
         self.backup_max_count_label.setText(self.loc.get("settings_backup_max_count"))
+        self.archive_after_label.setText(self.loc.get("settings_archive_after"))
+        self.archive_after_spin.setSpecialValueText(self.loc.get("settings_archive_off"))
+        self.archive_after_spin.setSuffix(self.loc.get("settings_archive_months_suffix"))
+        self.search_archive_check.setText(self.loc.get("settings_search_include_archive"))
         self.create_backup_btn.setText(self.loc.get("settings_create_backup_now"))
 
         # Вкладка "Оформление"
@@ -3567,6 +4068,8 @@ class SettingsPanel(QWidget):
 
         self.settings["backup_interval_min"] = self.backup_interval_spin.value()
         self.settings["backup_max_count"] = self.backup_max_count_spin.value()
+        self.settings["archive_after_months"] = self.archive_after_spin.value()
+        self.settings["search_include_archive"] = self.search_archive_check.isChecked()
         
         self.settings["window_min_width_left"] = self.min_width_left_spin.value()
         self.settings["window_min_width_right"] = self.min_width_right_spin.value()
@@ -3860,9 +4363,7 @@ class ZenModeWindow(QWidget, ThemedMenuMixin):
         
         initial_text = ""
         if self.note_id:
-            note_details = self.db.get_note_details(self.note_id)
-            if note_details:
-                initial_text = note_details.get('content', '')
+            initial_text = data_manager.note_store.get_content(self.note_id) or ""
 
         self.pomodoro_timer = QTimer(self)
         self.pomodoro_timer.timeout.connect(self.update_pomodoro)
@@ -4530,7 +5031,7 @@ class MainPopup(QWidget, ThemedMenuMixin):
             try:
                 saved_id = self.notes_panel.notes_editor.property("current_note_id")
                 if saved_id:
-                    parent_id = self.notes_panel.db.get_parent_id(saved_id)
+                    parent_id = self.notes_panel.note_store.parent_id(saved_id)
             except RuntimeError:
                 pass
         
@@ -4922,6 +5423,10 @@ class NotesTreeWidget(QTreeWidget):
         item = self.itemAt(pos)
         drop_indicator_pos = self.dropIndicatorPosition()
 
+        if LazyNotesTreeMixin._is_archive_item(item):
+            # В архив переносят через контекстное меню, а не перетаскиванием
+            event.ignore()
+            return
         if drop_indicator_pos == QAbstractItemView.DropIndicatorPosition.OnItem:
             if not self._is_folder(item):
                 event.ignore()
@@ -5007,7 +5512,7 @@ class SmartSplitter(QSplitter):
             self.setSizes(new_sizes)
 
 
-class NotesTreeSidebar(QWidget):
+class NotesTreeSidebar(QWidget, LazyNotesTreeMixin):
     folder_selected = pyqtSignal(QTreeWidgetItem)
     note_selected = pyqtSignal(int)
     selection_cleared = pyqtSignal()
@@ -5018,7 +5523,10 @@ class NotesTreeSidebar(QWidget):
         self.main_window = main_window
         self.loc = loc_manager
         self.notes_panel = notes_panel
+        self.data_manager = main_window.data_manager
         self.db = main_window.data_manager.db
+        self.async_db = main_window.data_manager.async_db
+        self.note_store = main_window.data_manager.note_store
         self.pending_target_folder = None
         self._building = False
         self.active_folder_id = None
@@ -5035,20 +5543,43 @@ class NotesTreeSidebar(QWidget):
         self.tree.customContextMenuRequested.connect(self._open_context_menu)
         self.tree.itemSelectionChanged.connect(self._on_selection_changed)
         self.tree.dropped.connect(self._on_item_dropped)
+        self._connect_lazy_tree(self.tree)
+        self._connect_note_store(self.tree)
         layout.addWidget(self.tree, 1)
 
 
     def load_tree_from_db(self):
-        """Загружает и строит дерево из данных, полученных от DatabaseManager."""
+        """Загружает корень дерева; содержимое папок подгружается при раскрытии."""
         self._building = True
         try:
-            self.tree.clear()
-            tree_data = self.db.get_note_tree()
-            self._populate_tree(self.tree.invisibleRootItem(), tree_data)
-            self.tree.expandAll()
+            self._load_tree_lazily(self.tree)
         finally:
             self._building = False
 
+    def load_filtered_tree(self, visible_ids, found_in_archive=()):
+        """
+        Строит полное дерево, оставляя видимыми только заметки из visible_ids и их папки.
+        Дерево читается в фоне и подменяется целиком, когда данные готовы.
+        found_in_archive - найденные в архиве заметки, они показываются в узле "Архив".
+        """
+        def on_loaded():
+            self._apply_visible_ids(self.tree.invisibleRootItem(), visible_ids)
+            self._show_found_in_archive(found_in_archive)
+        self._load_full_tree(self.tree, on_loaded)
+
+    def _apply_visible_ids(self, parent_item, visible_ids):
+        any_visible = False
+        for i in range(parent_item.childCount()):
+            child = parent_item.child(i)
+            child_data = child.data(0, Qt.ItemDataRole.UserRole) or {}
+            if child_data.get('type') == 'folder':
+                is_visible = self._apply_visible_ids(child, visible_ids)
+            else:
+                is_visible = child_data.get('id') in visible_ids
+            child.setHidden(not is_visible)
+            any_visible = any_visible or is_visible
+        return any_visible
+
     def _populate_tree(self, parent_item, children_data):
         """Рекурсивно заполняет QTreeWidget данными из списка словарей."""
         settings = self.notes_panel.data_manager.get_settings()
@@ -5065,8 +5596,11 @@ class NotesTreeSidebar(QWidget):
                 item.setFlags(item.flags() | Qt.ItemFlag.ItemIsDropEnabled | Qt.ItemFlag.ItemIsDragEnabled)
                 if 'children' in node_data and node_data['children']:
                     self._populate_tree(item, node_data['children'])
+                elif node_data.get('has_children'):
+                    # Содержимое подгрузится при раскрытии папки
+                    item.setChildIndicatorPolicy(QTreeWidgetItem.ChildIndicatorPolicy.ShowIndicator)
             else: # note
-                icon_name = "pin" if node_data.get('is_pinned') else "file"
+                icon_name = "lock" if node_data.get('is_hidden') else "pin" if node_data.get('is_pinned') else "file"
                 item.setIcon(0, ThemedIconProvider.icon(icon_name, settings))
                 item.setFlags(item.flags() & ~Qt.ItemFlag.ItemIsDropEnabled | Qt.ItemFlag.ItemIsDragEnabled)
 
@@ -5091,34 +5625,21 @@ class NotesTreeSidebar(QWidget):
 
     def refresh_aliases(self):
         """Обновляет заголовки и иконки (закреплено/не закреплено) в дереве."""
-        ts_map = {}
-        
-        all_notes = self.db.get_all_notes_for_refresh()
-
-        for note in all_notes:
-            note_id = note.get("id")
-            if note_id:
-                title = note.get("title", "")
-                pinned = note.get("pinned", False)
-
-                display_title = title[:30] + '...' if len(title) > 30 else title
-                ts_map[note_id] = (display_title, pinned) 
-        
         settings = self.notes_panel.data_manager.get_settings()
-        pin_icon = ThemedIconProvider.icon("pin", settings)
-        file_icon = ThemedIconProvider.icon("file", settings)
+        icons = {name: ThemedIconProvider.icon(name, settings) for name in ("pin", "file", "lock")}
         
         def apply(parent_item):
                 for i in range(parent_item.childCount()):
                     ch = parent_item.child(i)
                     md = ch.data(0, Qt.ItemDataRole.UserRole) or {}
                     if md.get("type") == "note":
-                        note_id = md.get("id")
-                        if note_id and note_id in ts_map:
-                            display_title, pinned = ts_map[note_id]
-                            ch.setText(0, display_title)
-                            ch.setIcon(0, pin_icon if pinned else file_icon)
-                    else: # folder
+                        # Метаданные берем из NoteStore, а не из БД
+                        note = self.note_store.get(md.get("id"))
+                        if note:
+                            ch.setText(0, self._tree_item_text(note['title']))
+                            icon_name = "lock" if note['is_hidden'] else "pin" if note['is_pinned'] else "file"
+                            ch.setIcon(0, icons[icon_name])
+                    elif md.get("type") == "folder":
                         ch.setIcon(0, ThemedIconProvider.icon("folder", settings))
                         apply(ch)
                         
@@ -5131,6 +5652,11 @@ class NotesTreeSidebar(QWidget):
 
     def _open_context_menu(self, pos):
         item = self.tree.itemAt(pos)
+        if self._is_archive_item(item):
+            self._exec_archive_menu(item, self.tree.viewport().mapToGlobal(pos))
+            return
+        if self._is_service_item(item):
+            item = None
         menu = self._create_themed_menu()
         
         if item:
@@ -5150,6 +5676,7 @@ class NotesTreeSidebar(QWidget):
                 menu.addSeparator()
                 menu.addAction(self.loc.get("tree_new_folder"), lambda: self._create_folder(item))
                 menu.addAction(self.loc.get("tree_rename_folder"), lambda: self._rename_item(item))
+                menu.addAction(self.loc.get("archive_item_action"), lambda: self._archive_item(item))
                 menu.addAction(self.loc.get("tree_delete_folder"), lambda: self._delete_item(item))
                 
                 if item.parent():
@@ -5159,7 +5686,14 @@ class NotesTreeSidebar(QWidget):
                          menu.addAction(self.loc.get("move_item_to_root_title"), lambda: self._move_item_to_root(item))
             else: # note
                 menu.addAction(self.loc.get("export_note_title"), lambda: self.main_window.data_manager.export_notes(scope="note", item=item))
+                menu.addAction(self.loc.get("note_history_action"), lambda: self._show_note_history(item))
+                if self.db.can_encrypt_notes():
+                    if item_data.get('is_hidden'):
+                        menu.addAction(self.loc.get("note_decrypt_action"), lambda: self._set_note_encrypted(item, False))
+                    else:
+                        menu.addAction(self.loc.get("note_encrypt_action"), lambda: self._set_note_encrypted(item, True))
                 menu.addSeparator()
+                menu.addAction(self.loc.get("archive_item_action"), lambda: self._archive_item(item))
                 menu.addAction(self.loc.get("tree_delete_note"), lambda: self._delete_item(item))
                 
                 if item.parent():
@@ -5198,8 +5732,7 @@ class NotesTreeSidebar(QWidget):
         # --- ИСПОЛЬЗУЕМ ЗАМОК ---
         self._item_creation_lock = True
         try:
-            new_note_id = self.db.create_note(parent_id)
-            self.load_tree_from_db()
+            new_note_id = self.note_store.create_note(parent_id)
             self.select_item_by_id(new_note_id)
         finally:
             self._item_creation_lock = False
@@ -5218,8 +5751,7 @@ class NotesTreeSidebar(QWidget):
         # --- ИСПОЛЬЗУЕМ ЗАМОК ---
         self._item_creation_lock = True
         try:
-            new_folder_id = self.db.create_folder(parent_id, name.strip())
-            self.load_tree_from_db()
+            new_folder_id = self.note_store.create_folder(parent_id, name.strip())
             self.select_item_by_id(new_folder_id)
         finally:
             self._item_creation_lock = False
@@ -5237,21 +5769,47 @@ class NotesTreeSidebar(QWidget):
 
         # Для заметки обновляем и контент, так как title это часть контента
         if item_data.get('type') == 'note':
-            note_details = self.db.get_note_details(item_id)
-            self.db.update_note_content(item_id, new_name.strip(), note_details['content'])
+            self.note_store.update_note(item_id, new_name.strip(), self.note_store.get_content(item_id))
         else: # Для папки просто обновляем title
-            self.db.update_note_content(item_id, new_name.strip(), None)
+            self.note_store.update_note(item_id, new_name.strip(), None)
         
-        self.load_tree_from_db()
         self.select_item_by_id(item_id)
 
+    def _show_note_history(self, item):
+        """Открывает историю версий заметки и восстанавливает выбранную версию."""
+        note_id = item.data(0, Qt.ItemDataRole.UserRole).get('id')
+        # Несохраненный текст тоже должен попасть в историю
+        self.main_window.save_current_item()
+        self.db.flush()
+        dialog = NoteHistoryDialog(self.main_window, self.db, self.loc, note_id,
+                                   self.main_window.data_manager.get_settings())
+        if dialog.exec() and dialog.selected_revision is not None:
+            self.note_store.restore_revision(note_id, dialog.selected_revision)
+            self.main_window.edit_note(note_id)
+
+    def _set_note_encrypted(self, item, encrypted):
+        """Шифрует заметку или снимает с нее шифрование."""
+        note_id = item.data(0, Qt.ItemDataRole.UserRole).get('id')
+        self.main_window.save_current_item()
+        self.db.flush()
+        self.note_store.set_encrypted(note_id, encrypted)
+
+    def _archive_item(self, item):
+        """Переносит элемент вместе с содержимым в архив."""
+        self.main_window.save_current_item()
+        target = self.main_window.current_edit_target
+        current_note_id = target[1].data(0, Qt.ItemDataRole.UserRole).get('id') if target and target[0] == 'note' else None
+        self.note_store.archive_item(item.data(0, Qt.ItemDataRole.UserRole).get('id'))
+        if current_note_id is not None and self.note_store.get(current_note_id) is None:
+            self.main_window.current_edit_target = None
+            self.main_window.clear_editor()
+
     def _delete_item(self, item):
         """Удаляет выбранный элемент."""
         item_data = item.data(0, Qt.ItemDataRole.UserRole)
         item_id = item_data.get('id')
         
-        fresh_item_data = self.db.get_note_details(item_id) or item_data
-        item_name = fresh_item_data.get('title', "")
+        item_name = self.note_store.title(item_id) or item_data.get('title', "")
         
         display_name = item_name[:50] + '...' if len(item_name) > 50 else item_name
         msg = f"Удалить '{display_name}'?"
@@ -5259,6 +5817,7 @@ class NotesTreeSidebar(QWidget):
 
         if item_data.get('type') == 'folder':
             msg += "\nВЕСЬ контент внутри папки будет удален!"
+            msg += "\n" + self.loc.get("delete_folder_contents").format(**self.db.count_descendants(item_id))
             
         reply = QMessageBox.question(self, "Подтверждение", msg)
         if reply != QMessageBox.StandardButton.Yes: return
@@ -5271,8 +5830,7 @@ class NotesTreeSidebar(QWidget):
             self.main_window.current_edit_target = None
             self.main_window.notes_panel.clear_for_new_note(force=True)
         
-        self.db.delete_note_or_folder(item_id)
-        self.load_tree_from_db()
+        self.note_store.delete_item(item_id)
 
         if item_data.get('type') == 'note' and parent_id is not None:
             new_parent_item = self.select_item_by_id(parent_id)
@@ -5296,6 +5854,9 @@ class NotesTreeSidebar(QWidget):
             return None
 
         item_to_select = find_item(self.tree.invisibleRootItem())
+        if not item_to_select:
+            # Элемент может быть в еще не загруженной папке - догружаем путь до него
+            item_to_select = self._reveal_item(self.tree, item_id)
         if item_to_select and select:
             self.tree.setCurrentItem(item_to_select)
             self.tree.scrollToItem(item_to_select, QAbstractItemView.ScrollHint.PositionAtCenter)
@@ -5360,6 +5921,9 @@ class NotesTreeSidebar(QWidget):
             return
             
         it = items[0]
+        if self._is_service_item(it):
+            # Архивные элементы открываются по клику в отдельном окне
+            return
         if self.main_window.current_edit_target and self.main_window.current_edit_target[1] == it:
             return
 
@@ -5429,15 +5993,13 @@ class NotesTreeSidebar(QWidget):
         item_id = item.data(0, Qt.ItemDataRole.UserRole).get('id')
         grandparent_item = item.parent().parent()
         new_parent_id = grandparent_item.data(0, Qt.ItemDataRole.UserRole).get('id') if grandparent_item else None
-        self.db.move_item(item_id, new_parent_id)
-        self.load_tree_from_db()
+        self.note_store.move_item(item_id, new_parent_id)
         self.select_item_by_id(item_id)
 
     def _move_item_to_root(self, item):
         if not item or not item.parent(): return
         item_id = item.data(0, Qt.ItemDataRole.UserRole).get('id')
-        self.db.move_item(item_id, None)
-        self.load_tree_from_db()
+        self.note_store.move_item(item_id, None)
         self.select_item_by_id(item_id)
 
     def _on_item_dropped(self, moved_item, old_parent, new_parent):
@@ -5452,12 +6014,14 @@ class NotesTreeSidebar(QWidget):
         if new_parent and new_parent != self.tree.invisibleRootItem():
             new_parent_id = new_parent.data(0, Qt.ItemDataRole.UserRole).get('id')
 
-        self.db.update_item_parent_and_order(moved_id, new_parent_id, [])
-
         self._item_creation_lock = True
         try:
-            self.load_tree_from_db()
+            self._save_drop_position(moved_item, new_parent, new_parent_id)
             self.select_item_by_id(moved_id)
+        except ValueError as e:
+            # Папку перетащили в ее же подпапку - возвращаем дерево к состоянию БД
+            print(f"Ошибка перемещения: {e}")
+            self.load_tree_from_db()
         finally:
             self._item_creation_lock = False
 
@@ -5468,9 +6032,7 @@ class NotesTreeSidebar(QWidget):
         grandparent_item = item.parent().parent()
         new_parent_id = grandparent_item.data(0, Qt.ItemDataRole.UserRole).get('id') if grandparent_item else None
         
-        self.db.move_item(item_id, new_parent_id)
-        
-        self.load_tree_from_db()
+        self.note_store.move_item(item_id, new_parent_id)
         self.select_item_by_id(item_id)
 
     def _move_item_to_root(self, item):
@@ -5478,9 +6040,7 @@ class NotesTreeSidebar(QWidget):
         if not item or not item.parent(): return
         item_id = item.data(0, Qt.ItemDataRole.UserRole).get('id')
         
-        self.db.move_item(item_id, None)
-        
-        self.load_tree_from_db()
+        self.note_store.move_item(item_id, None)
         self.select_item_by_id(item_id)
 
     def _flatten_children(self, node):
@@ -5609,6 +6169,13 @@ class WindowMain(QWidget, ThemedMenuMixin):
         self.center_container.setMinimumWidth(260)
         center_layout = QVBoxLayout(self.center_container)
         center_layout.setContentsMargins(10, 10, 10, 10)
+        self.tags_container = QFrame()
+        self.tags_container.setObjectName("tagsContainer")
+        self.chips_layout = QHBoxLayout(self.tags_container)
+        self.chips_layout.setContentsMargins(6, 4, 6, 4)
+        self.chips_layout.setSpacing(4)
+        self._chip_tags = set()
+        center_layout.addWidget(self.tags_container)
         center_layout.addWidget(self.editor_stack, 1)
         
         self.right_container = QWidget()
@@ -5800,14 +6367,23 @@ class WindowMain(QWidget, ThemedMenuMixin):
         text_to_insert = self.time_chip.text()
         self._insert_text_into_editor(text_to_insert)
 
-       
-        self._update_datetime_chips() # Обновляем дату и время
-        
-        all_tags = self.data_manager.db.get_all_tags()
+    def _update_tag_chips(self):
+        """Перестраивает чипсы тегов над редактором (список тегов читается в фоне)."""
+        self.data_manager.async_db.call('get_all_tags', on_result=self._build_tag_chips,
+                                        owner=self.tags_container, key=self.tags_container)
+
+    def _build_tag_chips(self, all_tags):
+        while self.chips_layout.count():
+            layout_item = self.chips_layout.takeAt(0)
+            if widget := layout_item.widget():
+                widget.deleteLater()
+
+        self._chip_tags = set(all_tags)
+        self.tags_container.setVisible(bool(all_tags))
         
         if all_tags:
             label = QLabel(self.loc.get("tags_label"))
-            self.chips_layout.insertWidget(2, label)
+            self.chips_layout.addWidget(label)
         
         for tag in all_tags[:30]:
             chip_widget = QFrame()
@@ -5820,6 +6396,10 @@ class WindowMain(QWidget, ThemedMenuMixin):
             tag_btn.setObjectName("chipButton")
             tag_btn.setCursor(Qt.CursorShape.PointingHandCursor)
             tag_btn.clicked.connect(lambda _, t=tag: self._insert_tag_into_editor(t))
+            tag_btn.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
+            tag_btn.customContextMenuRequested.connect(
+                lambda pos, t=tag, b=tag_btn: self._show_tag_chip_menu(t, b.mapToGlobal(pos))
+            )
             
             del_btn = QToolButton()
             del_btn.setText("×")
@@ -5829,7 +6409,64 @@ class WindowMain(QWidget, ThemedMenuMixin):
 
             chip_layout.addWidget(tag_btn)
             chip_layout.addWidget(del_btn)
-            
+            self.chips_layout.addWidget(chip_widget)
+
+        self.chips_layout.addStretch()
+
+    def _show_tag_chip_menu(self, tag, global_pos):
+        menu = self._create_themed_menu()
+        menu.addAction(self.loc.get("tag_rename_action"), lambda: self._rename_tag(tag))
+        menu.addAction(self.loc.get("tag_delete_action"), lambda: self._delete_tag(tag))
+        menu.exec(global_pos)
+
+    def _rename_tag(self, tag):
+        """Переименовывает тег во всех заметках (или сливает с существующим)."""
+        db = self.data_manager.db
+        settings = self.data_manager.get_settings()
+        dialog = ThemedInputDialog(self, self.loc.get("tag_rename_title"),
+                                   self.loc.get("tag_rename_prompt").format(tag=tag), text=tag, settings=settings)
+        if dialog.exec() != QDialog.DialogCode.Accepted:
+            return
+        new_tag = dialog.get_text().strip().lstrip('#')
+        if not new_tag or new_tag == tag:
+            return
+        if not re.fullmatch(r'\w+', new_tag):
+            update_style_for_dialogs(settings)
+            QMessageBox.warning(self, self.loc.get("tag_rename_title"), self.loc.get("tag_invalid_name"))
+            return
+
+        self.save_current_item()
+        count = db.rename_tag(tag, new_tag, dry_run=True)
+        confirm_key = "tag_merge_confirm" if new_tag in db.get_all_tags() else "tag_rename_confirm"
+        update_style_for_dialogs(settings)
+        reply = QMessageBox.question(self, self.loc.get("tag_rename_title"),
+                                     self.loc.get(confirm_key).format(old=tag, new=new_tag, count=count))
+        if reply != QMessageBox.StandardButton.Yes:
+            return
+        db.rename_tag(tag, new_tag)
+        self._after_tags_rewritten()
+
+    def _delete_tag(self, tag):
+        """Удаляет тег из текста всех заметок."""
+        db = self.data_manager.db
+        self.save_current_item()
+        count = db.delete_tag(tag, dry_run=True)
+        update_style_for_dialogs(self.data_manager.get_settings())
+        reply = QMessageBox.question(self, self.loc.get("tag_delete_action"),
+                                     self.loc.get("tag_delete_confirm").format(tag=tag, count=count))
+        if reply != QMessageBox.StandardButton.Yes:
+            return
+        db.delete_tag(tag)
+        self._after_tags_rewritten()
+
+    def _after_tags_rewritten(self):
+        """Обновляет редактор, фильтр тегов и чипсы после массовой правки тегов."""
+        if self.current_edit_target and self.current_edit_target[0] == "note":
+            item_data = self.current_edit_target[1].data(0, Qt.ItemDataRole.UserRole) or {}
+            if note_id := item_data.get('id'):
+                self.edit_note(note_id)
+        self.notes_panel.retranslate_ui()
+        self._update_tag_chips()
 
     def _insert_text_into_editor(self, text):
         """Вспомогательный метод для вставки текста в текущую позицию курсора."""
@@ -5938,8 +6575,13 @@ class WindowMain(QWidget, ThemedMenuMixin):
         
         self.notes_panel.display_folder_info(item_data)
         
-        # Обновляем UI WindowMain
-        self.editor_context_label.setText(f"<b>Папка:</b> {item_data.get('title', '')}")
+        # Обновляем UI WindowMain: путь к папке и число заметок в ней (с вложенными)
+        folder_id = item_data.get('id')
+        folder_path = self._breadcrumb(folder_id, html.escape(item_data.get('title', '')))
+        notes_count = self.data_manager.db.count_descendants(folder_id)['notes']
+        self.editor_context_label.setText(
+            f"<b>Папка:</b> {folder_path} · {self.loc.get('folder_notes_count').format(count=notes_count)}"
+        )
         
         self.notes_panel.is_dirty = False
         self.set_status_saved()
@@ -5963,9 +6605,8 @@ class WindowMain(QWidget, ThemedMenuMixin):
         self.preview_button.setEnabled(True)
         self.notes_panel.save_button.setEnabled(True)
         
-        note_details = self.data_manager.db.get_note_details(note_id)
-        if note_details:
-            content = note_details.get('content', '')
+        content = self.data_manager.note_store.get_content(note_id)
+        if content is not None:
             self.notes_panel.notes_editor.blockSignals(True)
             self.notes_panel.notes_editor.setPlainText(content)
             self.notes_panel.notes_editor.blockSignals(False)
@@ -5994,9 +6635,19 @@ class WindowMain(QWidget, ThemedMenuMixin):
                 self.notes_panel.editor_stack.setCurrentIndex(0)
                 
         self.notes_panel.zen_button.setEnabled(True)
-        self.editor_context_label.setText(f"<b>{self.loc.get('note_editing', 'Редактирование заметки')}</b>")
+        context_text = f"<b>{self.loc.get('note_editing', 'Редактирование заметки')}</b>"
+        if folder_path := self._breadcrumb(note_id):
+            context_text += f" · {folder_path}"
+        self.editor_context_label.setText(context_text)
         self._update_to_task_btn_state()
 
+    def _breadcrumb(self, item_id, last=None):
+        """Путь по папкам к элементу ("Папка › Подпапка") одним запросом к БД; last - добавить в конец."""
+        parts = [html.escape(ancestor['title'] or "") for ancestor in self.data_manager.db.get_ancestors(item_id)]
+        if last:
+            parts.append(last)
+        return " › ".join(parts)
+
     def clear_editor(self):
         self.save_current_item()
         self.current_edit_target = None
@@ -6040,7 +6691,7 @@ class WindowMain(QWidget, ThemedMenuMixin):
         if not is_dirty and not force_save:
             if self.current_edit_target and self.current_edit_target[0] == 'note':
                 item_data = self.current_edit_target[1].data(0, Qt.ItemDataRole.UserRole)
-                parent_id = self.data_manager.db.get_parent_id(item_data.get('id'))
+                parent_id = self.data_manager.note_store.parent_id(item_data.get('id'))
                 self._save_lock = False
                 return item_data.get('id'), parent_id
             self._save_lock = False
@@ -6056,26 +6707,28 @@ class WindowMain(QWidget, ThemedMenuMixin):
             item_id = item_data.get('id')
             
             title = content.split('\n', 1)[0].strip() or self.loc.get("unnamed_note_title")
-            self.data_manager.db.update_note_content(item_id, title, content)
+            # Заголовок в дереве обновит сигнал note_updated
+            self.data_manager.note_store.update_note(item_id, title, content)
             
-            display_title = re.sub(r'#', '', title).strip()
-            display_title = display_title[:30] + '...' if len(display_title) > 30 else display_title
-            item.setText(0, display_title)
+            # В заметке появился новый тег - добавляем его чипс
+            if not set(re.findall(r'#(\w+)', content)) <= self._chip_tags:
+                self._update_tag_chips()
             
             saved_item_id = item_id
-            parent_id = self.data_manager.db.get_parent_id(item_id)
+            parent_id = self.data_manager.note_store.parent_id(item_id)
             
         elif self.current_edit_target is None and content.strip():
 
             title = content.split('\n', 1)[0].strip() or self.loc.get("unnamed_note_title")
             parent_id = self.tree_sidebar.active_folder_id
-            new_id = self.data_manager.db.create_note(parent_id, title, content)
+            new_id = self.data_manager.note_store.create_note(parent_id, title, content)
             
-            self.tree_sidebar.load_tree_from_db()
             new_item = self.tree_sidebar.select_item_by_id(new_id)
             if new_item:
                 self.current_edit_target = ("note", new_item)
             saved_item_id = new_id
+            if not set(re.findall(r'#(\w+)', content)) <= self._chip_tags:
+                self._update_tag_chips()
         
         self.notes_panel.is_dirty = False
         self.set_status_saved()
@@ -6291,7 +6944,8 @@ class WindowMain(QWidget, ThemedMenuMixin):
         if hasattr(self, 'to_task_btn'):
             self.to_task_btn.setText(self.loc.get("to_task_btn"))
             self.to_task_btn.setToolTip(self.loc.get("to_task_tooltip"))
-            
+
+        self._update_tag_chips()
         self.set_status_saved()
         
         
@@ -6583,18 +7237,15 @@ class WindowMain(QWidget, ThemedMenuMixin):
             self.tree_sidebar.load_tree_from_db() # Показываем все дерево
             return
             
-        # Ищем в БД и получаем ID подходящих заметок
-        visible_ids = set(self.data_manager.db.search_notes(search_text, selected_tag))
-        
-        # Перезагружаем дерево, передавая ему ID для отображения
-        self.tree_sidebar._building = True
-        try:
-            self.tree_sidebar.tree.clear()
-            tree_data = self.data_manager.db.get_note_tree()
-            self.tree_sidebar._populate_tree(self.tree_sidebar.tree.invisibleRootItem(), tree_data, visible_ids)
-            self.tree_sidebar.tree.expandAll()
-        finally:
-            self.tree_sidebar._building = False
+        # Ищем в БД (в фоне) и перезагружаем дерево, передавая ему ID для отображения.
+        # Ключ - дерево: ответ на устаревший запрос отбрасывается
+        self.data_manager.async_db.call(
+            'search_notes', search_text, selected_tag, snippets=False,
+            include_archive=self.data_manager.get_settings().get("search_include_archive", False),
+            on_result=lambda rows: self.tree_sidebar.load_filtered_tree(
+                {row['id'] for row in rows if not row.get('archived')}, [row for row in rows if row.get('archived')]),
+            owner=self.tree_sidebar.tree, key=self.tree_sidebar.tree
+        )
 
     def _align_toolbar_buttons(self):
         """Выравнивает высоту всех кнопок на главной панели инструментов."""
@@ -7291,6 +7942,7 @@ class GlobalAudioWidget(QWidget):
 
 class TriggerButton(QWidget):
     settings_changed = pyqtSignal(dict)
+    note_save_failed = pyqtSignal(list, str)  # ID заметок и текст ошибки (из потока записи БД)
     
     def __init__(self, loc_manager):
         super().__init__()
@@ -7303,6 +7955,11 @@ class TriggerButton(QWidget):
         self.button.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
 
         self.db = DatabaseManager() # Создаем экземпляр нашего менеджера БД
+        # Ошибки отложенной записи приходят из фонового потока - передаем их в GUI сигналом
+        self.db.on_write_error = self.note_save_failed.emit
+        self.note_save_failed.connect(self._on_note_save_failed)
+        self.note_store = NoteStore(self.db, self) # Метаданные заметок в памяти
+        self.async_db = AsyncDatabase(self.db, self) # Долгие чтения в фоновых потоках
         self.global_audio = GlobalAudioController(self) # Это оставляем как есть
 
         layout = QHBoxLayout(self)
@@ -7344,9 +8001,17 @@ class TriggerButton(QWidget):
         self.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
         self.customContextMenuRequested.connect(self._on_context_menu)
         
+        self.backup_store = BackupStore(BACKUP_DIR)
         self.backup_timer = QTimer(self)
         self.backup_timer.timeout.connect(self.create_backup)
         self._restart_backup_timer()
+        # Политика хранения истории версий: раз после запуска, когда UI уже готов
+        QTimer.singleShot(30000, self.db.prune_revisions)
+        # Обслуживание БД (ANALYZE, incremental_vacuum) в простое, в фоновом потоке
+        self.maintenance_timer = QTimer(self)
+        self.maintenance_timer.setSingleShot(True)
+        self.maintenance_timer.timeout.connect(self.run_maintenance)
+        self.maintenance_timer.start(MAINTENANCE_FIRST_DELAY_MS)
         
         QApplication.instance().aboutToQuit.connect(self.on_app_quit)
         self._popup_lock = False
@@ -7358,6 +8023,7 @@ class TriggerButton(QWidget):
 
         self.load_settings()
         self.loc.set_language(self.settings.get("language", "ru_RU"))
+        self._apply_db_profiling()
 
 
     def load_data_into_ui(self, container):
@@ -7383,12 +8049,39 @@ class TriggerButton(QWidget):
         if interval_ms > 0:
             self.backup_timer.start(interval_ms)
 
+    def _apply_db_profiling(self):
+        """Включает профилирование БД по скрытой настройке db_profiling_enabled."""
+        if self.settings.get("db_profiling_enabled", False):
+            self.db.set_profiling(True, slow_ms=self.settings.get("db_slow_query_ms", 50), log_path=SLOW_QUERY_LOG)
+        elif self.db.profiler.enabled:
+            self._save_db_profile()
+            self.db.set_profiling(False)
+
+    def _save_db_profile(self):
+        """Сохраняет накопленную статистику профилирования в DB_PROFILE_FILE."""
+        if not self.db.profiler.enabled:
+            return
+        try:
+            with open(DB_PROFILE_FILE, 'w', encoding='utf-8') as f:
+                json.dump(self.db.get_profile(), f, ensure_ascii=False, indent=2)
+        except OSError as e:
+            print(f"Ошибка сохранения статистики БД: {e}")
+
     def on_app_quit(self):
         container = self._choose_ui()
         if isinstance(container, WindowMain):
             container.save_current_item()
         elif isinstance(container, MainPopup):
             container.notes_panel.save_current_note()
+        # Дописываем отложенные сохранения заметок до закрытия
+        self.db.flush()
+        self.maintenance_timer.stop()
+        self.async_db.shutdown()
+        self._wait_for_backup()
+        self._wait_for_maintenance()
+        self._save_db_profile()
+        # Закрываем пул соединений: при закрытии последнего WAL сливается в файл БД
+        self.db.close()
         
     def _on_left_click(self):
         if self.db.is_password_set() and not self._unlocked:
@@ -7685,11 +8378,11 @@ class TriggerButton(QWidget):
             title = text_from_zen.split('\n', 1)[0].strip() or self.loc.get("unnamed_note_title")
             
             if note_id:
-                self.db.update_note_content(note_id, title, text_from_zen)
+                self.note_store.update_note(note_id, title, text_from_zen)
             else:
 
                 parent_id = self.last_selected_item_id
-                saved_note_id = self.db.create_note(parent_id, title, text_from_zen)
+                saved_note_id = self.note_store.create_note(parent_id, title, text_from_zen)
         
         self.show()
         
@@ -7721,10 +8414,15 @@ class TriggerButton(QWidget):
 
         
         self._restart_backup_timer()
+        self._apply_db_profiling()
         self.settings_changed.emit(self.settings)
 
     def create_backup(self, notify=False):
-       
+        """Запускает резервное копирование в фоновом потоке (BackupWorker)."""
+        if getattr(self, "_backup_worker", None):
+            print("Резервное копирование уже выполняется.")
+            return
+
         db_file = self.db.db_path
         
         if not os.path.exists(db_file):
@@ -7735,9 +8433,26 @@ class TriggerButton(QWidget):
             os.makedirs(BACKUP_DIR)
         
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_path = os.path.join(BACKUP_DIR, f"assistant_{timestamp}.db.bak")
-        try:
-            shutil.copyfile(db_file, backup_path)
+        snapshot_name = f"assistant_{timestamp}"
+        max_count = self.settings.get("backup_max_count", 10)
+
+        worker = BackupWorker(self.db, self.backup_store, snapshot_name, max_count, self)
+        self._backup_worker = worker
+        progress_dialog = None
+        if notify:
+            # Окно прогресса не модальное: редактировать заметки можно и во время копирования
+            progress_dialog = QProgressDialog(self.loc.get("backup_in_progress"), None, 0, 100,
+                                              QApplication.activeWindow() or self._choose_ui())
+            progress_dialog.setWindowTitle(self.loc.get("backup_title"))
+            progress_dialog.setWindowModality(Qt.WindowModality.NonModal)
+            progress_dialog.setMinimumDuration(300)
+            worker.progress.connect(
+                lambda copied, total: progress_dialog.setValue(int(copied * 100 / total) if total else 100)
+            )
+
+        def on_finished(path):
+            if progress_dialog:
+                progress_dialog.close()
             if notify:
                 active_window = QApplication.activeWindow() or self._choose_ui() or self
                 
@@ -7753,19 +8468,77 @@ class TriggerButton(QWidget):
             else:
                 print(self.loc.get("backup_creation_silent_success"))
 
-            # Удаление старых бэкапов
-            max_count = self.settings.get("backup_max_count", 10)
-            all_backups = sorted(glob(os.path.join(BACKUP_DIR, "assistant_*.db.bak")))
-            if len(all_backups) > max_count:
-                for old_backup in all_backups[:-max_count]:
-                    os.remove(old_backup)
-                    print(f"Удален старый бэкап: {old_backup}")
-        except Exception as e:
-            print(f"Не удалось создать резервную копию: {e}")
+        def on_failed(error):
+            if progress_dialog:
+                progress_dialog.close()
+            print(f"Не удалось создать резервную копию: {error}")
+
+        worker.backup_finished.connect(on_finished)
+        worker.backup_failed.connect(on_failed)
+        worker.finished.connect(lambda: setattr(self, "_backup_worker", None))
+        worker.finished.connect(worker.deleteLater)
+        worker.start()
+
+    def _on_note_save_failed(self, note_ids, error):
+        """
+        Сообщает, что сохранения заметок не записались. Они остаются в очереди
+        и повторяются автоматически; одно окно на все ошибки подряд.
+        """
+        titles = ", ".join(self.note_store.title(note_id) or str(note_id) for note_id in note_ids)
+        text = self.loc.get("note_save_failed_text").format(titles=titles, error=error)
+        if (msg_box := getattr(self, "_save_error_box", None)) and msg_box.isVisible():
+            msg_box.setText(text)
+            return
+        msg_box = QMessageBox(QApplication.activeWindow() or self._choose_ui() or self)
+        msg_box.setWindowTitle(self.loc.get("note_save_failed_title"))
+        msg_box.setText(text)
+        msg_box.setIcon(QMessageBox.Icon.Warning)
+        msg_box.setStyleSheet(get_global_dialog_stylesheet(self.get_settings()))
+        msg_box.setWindowModality(Qt.WindowModality.NonModal)
+        self._save_error_box = msg_box
+        msg_box.show()
+
+    def _wait_for_backup(self):
+        """Дожидается фонового бэкапа перед закрытием соединений с БД."""
+        if worker := getattr(self, "_backup_worker", None):
+            worker.wait()
+
+    def run_maintenance(self):
+        """
+        Запускает обслуживание БД в фоновом потоке (MaintenanceWorker), если
+        пользователь не работает с окнами и не идет бэкап; иначе откладывает.
+        """
+        if QApplication.activeWindow() or getattr(self, "_backup_worker", None):
+            self.maintenance_timer.start(MAINTENANCE_RETRY_MS)
+            return
+
+        worker = MaintenanceWorker(self.db, self.settings.get("archive_after_months", 0), self)
+        self._maintenance_worker = worker
+
+        def on_finished(report):
+            # Заметки, перенесенные в архив, убираются из NoteStore и деревьев
+            if report.get('archived_ids'):
+                self.note_store.archived(report['archived_ids'])
+
+        def on_failed(error):
+            print(f"Ошибка обслуживания базы данных: {error}")
+
+        worker.maintenance_finished.connect(on_finished)
+        worker.maintenance_failed.connect(on_failed)
+        worker.finished.connect(lambda: setattr(self, "_maintenance_worker", None))
+        worker.finished.connect(lambda: self.maintenance_timer.start(MAINTENANCE_INTERVAL_MS))
+        worker.finished.connect(worker.deleteLater)
+        worker.start()
+
+    def _wait_for_maintenance(self):
+        """Дожидается фонового обслуживания БД перед закрытием или заменой базы."""
+        if worker := getattr(self, "_maintenance_worker", None):
+            worker.wait()
 
     def restore_from_backup(self):
         active_window = QApplication.activeWindow() or self._choose_ui() or self
-        dialog = BackupManagerDialog(active_window, self.loc)
+        self._wait_for_backup()
+        dialog = BackupManagerDialog(active_window, self.loc, self.backup_store)
         
         dialog_style = get_global_dialog_stylesheet(self.get_settings())
 
@@ -7780,29 +8553,59 @@ class TriggerButton(QWidget):
             reply = QMessageBox.question(active_window, self.loc.get("restore_menu"), self.loc.get("backup_confirm_restore").format(date=dialog.get_date_from_filename(selected_file)))
             
             if reply == QMessageBox.StandardButton.Yes:
+                # Окна сохраняют открытые заметки при закрытии - до замены базы
+                window_was_open = bool(self.main_window and self.main_window.isVisible())
+                if self.main_popup and self.main_popup.isVisible():
+                    self.main_popup.close()
+                if window_was_open:
+                    self.main_window.close()
+
+                restored_file = None
+                restored_archive = {}
                 try:
-                    db_file = self.db.db_path
-                    if self.main_popup and self.main_popup.isVisible():
-                        self.main_popup.close()
-                    if self.main_window and self.main_window.isVisible():
-                        self.main_window.close()
-                    
-                    shutil.copyfile(selected_file, db_file)
-                    
-                    update_style_for_dialogs(self.get_settings())
-                    QMessageBox.information(active_window, self.loc.get("success_title"), self.loc.get("backup_restored_success"))
-                    QApplication.instance().exit(123)
+                    self._wait_for_backup()
+                    self._wait_for_maintenance()
+                    self.async_db.wait()
+                    if selected_file.endswith(".json"):
+                        # Снимок хранилища сначала собираем во временные файлы
+                        restored_file = self.db.db_path + ".restore"
+                        restored_archive = self.backup_store.restore_snapshot(
+                            os.path.basename(selected_file)[:-len(".json")], restored_file,
+                            {"archive": self.db.archive_path + ".restore"})
+                    # Горячая замена: база подменяется в работающем процессе
+                    self.db.restore_from(restored_file or selected_file, restored_archive.get("archive"))
+                    self.note_store.reload()
                 except Exception as e:
                     update_style_for_dialogs(self.get_settings())
                     QMessageBox.critical(active_window, self.loc.get("error_title"), self.loc.get("backup_restore_error").format(error=e))
+                    return
+                finally:
+                    for path in (restored_file, restored_archive.get("archive")):
+                        if path and os.path.exists(path):
+                            os.remove(path)
+
+                if window_was_open:
+                    # show_main_window перезагружает данные через load_data_into_ui
+                    self.show_main_window()
+                elif active_ui := self._choose_ui():
+                    self.load_data_into_ui(active_ui)
+                update_style_for_dialogs(self.get_settings())
+                QMessageBox.information(self._choose_ui() or self, self.loc.get("success_title"), self.loc.get("backup_restored_success"))
 
     def export_notes(self, scope="all", item=None):
+        """Собирает заметки для экспорта в фоне, затем предлагает формат и файл."""
+        item_data = dict(item.data(0, Qt.ItemDataRole.UserRole) or {}) if item else None
+        self.async_db.call(
+            self._collect_notes_for_export, scope, item_data,
+            on_result=lambda collected: self._export_collected_notes(scope, item_data, *collected),
+            on_error=lambda error: print(f"Ошибка сбора заметок для экспорта: {error}")
+        )
+
+    def _export_collected_notes(self, scope, item_data, has_notes, default_filename):
         from PyQt6.QtCore import QMarginsF, QSizeF
         from PyQt6.QtGui import QPageLayout, QTextOption, QPageSize
-        
-        notes_to_export, default_filename = self._collect_notes_for_export(scope, item)
 
-        if not notes_to_export:
+        if not has_notes:
             update_style_for_dialogs(self.get_settings())
             QMessageBox.information(self._choose_ui() or self, self.loc.get("export_menu"), self.loc.get("export_no_notes"))
             return
@@ -7823,19 +8626,20 @@ class TriggerButton(QWidget):
         path, _ = QFileDialog.getSaveFileName(self._choose_ui() or self, self.loc.get("export_notes_dialog_title"), default_filename, filter_str)
         if not path: return
 
-        md_content = ""
-        for note_data in notes_to_export:
-            ts = note_data.get('created_at', 'N/A')
-            text = note_data.get('content', '')
-            md_content += f"## {self.loc.get('export_note_default_filename')} {ts}\n\n"
-            md_content += f"{text}\n\n---\n\n"
-
+        def md_sections():
+            # Заметки читаются из БД потоком, в порядке created_at
+            for note_data in self._iter_notes_for_export(scope, item_data):
+                ts = note_data.get('created_at', 'N/A')
+                text = note_data.get('content') or ''
+                yield f"## {self.loc.get('export_note_default_filename')} {ts}\n\n{text}\n\n---\n\n"
 
         try:
             if file_format == 'md':
+                # Пишем по заметке, не собирая весь документ в одну строку
                 with open(path, 'w', encoding='utf-8') as f:
-                    f.write(md_content)
+                    f.writelines(md_sections())
             else: # PDF
+                md_content = "".join(md_sections())
                 style_head = generate_markdown_css(self.settings, for_pdf=True)
                 escaped_md = escape_markdown_tags(md_content)
                 html_body = markdown.markdown(escaped_md, extensions=['fenced_code', 'tables', 'nl2br'])
@@ -7870,50 +8674,57 @@ class TriggerButton(QWidget):
             update_style_for_dialogs(self.get_settings())
             QMessageBox.critical(self._choose_ui() or self, self.loc.get("error_title"), self.loc.get("export_file_error").format(error=e))
 
-    def _collect_notes_for_export(self, scope, item):
-        all_notes_map = {note['id']: note for note in self.db.get_all_notes_flat()}
-        notes_to_export = []
+    def _collect_notes_for_export(self, scope, item_data):
+        """
+        Выполняется в рабочем потоке AsyncDatabase: только чтение БД, без виджетов.
+        Возвращает (есть ли что экспортировать, имя файла по умолчанию); тексты
+        здесь не читаются - их отдает _iter_notes_for_export во время записи.
+        """
         default_filename = "export"
+        has_notes = False
 
         if scope == "all":
-            notes_to_export = list(all_notes_map.values())
+            has_notes = self._first_export_note(self.db.iter_notes(fields=('id',))) is not None
             default_filename = self.loc.get("export_all_notes_default_filename")
 
-        elif scope == "note" and item:
-            note_data = item.data(0, Qt.ItemDataRole.UserRole)
-            note_id = note_data.get("id")
-            if note_id in all_notes_map:
-                note_content_data = all_notes_map[note_id]
-                notes_to_export.append(note_content_data)
-                
-                ts = note_content_data.get("created_at")
+        elif scope == "note" and item_data:
+            note_id = item_data.get("id")
+            note_data = self._first_export_note(self.db.iter_subtree(note_id, fields=('id', 'created_at'), notes_only=True))
+            if note_data:
+                has_notes = True
+                ts = note_data.get("created_at")
                 if ts:
                     default_filename = f"{self.loc.get("export_note_default_filename")}_{ts.split(' ')[0]}"
                 else:
                     default_filename = f"{self.loc.get("export_note_default_filename")}_{note_id}"
 
-        elif scope == "folder" and item:
-            folder_data = item.data(0, Qt.ItemDataRole.UserRole)
-            default_filename = f"{self.loc.get("export_folder_default_filename")}_{folder_data.get('title', 'export')}"
-            
-            ids_in_folder = set()
-            def collect_ids(parent_item):
-                for i in range(parent_item.childCount()):
-                    child = parent_item.child(i)
-                    child_data = child.data(0, Qt.ItemDataRole.UserRole)
-                    if child_data.get("type") == "note":
-                        ids_in_folder.add(child_data.get("id"))
-                    elif child_data.get("type") == "folder":
-                        collect_ids(child)
-            collect_ids(item)
-            
-            for note_id in ids_in_folder:
-                if note_id in all_notes_map:
-                    notes_to_export.append(all_notes_map[note_id])
+        elif scope == "folder" and item_data:
+            default_filename = f"{self.loc.get("export_folder_default_filename")}_{item_data.get('title', 'export')}"
+            # Заметки папки на любой глубине - одним запросом, а не по загруженному дереву
+            has_notes = self.db.count_descendants(item_data.get("id"))['notes'] > 0
 
-        notes_to_export.sort(key=lambda x: x.get("created_at", ""), reverse=False)
-        return notes_to_export, default_filename
+        return has_notes, default_filename
 
+    @staticmethod
+    def _first_export_note(rows):
+        """Первая строка потока; поток сразу закрывается, чтобы вернуть соединение в пул."""
+        try:
+            return next(rows, None)
+        finally:
+            rows.close()
+
+    def _iter_notes_for_export(self, scope, item_data):
+        """
+        Поток экспортируемых заметок в порядке создания. Сортирует SQLite,
+        поэтому в памяти одновременно только одна пачка строк.
+        """
+        fields = ('id', 'content', 'created_at')
+        if scope == "all":
+            return self.db.iter_notes(fields=fields, by_created=True)
+        if scope in ("note", "folder") and item_data:
+            # Для заметки поддерево - она сама
+            return self.db.iter_subtree(item_data.get("id"), fields=fields, notes_only=True, by_created=True)
+        return iter(())
 
     def export_settings_file(self):
         path, _ = QFileDialog.getSaveFileName(self, self.loc.get("export_settings"), "settings_export.json", "JSON (*.json)")
@@ -7964,6 +8775,9 @@ class TriggerButton(QWidget):
         if self.zen_window and self.zen_window.isVisible(): self.zen_window.close()
         
         self.is_locking = False
+        # Окна сохранили заметки при закрытии: дожидаемся их записи на диск
+        # и забываем ключ и расшифрованные тексты заметок
+        self.db.lock()
 
         if not self.db.is_password_set():
             self.show()
@@ -7987,7 +8801,10 @@ class TriggerButton(QWidget):
         if not target_dir:
             return
         exporter = Exporter(self.db, self.loc)
-        exporter.export_to_directory(target_dir, parent_widget)
+        # Заметки читаются потоково и пишутся на диск в фоне
+        self.async_db.call(exporter.write_to_directory, target_dir,
+                           on_result=lambda exported: exporter.show_result(parent_widget, exported),
+                           on_error=lambda error: exporter.show_result(parent_widget, Exception(error)))
 
     def import_notes_from_folders(self):
         """Запускает импорт заметок из структуры папок."""
@@ -8004,7 +8821,10 @@ class TriggerButton(QWidget):
         parent_id = target_dialog.selected_parent_id
         
         importer = Importer(self.db, self.loc)
-        if importer.import_from_directory(source_dir, parent_id):
+        imported = importer.import_from_directory(source_dir, parent_id)
+        # Импорт (и создание папки в диалоге) идет мимо NoteStore
+        self.note_store.reload()
+        if imported:
             if active_ui := self._choose_ui():
                 self.load_data_into_ui(active_ui)
 
@@ -8013,9 +8833,13 @@ class TriggerButton(QWidget):
         target_dir = QFileDialog.getExistingDirectory(self, self.loc.get("select_folder_to_export"))
         if not target_dir: return
         
-        folder_data = folder_item.data(0, Qt.ItemDataRole.UserRole)
+        # Поддерево папки читается из БД: элемент дерева может быть еще не загружен
+        folder_id = folder_item.data(0, Qt.ItemDataRole.UserRole).get('id')
+        parent_widget = self._choose_ui() or self
         exporter = Exporter(self.db, self.loc)
-        exporter.export_to_directory(target_dir, single_folder_data=folder_data)
+        self.async_db.call(exporter.write_to_directory, target_dir, folder_id,
+                           on_result=lambda exported: exporter.show_result(parent_widget, exported),
+                           on_error=lambda error: exporter.show_result(parent_widget, Exception(error)))
 
     def import_files_here(self, parent_item):
         """Импортирует отдельные файлы в указанную папку."""
@@ -8026,6 +8850,7 @@ class TriggerButton(QWidget):
             
         importer = Importer(self.db, self.loc)
         if importer.import_files(files, parent_id):
+            self.note_store.reload()
             if active_ui := self._choose_ui():
                 self.load_data_into_ui(active_ui)
 
@@ -8057,10 +8882,210 @@ class TriggerButton(QWidget):
         return ( (self.main_popup and self.main_popup.isVisible()) or
                  (self.main_window and self.main_window.isVisible()) )
 
+class NoteHistoryDialog(QDialog):
+    """Список версий заметки с предпросмотром и восстановлением выбранной."""
+    def __init__(self, parent, db, loc, note_id, settings):
+        super().__init__(parent)
+        self.db = db
+        self.loc = loc
+        self.note_id = note_id
+        self.settings = settings
+        self.selected_revision = None
+        self.setWindowTitle(self.loc.get("note_history_title"))
+        self.setMinimumSize(640, 420)
+
+        layout = QVBoxLayout(self)
+        splitter = QSplitter(Qt.Orientation.Horizontal)
+        self.revision_list = QListWidget()
+        self.preview = QPlainTextEdit()
+        self.preview.setReadOnly(True)
+        splitter.addWidget(self.revision_list)
+        splitter.addWidget(self.preview)
+        splitter.setSizes([220, 420])
+
+        button_layout = QHBoxLayout()
+        self.restore_button = QPushButton(self.loc.get("note_history_restore_btn"))
+        self.close_button = QPushButton(self.loc.get("note_history_close_btn"))
+        button_layout.addStretch()
+        button_layout.addWidget(self.restore_button)
+        button_layout.addWidget(self.close_button)
+        layout.addWidget(splitter, 1)
+        layout.addLayout(button_layout)
+
+        self.restore_button.clicked.connect(self.accept)
+        self.close_button.clicked.connect(self.reject)
+        self.revision_list.currentItemChanged.connect(self._show_preview)
+
+        for revision in self.db.get_note_revisions(note_id):
+            item = QListWidgetItem(f"{self._format_date(revision['created_at'])}  {revision['title'] or ''}")
+            item.setData(Qt.ItemDataRole.UserRole, revision)
+            self.revision_list.addItem(item)
+        if self.revision_list.count():
+            self.revision_list.setCurrentRow(0)
+        else:
+            self.preview.setPlainText(self.loc.get("note_history_empty"))
+        self.restore_button.setEnabled(self.revision_list.count() > 0)
+
+        is_dark, accent, bg, text, _ = theme_colors(settings)
+        comp_bg = QColor(bg).lighter(115).name() if is_dark else QColor(bg).darker(105).name()
+        border = "#555" if is_dark else "#ced4da"
+        self.setStyleSheet(f"""
+            QDialog {{ background-color: {bg}; }} QLabel {{ color: {text}; }}
+            QListWidget, QPlainTextEdit {{ background-color: {comp_bg}; border: 1px solid {border}; color: {text}; border-radius: 4px; }}
+            QListWidget::item:selected {{ background-color: {accent}; }}
+            QPushButton {{
+                background-color: {comp_bg}; color: {text}; border: 1px solid {border};
+                padding: 6px 12px; border-radius: 4px; min-width: 80px;
+            }}
+            QPushButton:hover {{ border-color: {accent}; }}
+        """)
+
+    @staticmethod
+    def _format_date(created_at):
+        """Переводит время версии из UTC (SQLite) в местное."""
+        try:
+            dt_obj = datetime.strptime(created_at, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+            return dt_obj.astimezone().strftime("%Y-%m-%d %H:%M")
+        except (TypeError, ValueError):
+            return str(created_at)
+
+    def _show_preview(self, current, previous=None):
+        if not current:
+            return
+        revision = current.data(Qt.ItemDataRole.UserRole)
+        try:
+            content = self.db.get_note_revision(self.note_id, revision['revision'])['content']
+        except LookupError as e:
+            content = str(e)
+        self.preview.setPlainText(content)
+
+    def accept(self):
+        current = self.revision_list.currentItem()
+        if not current:
+            return
+        revision = current.data(Qt.ItemDataRole.UserRole)
+        update_style_for_dialogs(self.settings)
+        reply = QMessageBox.question(self, self.loc.get("note_history_title"),
+                                     self.loc.get("note_history_restore_confirm").format(date=self._format_date(revision['created_at'])))
+        if reply == QMessageBox.StandardButton.Yes:
+            self.selected_revision = revision['revision']
+            super().accept()
+
+
+
+class ArchivedNoteDialog(QDialog):
+    """Просмотр архивной заметки только для чтения с кнопкой возврата в дерево."""
+    def __init__(self, parent, loc, note, settings):
+        super().__init__(parent)
+        self.loc = loc
+        self.setWindowTitle(note.get('title') or self.loc.get("unnamed_note_title"))
+        self.setMinimumSize(560, 400)
+
+        layout = QVBoxLayout(self)
+        info_label = QLabel(self.loc.get("archived_note_info").format(
+            path=note.get('origin_path') or "/", date=NoteHistoryDialog._format_date(note.get('archived_at'))))
+        info_label.setWordWrap(True)
+        self.preview = QPlainTextEdit()
+        self.preview.setReadOnly(True)
+        content = note.get('content')
+        self.preview.setPlainText(content if content is not None else self.loc.get("archived_note_locked"))
+
+        button_layout = QHBoxLayout()
+        self.restore_button = QPushButton(self.loc.get("restore_from_archive_action"))
+        self.close_button = QPushButton(self.loc.get("note_history_close_btn"))
+        button_layout.addStretch()
+        button_layout.addWidget(self.restore_button)
+        button_layout.addWidget(self.close_button)
+        layout.addWidget(info_label)
+        layout.addWidget(self.preview, 1)
+        layout.addLayout(button_layout)
+
+        self.restore_button.clicked.connect(self.accept)
+        self.close_button.clicked.connect(self.reject)
+
+        is_dark, accent, bg, text, _ = theme_colors(settings)
+        comp_bg = QColor(bg).lighter(115).name() if is_dark else QColor(bg).darker(105).name()
+        border = "#555" if is_dark else "#ced4da"
+        self.setStyleSheet(f"""
+            QDialog {{ background-color: {bg}; }} QLabel {{ color: {text}; }}
+            QPlainTextEdit {{ background-color: {comp_bg}; border: 1px solid {border}; color: {text}; border-radius: 4px; }}
+            QPushButton {{
+                background-color: {comp_bg}; color: {text}; border: 1px solid {border};
+                padding: 6px 12px; border-radius: 4px; min-width: 80px;
+            }}
+            QPushButton:hover {{ border-color: {accent}; }}
+        """)
+
+class BackupWorker(QThread):
+    """
+    Снимает копию базы и архива через DatabaseManager.backup_to и backup_archive_to,
+    кладет их в хранилище BackupStore одним снимком и удаляет лишние старые снимки -
+    все вне GUI-потока.
+    """
+    progress = pyqtSignal(int, int)     # скопировано страниц, всего страниц
+    backup_finished = pyqtSignal(str)   # имя созданного снимка
+    backup_failed = pyqtSignal(str)
+
+    def __init__(self, db, store, snapshot_name, max_count, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self.store = store
+        self.snapshot_name = snapshot_name
+        self.max_count = max_count
+
+    def run(self):
+        temp_path = os.path.join(BACKUP_DIR, f"{self.snapshot_name}.db.tmp")
+        archive_temp_path = os.path.join(BACKUP_DIR, f"{self.snapshot_name}.archive.db.tmp")
+        try:
+            self.db.backup_to(temp_path, progress=self.progress.emit)
+            # Архив входит в тот же снимок: неизменный архив дает только повторные блоки
+            attachments = {"archive": archive_temp_path} if self.db.backup_archive_to(archive_temp_path) else None
+            manifest = self.store.add_snapshot(temp_path, self.snapshot_name, attachments)
+            print(f"Бэкап {self.snapshot_name}: новых блоков {manifest['new_chunks']}, "
+                  f"{manifest['new_bytes'] // 1024} КБ")
+
+            # Удаление старых снимков и неиспользуемых блоков
+            self.store.prune(self.max_count)
+            # Полные копии старого формата (*.db.bak) тоже входят в лимит
+            keep_legacy = max(self.max_count - len(self.store.list_snapshots()), 0)
+            legacy_backups = sorted(glob(os.path.join(BACKUP_DIR, "assistant_*.db.bak")))
+            for old_backup in legacy_backups[:len(legacy_backups) - keep_legacy]:
+                os.remove(old_backup)
+                print(f"Удален старый бэкап: {old_backup}")
+        except Exception as e:
+            self.backup_failed.emit(str(e))
+            return
+        finally:
+            for path in (temp_path, archive_temp_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        self.backup_finished.emit(self.snapshot_name)
+
+
+class MaintenanceWorker(QThread):
+    """Выполняет DatabaseManager.run_maintenance вне GUI-потока."""
+    maintenance_finished = pyqtSignal(dict)  # {'freed_bytes', 'file_bytes', 'full_vacuum', 'archived_ids'}
+    maintenance_failed = pyqtSignal(str)
+
+    def __init__(self, db, archive_after_months=0, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self.archive_after_months = archive_after_months
+
+    def run(self):
+        try:
+            report = self.db.run_maintenance(self.archive_after_months)
+        except Exception as e:
+            self.maintenance_failed.emit(str(e))
+            return
+        self.maintenance_finished.emit(report)
+
+
 class BackupManagerDialog(QDialog):
-    def __init__(self, parent, loc):
+    def __init__(self, parent, loc, store):
         super().__init__(parent)
         self.loc = loc
+        self.store = store
         self.setWindowTitle(self.loc.get("backup_manager_title"))
         self.setMinimumSize(400, 300)
         self.selected_backup = None
@@ -8106,7 +9131,9 @@ class BackupManagerDialog(QDialog):
             self.backup_list_widget.addItem(self.loc.get("backup_no_copies"))
             return
             
-        backups = sorted(glob(os.path.join(BACKUP_DIR, "assistant_*.db.bak")), reverse=True)
+        # Снимки хранилища (манифесты) и полные копии старого формата
+        backups = [snapshot['path'] for snapshot in self.store.list_snapshots()]
+        backups += sorted(glob(os.path.join(BACKUP_DIR, "assistant_*.db.bak")), reverse=True)
         if not backups:
             self.backup_list_widget.addItem(self.loc.get("backup_no_copies"))
             return
@@ -8119,7 +9146,7 @@ class BackupManagerDialog(QDialog):
     
     def get_date_from_filename(self, filename):
         try:
-            timestamp_str = os.path.basename(filename).replace("assistant_", "").replace(".db.bak", "")
+            timestamp_str = os.path.basename(filename).replace("assistant_", "").replace(".db.bak", "").replace(".json", "")
             dt_obj = datetime.strptime(timestamp_str, "%Y%m%d_%H%M%S")
             return dt_obj.strftime("%Y-%m-%d %H:%M:%S")
         except ValueError:
@@ -8142,7 +9169,12 @@ class BackupManagerDialog(QDialog):
         reply = QMessageBox.question(self, self.loc.get("delete_note_tooltip"), self.loc.get("backup_confirm_delete"))
         if reply == QMessageBox.StandardButton.Yes:
             try:
-                os.remove(file_path); self.populate_backups(); self.update_button_states()
+                if file_path.endswith(".json"):
+                    self.store.delete_snapshot(os.path.basename(file_path)[:-len(".json")])
+                    self.store.collect_garbage()
+                else:
+                    os.remove(file_path)
+                self.populate_backups(); self.update_button_states()
             except OSError as e: QMessageBox.critical(self, "error_title",  self.loc.get("delete_faied").format(error=e))
     
    
@@ -8166,6 +9198,7 @@ class ThemedIconProvider:
         "folder":"<svg viewBox='0 0 24 24'><path fill='{c}' d='M10 4H4a2 2 0 0 0-2 2v12a2 2 0 0 0 2 2h16a2 2 0 0 0 2-2V8a2 2 0 0 0-2-2h-8l-2-2z'/></svg>",
         "file":"<svg viewBox='0 0 24 24'><path fill='{c}' d='M14 2H6a2 2 0 0 0-2 2v16a2 2 0 0 0 2 2h12a2 2 0 0 0 2-2V8l-6-6z M13 9V3.5L18.5 9H13z'/></svg>",
         "pin":"<svg viewBox='0 0 24 24'><path fill='{c}' d='M16 12V4h1V2H7v2h1v8l-2 2v2h5.2v6h1.6v-6H18v-2l-2-2z'/></svg>",
+        "lock":"<svg viewBox='0 0 24 24'><path fill='{c}' d='M18 8h-1V6A5 5 0 0 0 7 6v2H6a2 2 0 0 0-2 2v10a2 2 0 0 0 2 2h12a2 2 0 0 0 2-2V10a2 2 0 0 0-2-2zM9 6a3 3 0 0 1 6 0v2H9V6zm3 11a2 2 0 1 1 0-4 2 2 0 0 1 0 4z'/></svg>",
         "eye":"<svg viewBox='0 0 24 24'><path fill='{c}' d='M12 4.5C7 4.5 2.73 7.61 1 12c1.73 4.39 6 7.5 11 7.5s9.27-3.11 11-7.5c-1.73-4.39-6-7.5-11-7.5zM12 17c-2.76 0-5-2.24-5-5s2.24-5 5-5 5 2.24 5 5-2.24 5-5 5zm0-8c-1.66 0-3 1.34-3 3s1.34 3 3 3 3-1.34 3-3-1.34-3-3-3z'/></svg>",
         "edit_pencil":"<svg viewBox='0 0 24 24'><path fill='{c}' d='M3 17.25V21h3.75L17.81 9.94l-3.75-3.75L3 17.25zM20.71 7.04c.39-.39.39-1.02 0-1.41l-2.34-2.34a.9959.9959 0 0 0-1.41 0l-1.83 1.83 3.75 3.75 1.83-1.83z'/></svg>",
         "minimize": "<svg viewBox='0 0 24 24'><path fill='{c}' d='M20 14H4v-4h16v4z'/></svg>",
@@ -8196,12 +9229,18 @@ def main():
         "_reset.flag"
     )
     db_file = os.path.join(os.path.dirname(flag_file), "assistant.db")
+    archive_file = os.path.join(os.path.dirname(flag_file), ARCHIVE_FILE_NAME)
 
     if os.path.exists(flag_file):
         try:
             if os.path.exists(db_file):
                 os.remove(db_file)
                 print("Файл базы данных успешно удален.")
+            # Служебные файлы WAL-режима и архив не должны пережить сброс
+            for path in (db_file + "-wal", db_file + "-shm",
+                         archive_file, archive_file + "-wal", archive_file + "-shm", archive_file + "-journal"):
+                if os.path.exists(path):
+                    os.remove(path)
             os.remove(flag_file)
             print("Файл-флаг сброса удален.")
         except Exception as e:
@@ -0,0 +1,218 @@
+# Файл: note_store.py
+
+from datetime import datetime, timezone
+
+from PyQt6.QtCore import QObject, pyqtSignal
+
+
+class NoteStore(QObject):
+    """
+    Модель чтения метаданных заметок поверх DatabaseManager.
+    Держит в памяти id, родителя, тип, заголовок, закрепление, шифрование
+    и время изменения всех заметок и папок (загружаются одним запросом),
+    поэтому виджетам не нужно спрашивать у SQLite то, что уже известно.
+    Тексты заметок в памяти не хранятся и читаются из БД по запросу.
+    Изменения дерева идут через методы хранилища: оно пишет в БД, обновляет
+    свою копию и рассылает сигналы, по которым панели обновляются точечно.
+    """
+    note_created = pyqtSignal(dict)        # Метаданные нового элемента
+    note_updated = pyqtSignal(dict)        # Новые метаданные измененного элемента
+    note_moved = pyqtSignal(dict, object)  # Метаданные с новым parent_id, старый parent_id
+    notes_deleted = pyqtSignal(list)       # ID удаленного элемента и всех его потомков
+    reloaded = pyqtSignal()                # Копия перечитана из БД целиком
+    archive_changed = pyqtSignal()         # Изменился состав холодного архива
+
+    def __init__(self, db, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self._items = {}     # id -> метаданные
+        self._children = {}  # parent_id -> set(id)
+        self.reload()
+
+    # --- Загрузка ---
+
+    def reload(self):
+        """Перечитывает метаданные из БД (после импорта, восстановления и т.п.)."""
+        self._items = {}
+        self._children = {}
+        for meta in self.db.get_notes_metadata():
+            self._add(meta)
+        self.reloaded.emit()
+
+    def _add(self, meta):
+        self._items[meta['id']] = meta
+        self._children.setdefault(meta['parent_id'], set()).add(meta['id'])
+
+    def _set_parent(self, meta, new_parent_id):
+        self._children.get(meta['parent_id'], set()).discard(meta['id'])
+        meta['parent_id'] = new_parent_id
+        self._children.setdefault(new_parent_id, set()).add(meta['id'])
+
+    @staticmethod
+    def _now():
+        """Текущее время в формате CURRENT_TIMESTAMP SQLite (UTC)."""
+        return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+    # --- Чтение ---
+
+    def get(self, item_id):
+        """Копия метаданных элемента или None."""
+        meta = self._items.get(item_id)
+        return dict(meta) if meta else None
+
+    def parent_id(self, item_id):
+        meta = self._items.get(item_id)
+        return meta['parent_id'] if meta else None
+
+    def title(self, item_id):
+        meta = self._items.get(item_id)
+        return meta['title'] if meta else None
+
+    def notes(self):
+        """Метаданные всех заметок (без папок)."""
+        return [dict(meta) for meta in self._items.values() if meta['type'] == 'note']
+
+    def children(self, parent_id):
+        """Дочерние элементы в порядке дерева (как NOTE_ORDER_SQL в БД)."""
+        items = [self._items[child_id] for child_id in self._children.get(parent_id, ())]
+        items.sort(key=self.sort_key)
+        return [dict(meta) for meta in items]
+
+    @staticmethod
+    def sort_key(meta):
+        return (not meta.get('is_pinned'), meta['type'], meta.get('order_key') or "", (meta.get('title') or "").lower())
+
+    def ancestor_ids(self, item_id):
+        """ID папок от корня до родителя элемента."""
+        ancestors = []
+        parent_id = self.parent_id(item_id)
+        while parent_id is not None and parent_id not in ancestors:
+            ancestors.append(parent_id)
+            parent_id = self.parent_id(parent_id)
+        ancestors.reverse()
+        return ancestors
+
+    def descendant_ids(self, item_id):
+        """ID всех потомков элемента (на любой глубине)."""
+        result = []
+        stack = list(self._children.get(item_id, ()))
+        while stack:
+            child_id = stack.pop()
+            result.append(child_id)
+            stack.extend(self._children.get(child_id, ()))
+        return result
+
+    def get_content(self, note_id):
+        """Текст заметки; читается из БД при каждом вызове."""
+        return self.db.get_note_content(note_id)
+
+    # --- Изменения ---
+
+    def create_note(self, parent_id, title="Новая заметка", content=""):
+        return self._created(self.db.create_note(parent_id, title, content))
+
+    def create_folder(self, parent_id, title):
+        return self._created(self.db.create_folder(parent_id, title))
+
+    def _created(self, item_id):
+        meta = self.db.get_item_metadata(item_id)
+        if meta:
+            self._add(meta)
+            self.note_created.emit(dict(meta))
+        return item_id
+
+    def update_note(self, note_id, title, content):
+        """Сохраняет заметку (отложенная запись в БД) и сразу обновляет метаданные."""
+        saved_title = self.db.update_note_content(note_id, title, content)
+        if meta := self._items.get(note_id):
+            meta['title'] = saved_title
+            meta['updated_at'] = self._now()
+            self.note_updated.emit(dict(meta))
+
+    def rename_item(self, item_id, new_title):
+        saved_title = self.db.rename_item(item_id, new_title)
+        if meta := self._items.get(item_id):
+            meta['title'] = saved_title
+            meta['updated_at'] = self._now()
+            self.note_updated.emit(dict(meta))
+        return saved_title
+
+    def set_encrypted(self, note_id, encrypted):
+        """Шифрует заметку или снимает шифрование. Возвращает результат операции БД."""
+        done = self.db.encrypt_note(note_id) if encrypted else self.db.decrypt_note(note_id)
+        if done:
+            self.refresh_item(note_id)
+        return done
+
+    def restore_revision(self, note_id, revision):
+        self.db.restore_note_revision(note_id, revision)
+        self.refresh_item(note_id)
+
+    def refresh_item(self, item_id):
+        """Перечитывает метаданные одного элемента, измененного в обход хранилища."""
+        meta = self.db.get_item_metadata(item_id)
+        if meta and item_id in self._items:
+            self._items[item_id].update(meta)
+            self.note_updated.emit(dict(meta))
+
+    def move_item(self, item_id, new_parent_id):
+        self.db.move_item(item_id, new_parent_id)
+        self._refresh_order_key(item_id)
+        self._moved(item_id, new_parent_id)
+
+    def update_item_parent_and_order(self, item_id, new_parent_id, siblings_ids):
+        self.db.update_item_parent_and_order(item_id, new_parent_id, siblings_ids)
+        self._refresh_order_key(item_id)
+        self._moved(item_id, new_parent_id)
+
+    def _refresh_order_key(self, item_id):
+        """Перечитывает order_key после перемещения (без сигнала: дерево уже на месте)."""
+        meta = self._items.get(item_id)
+        if meta and (row := self.db.get_item_metadata(item_id)):
+            meta['order_key'] = row['order_key']
+
+    def _moved(self, item_id, new_parent_id):
+        meta = self._items.get(item_id)
+        if not meta or meta['parent_id'] == new_parent_id:
+            return
+        old_parent_id = meta['parent_id']
+        self._set_parent(meta, new_parent_id)
+        self.note_moved.emit(dict(meta), old_parent_id)
+
+    def delete_item(self, item_id):
+        """Удаляет заметку или папку вместе с содержимым."""
+        # Список удаленных берется из БД (поддерево одним запросом)
+        self._forget(self.db.delete_note_or_folder(item_id))
+
+    def _forget(self, removed_ids):
+        """Убирает элементы из копии и сообщает панелям, что их больше нет в дереве."""
+        for removed_id in removed_ids:
+            meta = self._items.pop(removed_id, None)
+            if meta:
+                self._children.get(meta['parent_id'], set()).discard(removed_id)
+            self._children.pop(removed_id, None)
+        self.notes_deleted.emit(removed_ids)
+
+    # --- Архив ---
+
+    def archive_item(self, item_id):
+        """Переносит элемент вместе с поддеревом в холодный архив."""
+        self.archived(self.db.archive_items([item_id]))
+
+    def archived(self, item_ids):
+        """Учитывает перенос в архив, сделанный в обход хранилища (обслуживание базы)."""
+        if item_ids:
+            self._forget(item_ids)
+        self.archive_changed.emit()
+
+    def restore_from_archive(self, item_id):
+        """Возвращает элемент из архива в дерево. Возвращает ID восстановленных элементов."""
+        restored_ids = self.db.restore_from_archive(item_id)
+        for restored_id in restored_ids:
+            if meta := self.db.get_item_metadata(restored_id):
+                self._add(meta)
+        # Сначала убираем элемент из узла архива, затем показываем его в дереве
+        self.archive_changed.emit()
+        if restored_ids and (meta := self._items.get(restored_ids[0])):
+            self.note_created.emit(dict(meta, has_children=len(restored_ids) > 1))
+        return restored_ids
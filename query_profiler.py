@@ -0,0 +1,400 @@
+# Файл: query_profiler.py
+
+import re
+import math
+import time
+import sqlite3
+import inspect
+import logging
+import functools
+import threading
+from collections import deque
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+# --- Параметры профилирования ---
+PROFILE_SAMPLES = 2048              # Последних замеров на метод/запрос для перцентилей
+SLOW_QUERY_MS = 50                  # Порог медленного запроса по умолчанию
+SLOW_LOG_MAX_BYTES = 1024 * 1024    # Размер файла журнала медленных запросов до ротации
+SLOW_LOG_BACKUPS = 3                # Сколько старых файлов журнала хранить
+SLOW_KEEP = 100                     # Последних медленных запросов в памяти (для get_profile)
+SQL_TEXT_LIMIT = 2000               # Сколько символов SQL писать в журнал
+EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE")
+
+# Списки "(?, ?, ?)" разной длины (IN (...)) считаются одним запросом
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+
+def normalize_sql(sql):
+    """Ключ статистики запроса: SQL без лишних пробелов и с одинаковыми списками параметров."""
+    return _PLACEHOLDER_LIST.sub("(?, ...)", " ".join(sql.split()))
+
+
+def _row_count(result):
+    if result is None:
+        return 0
+    if isinstance(result, (list, tuple, dict, set)):
+        return len(result)
+    return 1
+
+
+def _percentile(ordered, fraction):
+    """Перцентиль по методу ближайшего ранга (ordered отсортирован)."""
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class _Stat:
+    """Накопленная статистика одного метода или запроса."""
+    __slots__ = ('count', 'total', 'rows', 'samples')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.rows = 0
+        self.samples = deque(maxlen=PROFILE_SAMPLES)
+
+    def add(self, elapsed, rows):
+        self.count += 1
+        self.total += elapsed
+        self.rows += rows
+        self.samples.append(elapsed)
+
+    def as_dict(self):
+        ordered = sorted(self.samples)
+        return {
+            'count': self.count,
+            'total_ms': round(self.total * 1000, 3),
+            'p50_ms': round(_percentile(ordered, 0.50) * 1000, 3),
+            'p95_ms': round(_percentile(ordered, 0.95) * 1000, 3),
+            'p99_ms': round(_percentile(ordered, 0.99) * 1000, 3),
+            'max_ms': round(ordered[-1] * 1000, 3),
+            'rows': self.rows,
+        }
+
+
+class QueryProfiler:
+    """
+    Профилировщик DatabaseManager, включается по запросу.
+    Собирает для каждого публичного метода и каждого SQL-запроса число вызовов,
+    суммарное время, p50/p95/p99 и число возвращенных строк. Запросы дольше
+    порога попадают в журнал медленных запросов (с ротацией) вместе с
+    EXPLAIN QUERY PLAN и именем вызвавшего метода.
+    Пока профилирование выключено, пул отдает обычные соединения, а методы
+    не обернуты, поэтому накладные расходы - одна проверка флага на соединение.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.slow_ms = SLOW_QUERY_MS
+        self.since = None
+        self._lock = threading.Lock()
+        self._methods = {}
+        self._statements = {}
+        self._slow = deque(maxlen=SLOW_KEEP)
+        self._local = threading.local()
+        self._instrumented = {}  # id(объекта) -> (объект, имена обернутых методов)
+        self._log = logging.getLogger(f"{__name__}.slow")
+        self._log.propagate = False
+
+    # --- Включение и отчет ---
+
+    def enable(self, slow_ms=SLOW_QUERY_MS, log_path=None):
+        """Включает сбор статистики; log_path - файл журнала медленных запросов (или None)."""
+        self.slow_ms = slow_ms
+        self._set_log_path(log_path)
+        if not self.enabled:
+            self.since = datetime.now().isoformat(timespec="seconds")
+        self.enabled = True
+
+    def disable(self):
+        """Выключает сбор (накопленная статистика сохраняется до reset())."""
+        self.enabled = False
+        self._set_log_path(None)
+
+    def reset(self):
+        with self._lock:
+            self._methods = {}
+            self._statements = {}
+            self._slow.clear()
+        self.since = datetime.now().isoformat(timespec="seconds") if self.enabled else None
+
+    def _set_log_path(self, log_path):
+        for handler in list(self._log.handlers):
+            if log_path and getattr(handler, 'baseFilename', None) == log_path:
+                return
+            self._log.removeHandler(handler)
+            handler.close()
+        if log_path:
+            handler = RotatingFileHandler(log_path, maxBytes=SLOW_LOG_MAX_BYTES, backupCount=SLOW_LOG_BACKUPS,
+                                          encoding='utf-8', delay=True)
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            self._log.addHandler(handler)
+            self._log.setLevel(logging.INFO)
+
+    def report(self, limit=None):
+        """
+        Снимок статистики: {'enabled', 'since', 'slow_ms', 'methods', 'statements', 'slow'}.
+        methods и statements отсортированы по суммарному времени (limit - сколько оставить).
+        """
+        with self._lock:
+            methods = [{'method': name, **stat.as_dict()} for name, stat in self._methods.items()]
+            statements = [{'sql': sql, **stat.as_dict()} for sql, stat in self._statements.items()]
+            slow = list(self._slow)
+        methods.sort(key=lambda item: item['total_ms'], reverse=True)
+        statements.sort(key=lambda item: item['total_ms'], reverse=True)
+        return {
+            'enabled': self.enabled,
+            'since': self.since,
+            'slow_ms': self.slow_ms,
+            'methods': methods[:limit],
+            'statements': statements[:limit],
+            'slow': slow,
+        }
+
+    # --- Запись замеров ---
+
+    def _method_stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def record_method(self, name, elapsed, rows):
+        with self._lock:
+            stat = self._methods.get(name)
+            if stat is None:
+                stat = self._methods[name] = _Stat()
+            stat.add(elapsed, rows)
+
+    def record_statement(self, con, sql, params, elapsed, rows):
+        key = normalize_sql(sql)
+        with self._lock:
+            stat = self._statements.get(key)
+            if stat is None:
+                stat = self._statements[key] = _Stat()
+            stat.add(elapsed, rows)
+        if elapsed * 1000 >= self.slow_ms:
+            self._log_slow(con, sql, params, elapsed, rows)
+
+    def _log_slow(self, con, sql, params, elapsed, rows):
+        stack = self._method_stack()
+        entry = {
+            'time': datetime.now().isoformat(timespec="seconds"),
+            'ms': round(elapsed * 1000, 3),
+            'rows': rows,
+            'method': stack[-1] if stack else None,
+            'sql': normalize_sql(sql)[:SQL_TEXT_LIMIT],
+            'plan': self.explain(con, sql, params),
+        }
+        with self._lock:
+            self._slow.append(entry)
+        if self._log.handlers:
+            lines = [f"{entry['ms']} мс, строк: {rows}, метод: {entry['method'] or '-'}", entry['sql']]
+            lines.extend(f"    {detail}" for detail in entry['plan'])
+            self._log.info("\n".join(lines))
+
+    @staticmethod
+    def explain(con, sql, params=()):
+        """План запроса (EXPLAIN QUERY PLAN) построчно; для DDL, PRAGMA и т.п. - пустой список."""
+        if not sql.lstrip().upper().startswith(EXPLAINABLE):
+            return []
+        try:
+            return [row[3] for row in con.execute("EXPLAIN QUERY PLAN " + sql, params or ()).fetchall()]
+        except (sqlite3.Error, ValueError, TypeError):
+            # Например, запрос executemany без образца параметров
+            return []
+
+    # --- Обертки ---
+
+    def wrap_connection(self, con):
+        return ProfiledConnection(con, self)
+
+    def instrument(self, obj, names):
+        """Оборачивает методы объекта (атрибутами экземпляра, класс не меняется)."""
+        if id(obj) in self._instrumented:
+            return
+        prefix = type(obj).__name__
+        for name in names:
+            setattr(obj, name, self._wrap_method(f"{prefix}.{name}", getattr(obj, name)))
+        self._instrumented[id(obj)] = (obj, tuple(names))
+
+    def uninstrument(self, obj):
+        """Снимает обертки: методы снова берутся из класса напрямую."""
+        _, names = self._instrumented.pop(id(obj), (None, ()))
+        for name in names:
+            obj.__dict__.pop(name, None)
+
+    def _wrap_method(self, name, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            stack = self._method_stack()
+            stack.append(name)
+            started = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except BaseException:
+                self.record_method(name, time.perf_counter() - started, 0)
+                raise
+            finally:
+                stack.pop()
+            elapsed = time.perf_counter() - started
+            if inspect.isgenerator(result):
+                # Генераторы (iter_notes и т.п.) замеряются по мере чтения
+                return self._wrap_generator(name, result, elapsed)
+            self.record_method(name, elapsed, _row_count(result))
+            return result
+        return wrapper
+
+    def _wrap_generator(self, name, generator, elapsed):
+        rows = 0
+        try:
+            while True:
+                stack = self._method_stack()
+                stack.append(name)
+                started = time.perf_counter()
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    break
+                finally:
+                    stack.pop()
+                    elapsed += time.perf_counter() - started
+                rows += 1
+                yield item
+        finally:
+            generator.close()
+            self.record_method(name, elapsed, rows)
+
+
+class ProfiledConnection:
+    """
+    Обертка над sqlite3.Connection на время профилирования: курсоры замеряют
+    каждый запрос, остальное (commit, backup, create_function...) передается
+    соединению как есть.
+    """
+    __slots__ = ('_con', '_profiler')
+
+    def __init__(self, con, profiler):
+        self._con = con
+        self._profiler = profiler
+
+    def cursor(self):
+        return ProfiledCursor(self._con.cursor(), self._con, self._profiler)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def executescript(self, script):
+        started = time.perf_counter()
+        cursor = self._con.executescript(script)
+        self._profiler.record_statement(self._con, script, (), time.perf_counter() - started, 0)
+        return cursor
+
+    def __enter__(self):
+        self._con.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._con.__exit__(*exc_info)
+
+    def __getattr__(self, name):
+        return getattr(self._con, name)
+
+
+class ProfiledCursor:
+    """
+    Курсор, который замеряет запрос от execute() до последней прочитанной
+    строки: время выборки складывается, а замер записывается, когда строки
+    кончились, выполнен следующий запрос или курсор закрыт.
+    """
+    __slots__ = ('_cursor', '_con', '_profiler', '_sql', '_params', '_elapsed', '_rows')
+
+    def __init__(self, cursor, con, profiler):
+        self._cursor = cursor
+        self._con = con
+        self._profiler = profiler
+        self._sql = None
+        self._params = ()
+        self._elapsed = 0.0
+        self._rows = 0
+
+    def _run(self, method, sql, params, sample):
+        self._finish()
+        started = time.perf_counter()
+        method(sql, params)
+        self._sql, self._params = sql, sample
+        self._elapsed = time.perf_counter() - started
+        self._rows = 0
+        return self
+
+    def execute(self, sql, params=()):
+        return self._run(self._cursor.execute, sql, params, params)
+
+    def executemany(self, sql, seq_of_params):
+        # Для плана достаточно первого набора параметров (если это список)
+        sample = seq_of_params[0] if isinstance(seq_of_params, (list, tuple)) and seq_of_params else ()
+        return self._run(self._cursor.executemany, sql, seq_of_params, sample)
+
+    def _finish(self):
+        if self._sql is None:
+            return
+        sql, self._sql = self._sql, None
+        try:
+            rows = self._rows if self._cursor.description is not None else max(self._cursor.rowcount, 0)
+        except sqlite3.Error:
+            rows = self._rows
+        self._profiler.record_statement(self._con, sql, self._params, self._elapsed, rows)
+        self._params = ()
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = self._cursor.fetchone()
+        self._elapsed += time.perf_counter() - started
+        if row is None:
+            self._finish()
+        else:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        size = self._cursor.arraysize if size is None else size
+        started = time.perf_counter()
+        rows = self._cursor.fetchmany(size)
+        self._elapsed += time.perf_counter() - started
+        self._rows += len(rows)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = self._cursor.fetchall()
+        self._elapsed += time.perf_counter() - started
+        self._rows += len(rows)
+        self._finish()
+        return rows
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+    def close(self):
+        self._finish()
+        self._cursor.close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)